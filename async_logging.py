@@ -0,0 +1,122 @@
+"""Logging that stays off the event loop.
+
+``configure_logging`` routes every record through a bounded queue to a
+``QueueListener`` thread, which does the formatting and the writing. On the
+calling thread a record costs a filter check and a queue put. High-volume
+INFO call sites are sampled: each site logs its first ``burst`` records per
+window in full, then only a ``sample_rate`` fraction until the window ends.
+Warnings and errors are never sampled.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import time
+
+QUEUE_SIZE = 10000  # Records waiting for the listener before new ones are dropped
+SAMPLE_WINDOW = 60  # Seconds per call site sampling window
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_STANDARD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line, including ``extra`` fields"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "site": f"{record.module}:{record.lineno}"
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Samples INFO and lower records per call site once a site exceeds ``burst`` per window
+
+    A record logged after some were sampled out carries how many in
+    ``sampled_out``.
+    """
+
+    def __init__(self, burst=20, sample_rate=0.1, window=SAMPLE_WINDOW):
+        super().__init__()
+        self.burst = burst
+        self.sample_rate = sample_rate
+        self.window = window
+        self._sites = {}  # (pathname, lineno) -> [window start, count, sampled out]
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or self.sample_rate >= 1:
+            return True
+        now = time.monotonic()
+        site = self._sites.get((record.pathname, record.lineno))
+        if site is None or now - site[0] >= self.window:
+            dropped = site[2] if site else 0
+            site = self._sites[(record.pathname, record.lineno)] = [now, 0, 0]
+        else:
+            dropped = 0
+        site[1] += 1
+        if site[1] > self.burst:
+            if random.random() >= self.sample_rate:
+                site[2] += 1
+                return False
+            dropped, site[2] = site[2], 0
+            record.sample_rate = self.sample_rate
+        if dropped:
+            record.sampled_out = dropped
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that drops records instead of blocking when the queue is full
+
+    Records are queued unformatted; the listener thread formats them.
+    """
+
+    dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(level=logging.INFO, json_output=False, burst=20, sample_rate=0.1):
+    """Send all logging through a background thread and return the listener
+
+    The listener is stopped (and the queue flushed) at interpreter exit.
+    """
+    handler = logging.StreamHandler()
+    if json_output:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    log_queue = queue.Queue(QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(burst, sample_rate))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,195 @@
+"""Incremental, compressed snapshots of the data files.
+
+A snapshot is a small manifest in ``<root>/snapshots/`` that maps each data
+file to a content-addressed object in ``<root>/objects/``. Objects are
+compressed with zstd when the ``zstandard`` package is installed, otherwise
+gzip, and a file that hasn't changed since an earlier snapshot reuses that
+snapshot's object instead of being stored again. Files are streamed in
+chunks, so memory use doesn't grow with the size of the data files.
+
+"Incremental" is per file, not per record: a file with a single changed
+record is stored again in full (compressed). With the sqlite store the
+snapshot holds one database copy, so every snapshot after a change stores
+all of the bot's documents again.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from json_store import fsync_directory, read_json, write_json
+
+CHUNK_SIZE = 1 << 20
+COMPRESSION = "zstd" if zstandard is not None else "gzip"
+_EXTENSIONS = {"zstd": ".zst", "gzip": ".gz"}
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _compress(src_path, dst, compression):
+    with open(src_path, 'rb') as src:
+        if compression == "zstd":
+            with zstandard.ZstdCompressor(level=10).stream_writer(dst, closefd=False) as writer:
+                shutil.copyfileobj(src, writer, CHUNK_SIZE)
+        else:
+            with gzip.GzipFile(fileobj=dst, mode='wb', mtime=0) as writer:
+                shutil.copyfileobj(src, writer, CHUNK_SIZE)
+
+
+def _decompress(src_path, dst, compression):
+    with open(src_path, 'rb') as src:
+        if compression == "zstd":
+            if zstandard is None:
+                raise RuntimeError("This snapshot is zstd compressed; install zstandard to restore it")
+            with zstandard.ZstdDecompressor().stream_reader(src) as reader:
+                shutil.copyfileobj(reader, dst, CHUNK_SIZE)
+        else:
+            with gzip.GzipFile(fileobj=src, mode='rb') as reader:
+                shutil.copyfileobj(reader, dst, CHUNK_SIZE)
+
+
+def _write_atomic(directory, path, write):
+    """Call ``write(f)`` on a temp file in ``directory``, fsync it and rename it to ``path``"""
+    fd, tmp_path = tempfile.mkstemp(prefix=".backup.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class BackupStore:
+    """Snapshots of a set of data files under ``root``, keeping the newest ``keep``"""
+
+    def __init__(self, root="backups", keep=10):
+        self.root = root
+        self.keep = max(1, keep)
+        self.objects_dir = os.path.join(root, "objects")
+        self.snapshots_dir = os.path.join(root, "snapshots")
+
+    def snapshot(self, paths):
+        """Snapshot the given files and return (snapshot_id, bytes newly stored)
+
+        Missing files are skipped. Old snapshots beyond the retention limit
+        and objects no snapshot refers to any more are removed afterwards.
+        """
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+
+        manifest = {"created": time.time(), "files": {}}
+        stored = 0
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            digest, size = _file_digest(path)
+            entry = {"object": digest + _EXTENSIONS[COMPRESSION], "size": size, "compression": COMPRESSION}
+
+            existing = self._find_object(digest)
+            if existing:
+                entry["object"], entry["compression"] = existing
+            else:
+                object_path = os.path.join(self.objects_dir, entry["object"])
+                _write_atomic(self.objects_dir, object_path, lambda f: _compress(path, f, COMPRESSION))
+                stored += os.path.getsize(object_path)
+            manifest["files"][path] = entry
+        fsync_directory(self.objects_dir)
+
+        snapshot_id = time.strftime("%Y%m%d_%H%M%S")
+        suffix = 1
+        while os.path.exists(self._manifest_path(snapshot_id)):
+            suffix += 1
+            snapshot_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{suffix}"
+        write_json(self._manifest_path(snapshot_id), manifest)
+
+        self.apply_retention()
+        logging.info(f"Created backup snapshot {snapshot_id} ({len(manifest['files'])} files, {stored} new bytes)")
+        return snapshot_id, stored
+
+    def list_snapshots(self):
+        """Return (snapshot_id, manifest) pairs, newest first"""
+        if not os.path.isdir(self.snapshots_dir):
+            return []
+        snapshots = []
+        for name in os.listdir(self.snapshots_dir):
+            if not name.endswith(".json"):
+                continue
+            manifest = read_json(os.path.join(self.snapshots_dir, name), {})
+            if "files" in manifest:
+                snapshots.append((name[:-len(".json")], manifest))
+        snapshots.sort(key=lambda item: item[1].get("created", 0), reverse=True)
+        return snapshots
+
+    def restore(self, snapshot_id=None, paths=None):
+        """Restore files from a snapshot (the newest if None) and return the restored paths
+
+        Each file is decompressed to a temp file and renamed over the current
+        one, so a failed restore never leaves a half-written data file.
+        """
+        snapshots = self.list_snapshots()
+        if snapshot_id is None:
+            if not snapshots:
+                raise FileNotFoundError("No backup snapshots found")
+            snapshot_id, manifest = snapshots[0]
+        else:
+            manifest = dict(snapshots).get(snapshot_id)
+            if manifest is None:
+                raise FileNotFoundError(f"Backup snapshot {snapshot_id} not found")
+
+        restored = []
+        for path, entry in manifest["files"].items():
+            if paths is not None and path not in paths:
+                continue
+            object_path = os.path.join(self.objects_dir, entry["object"])
+            directory = os.path.dirname(os.path.abspath(path))
+            _write_atomic(directory, path, lambda f: _decompress(object_path, f, entry["compression"]))
+            fsync_directory(directory)
+            restored.append(path)
+        logging.info(f"Restored {len(restored)} files from backup snapshot {snapshot_id}")
+        return restored
+
+    def apply_retention(self):
+        """Drop snapshots beyond the newest ``keep`` and objects no snapshot refers to"""
+        snapshots = self.list_snapshots()
+        for snapshot_id, _ in snapshots[self.keep:]:
+            os.remove(self._manifest_path(snapshot_id))
+
+        referenced = {entry["object"] for _, manifest in snapshots[:self.keep] for entry in manifest["files"].values()}
+        for name in os.listdir(self.objects_dir):
+            if name not in referenced and not name.startswith("."):
+                os.remove(os.path.join(self.objects_dir, name))
+
+    def _find_object(self, digest):
+        for compression, extension in _EXTENSIONS.items():
+            if os.path.exists(os.path.join(self.objects_dir, digest + extension)):
+                return digest + extension, compression
+        return None
+
+    def _manifest_path(self, snapshot_id):
+        return os.path.join(self.snapshots_dir, f"{snapshot_id}.json")
@@ -0,0 +1,127 @@
+"""Compare JSON codecs on a synthetic library.
+
+    python -m benchmarks.codec [--files 100000] [--repeat 5]
+
+Times decoding and encoding files.json, batches.json and group_stats.json
+with the standard library and with every accelerated codec that is
+installed, plus parsing files.json into records through json_codec.
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+
+import json_codec
+from records import RecordParser, FileRecord, parse_files
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+MEDIA_TYPES = ["document", "video", "audio", "photo", "animation", "voice"]
+
+
+def make_library(file_count, seed=0):
+    """Return (files, batches, group_stats) shaped like the bot's data files"""
+    rng = random.Random(seed)
+    files = {}
+    for i in range(file_count):
+        file_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        files[file_id] = {
+            "message_id": 1000 + i,
+            "custom_name": f"Episode {i} [{rng.choice(['720p', '1080p'])}]",
+            "media_type": rng.choice(MEDIA_TYPES),
+            "file_link": f"https://t.me/example_bot?start={file_id}",
+            "file_unique_id": f"AgAD{rng.getrandbits(64):x}",
+            "links_channel_msg_id": 50000 + i
+        }
+
+    file_ids = list(files)
+    batches = {}
+    for i in range(file_count // 20):
+        batch_files = rng.sample(file_ids, min(len(file_ids), rng.randint(2, 40)))
+        batches[str(uuid.UUID(int=rng.getrandbits(128)))] = {
+            "files": batch_files,
+            "date": "2025-01-01 12:00:00",
+            "total_files": len(batch_files),
+            "links_channel_msg_id": 90000 + i
+        }
+
+    group_stats = {}
+    for i in range(200):
+        group_stats[str(-1000000000000 - i)] = {
+            "total_files": rng.randint(0, 5000),
+            "total_searches": rng.randint(0, 50000),
+            "active_members": {str(rng.getrandbits(32)): rng.randint(1, 500) for _ in range(200)},
+            "search_terms": {f"term {rng.getrandbits(16)}": rng.randint(1, 300) for _ in range(100)},
+            "last_activity": "2025-01-01 12:00:00"
+        }
+    return files, batches, group_stats
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def codecs():
+    """Yield (name, loads, dumps) for every codec available"""
+    yield "json", json.loads, lambda obj: json.dumps(obj).encode()
+    if orjson is not None:
+        yield "orjson", orjson.loads, orjson.dumps
+    if msgspec is not None:
+        yield "msgspec", msgspec.json.decode, msgspec.json.encode
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=100000, help="Files in the synthetic library")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (best is reported)")
+    args = parser.parse_args(argv)
+
+    files, batches, group_stats = make_library(args.files)
+    datasets = {"files.json": files, "batches.json": batches, "group_stats.json": group_stats}
+    print(f"Synthetic library: {len(files)} files, {len(batches)} batches, {len(group_stats)} groups")
+    print(f"json_codec backend: {json_codec.BACKEND}\n")
+
+    print(f"{'file':<18}{'codec':<10}{'size':>10}{'decode ms':>12}{'encode ms':>12}")
+    baseline = {}
+    for name, data in datasets.items():
+        for codec, loads, dumps in codecs():
+            raw = dumps(data)
+            decode = best_of(args.repeat, loads, raw) * 1000
+            encode = best_of(args.repeat, dumps, data) * 1000
+            if codec == "json":
+                baseline[name] = (decode, encode)
+                speedup = ""
+            else:
+                speedup = f"   ({baseline[name][0] / decode:.1f}x / {baseline[name][1] / encode:.1f}x)"
+            print(f"{name:<18}{codec:<10}{len(raw):>10}{decode:>12.1f}{encode:>12.1f}{speedup}")
+
+    # Loading files.json into records, as JsonStore.load_records does
+    raw = json_codec.dumps(files)
+    untyped = RecordParser(FileRecord.from_dict)
+    print()
+    stdlib = best_of(args.repeat, lambda: untyped(json.loads(raw))) * 1000
+    print(f"files.json -> records, stdlib json:        {stdlib:8.1f} ms")
+    codec_time = best_of(args.repeat, lambda: untyped(json_codec.loads(raw))) * 1000
+    print(f"files.json -> records, {json_codec.BACKEND:<19} {codec_time:8.1f} ms ({stdlib / codec_time:.1f}x)")
+    if parse_files.schema:
+        typed = best_of(args.repeat, parse_files.from_bytes, raw) * 1000
+        print(f"files.json -> records, msgspec typed:      {typed:8.1f} ms ({stdlib / typed:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""A local stand-in for the Telegram Bot API, for end-to-end load tests.
+
+Point a real bot process at it with ``BOT_API_URL=http://127.0.0.1:<port>``
+and it will poll ``getUpdates`` here instead of at Telegram. Updates are
+injected with ``FakeBotAPI.inject``; every API call the bot makes is counted
+and answered after a configurable latency, optionally with flood-control
+429 errors, the way the real API would.
+
+Implemented methods: getMe, getUpdates, sendMessage, sendDocument,
+copyMessage(s), forwardMessage(s), editMessageText, deleteMessage(s),
+getChatMember, pinChatMessage and unpinChatMessage. Anything else succeeds
+with ``true``.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from urllib.parse import parse_qsl
+
+SEND_METHODS = {"sendMessage", "sendDocument", "copyMessage", "copyMessages", "forwardMessage",
+                "forwardMessages", "editMessageText"}
+
+
+class FloodControl:
+    """Telegram-style rate limits: a global messages-per-second budget and a minimum gap per chat"""
+
+    def __init__(self, global_rate=0, chat_interval=0):
+        self.global_rate = global_rate
+        self.chat_interval = chat_interval
+        self._window_start = 0.0
+        self._window_count = 0
+        self._last_send = {}
+
+    def check(self, chat_id):
+        """Return 0 if a send to ``chat_id`` may go ahead now, otherwise the seconds to retry after"""
+        now = time.monotonic()
+        if self.global_rate:
+            if now - self._window_start >= 1:
+                self._window_start, self._window_count = now, 0
+            if self._window_count >= self.global_rate:
+                return max(1, round(1 - (now - self._window_start)))
+        if self.chat_interval and chat_id is not None:
+            wait = self.chat_interval - (now - self._last_send.get(chat_id, -self.chat_interval))
+            if wait > 0:
+                return max(1, round(wait))
+            self._last_send[chat_id] = now
+        self._window_count += 1
+        return 0
+
+
+class FakeBotAPI:
+    """Bot API state: queued updates, issued message IDs and per-method statistics
+
+    ``on_send(method, chat_id)`` is called for every successful send, which is
+    how the load generator notices that a user's request was answered.
+    """
+
+    def __init__(self, latency=0.03, jitter=0.5, retry_after_rate=0.0, retry_after=1,
+                 flood=None, username="load_test_bot", seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.flood = flood or FloodControl()
+        self.username = username
+        self.on_send = None
+        self.calls = Counter()
+        self.errors = Counter()
+        self._rng = random.Random(seed)
+        self._message_ids = itertools.count(1000)
+        self._update_ids = itertools.count(1)
+        self._updates = []
+        self._updates_ready = asyncio.Event()
+
+    # ---- Updates ---- #
+
+    def make_update(self, message):
+        """Wrap a message (a dict in Bot API format) in an update with the next update_id"""
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def inject(self, message):
+        """Queue a message update for getUpdates"""
+        self._updates.append(self.make_update(message))
+        self._updates_ready.set()
+
+    def user_message(self, user_id, text):
+        """Build a private chat message from ``user_id``, marking a leading /command as such"""
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"User {user_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+            "text": text
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return message
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or 100)
+        if offset:
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._updates_ready.clear()
+            try:
+                await asyncio.wait_for(self._updates_ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    # ---- Methods ---- #
+
+    def _message(self, chat_id, **fields):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id and chat_id > 0 else "channel"}
+        }
+        message.update(fields)
+        return message
+
+    async def call(self, method, params):
+        """Answer one API call; returns (HTTP status, response body dict)"""
+        self.calls[method] += 1
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": await self._get_updates(params)}
+
+        if self.latency:
+            await asyncio.sleep(self.latency * (1 + self._rng.uniform(-self.jitter, self.jitter)))
+
+        chat_id = params.get("chat_id")
+        if method in SEND_METHODS:
+            retry_after = self.flood.check(chat_id)
+            if not retry_after and self.retry_after_rate and self._rng.random() < self.retry_after_rate:
+                retry_after = self.retry_after
+            if retry_after:
+                self.errors[method] += 1
+                return 429, {"ok": False, "error_code": 429,
+                             "description": f"Too Many Requests: retry after {retry_after}",
+                             "parameters": {"retry_after": retry_after}}
+
+        result = self._result(method, params, chat_id)
+        if method in SEND_METHODS and self.on_send:
+            self.on_send(method, chat_id)
+        return 200, {"ok": True, "result": result}
+
+    def _result(self, method, params, chat_id):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Load Test", "username": self.username,
+                    "can_join_groups": True, "can_read_all_group_messages": False,
+                    "supports_inline_queries": False}
+        if method in ("sendMessage", "editMessageText"):
+            return self._message(chat_id, text=params.get("text", ""))
+        if method == "sendDocument":
+            return self._message(chat_id, document={"file_id": "doc", "file_unique_id": "doc"})
+        if method == "forwardMessage":
+            return self._message(chat_id, text="forwarded")
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method in ("copyMessages", "forwardMessages"):
+            return [{"message_id": next(self._message_ids)} for _ in params.get("message_ids") or []]
+        if method == "getChatMember":
+            return {"status": "member", "user": {"id": params.get("user_id"), "is_bot": False, "first_name": "User"}}
+        return True
+
+    def stats(self):
+        return {"calls": dict(self.calls.most_common()), "rate_limited": dict(self.errors.most_common())}
+
+
+def _parse_params(content_type, body):
+    """Decode a Bot API request body: form fields (JSON-encoded where not plain strings) or JSON"""
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    if content_type.startswith("multipart/form-data"):
+        return _parse_multipart(content_type, body)
+    params = {}
+    for key, value in parse_qsl(body.decode(), keep_blank_values=True):
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+def _parse_multipart(content_type, body):
+    boundary = content_type.split("boundary=", 1)[-1].strip('"').encode()
+    params = {}
+    for part in body.split(b"--" + boundary):
+        headers, _, value = part.partition(b"\r\n\r\n")
+        if b'name="' not in headers or b"filename=" in headers:
+            continue  # Uploaded files aren't needed
+        name = headers.split(b'name="', 1)[1].split(b'"', 1)[0].decode()
+        value = value.rstrip(b"\r\n").decode(errors="replace")
+        try:
+            params[name] = json.loads(value)
+        except ValueError:
+            params[name] = value
+    return params
+
+
+class FakeBotAPIServer:
+    """Serves a FakeBotAPI over HTTP/1.1 at ``/bot<token>/<method>``"""
+
+    def __init__(self, api, host="127.0.0.1", port=8081):
+        self.api = api
+        self.host = host
+        self.port = port
+        self._server = None
+        self.tokens = defaultdict(int)  # Requests seen per bot token
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                path = request_line.decode("latin-1").split()[1].split("?")[0]
+                parts = path.strip("/").split("/")
+                if len(parts) == 2 and parts[0].startswith("bot"):
+                    self.tokens[parts[0][3:]] += 1
+                    status, response = await self.api.call(parts[1], _parse_params(headers.get("content-type", ""), body))
+                else:
+                    status, response = 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+
+                payload = json.dumps(response).encode()
+                reason = {200: "OK", 404: "Not Found", 429: "Too Many Requests"}.get(status, "Error")
+                writer.write(
+                    f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    return
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            pass  # Client went away, or the server is shutting down
+        finally:
+            writer.close()
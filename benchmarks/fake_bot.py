@@ -0,0 +1,201 @@
+"""In-process stand-ins for the Bot, Update and CallbackContext objects the handlers use.
+
+``FakeBot`` answers every Bot API method the bot calls after a simulated
+network latency and records each call, so a benchmark can count API calls
+per request as well as time the handler. Only the attributes the handlers
+actually read are modelled.
+"""
+import asyncio
+import itertools
+import random
+from collections import Counter
+
+
+class FakeMessage:
+    """A sent or received message; media attributes are None unless set"""
+
+    def __init__(self, bot, chat_id, message_id, text=None, document=None, caption=None):
+        self._bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+        self.caption = caption
+        self.document = document
+        self.photo = None
+        self.video = None
+        self.audio = None
+        self.animation = None
+        self.voice = None
+        self.video_note = None
+        self.sticker = None
+        self.media_group_id = None
+        self.chat = FakeChat(chat_id)
+
+    async def reply_text(self, text, **kwargs):
+        return await self._bot.send_message(chat_id=self.chat_id, text=text, **kwargs)
+
+    async def reply_document(self, document, **kwargs):
+        return await self._bot.send_document(chat_id=self.chat_id, document=document, **kwargs)
+
+    async def edit_text(self, text, **kwargs):
+        return await self._bot.edit_message_text(chat_id=self.chat_id, message_id=self.message_id, text=text, **kwargs)
+
+    async def delete(self):
+        return await self._bot.delete_message(chat_id=self.chat_id, message_id=self.message_id)
+
+
+class FakeDocument:
+    def __init__(self, file_unique_id, file_name="file.bin"):
+        self.file_unique_id = file_unique_id
+        self.file_name = file_name
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.first_name = f"User {user_id}"
+        self.username = f"user{user_id}"
+        self.is_bot = False
+
+
+class FakeChat:
+    def __init__(self, chat_id, chat_type="private"):
+        self.id = chat_id
+        self.type = chat_type
+        self.title = None if chat_type == "private" else f"Group {chat_id}"
+
+
+class FakeChatMember:
+    def __init__(self, status="member"):
+        self.status = status
+
+
+class FakeBot:
+    """Records every call and answers after ``latency`` seconds (+/- ``jitter``)"""
+
+    def __init__(self, latency=0.02, jitter=0.5, username="benchmark_bot", seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.username = username
+        self.id = 1
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+        self._rng = random.Random(seed)
+
+    async def _call(self, method):
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * (1 + self._rng.uniform(-self.jitter, self.jitter)))
+
+    def _message(self, chat_id, text=None):
+        return FakeMessage(self, chat_id, next(self._message_ids), text=text)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._call("sendMessage")
+        return self._message(chat_id, text)
+
+    async def send_document(self, chat_id, document, **kwargs):
+        await self._call("sendDocument")
+        return self._message(chat_id)
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        await self._call("copyMessage")
+        return self._message(chat_id)
+
+    async def forward_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        await self._call("forwardMessage")
+        return self._message(chat_id)
+
+    async def copy_messages(self, chat_id, from_chat_id, message_ids, **kwargs):
+        await self._call("copyMessages")
+        return [self._message(chat_id) for _ in message_ids]
+
+    async def forward_messages(self, chat_id, from_chat_id, message_ids, **kwargs):
+        await self._call("forwardMessages")
+        return [self._message(chat_id) for _ in message_ids]
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        await self._call("editMessageText")
+        return self._message(chat_id, text)
+
+    async def delete_message(self, chat_id, message_id, **kwargs):
+        await self._call("deleteMessage")
+        return True
+
+    async def delete_messages(self, chat_id, message_ids, **kwargs):
+        await self._call("deleteMessages")
+        return True
+
+    async def get_chat_member(self, chat_id, user_id, **kwargs):
+        await self._call("getChatMember")
+        return FakeChatMember()
+
+    async def pin_chat_message(self, chat_id, message_id, **kwargs):
+        await self._call("pinChatMessage")
+        return True
+
+
+class FakeJob:
+    def __init__(self, callback, when, data, name):
+        self.callback = callback
+        self.when = when
+        self.data = data
+        self.name = name
+
+    def schedule_removal(self):
+        pass
+
+
+class FakeJobQueue:
+    """Records scheduled jobs without ever running them"""
+
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when, data=None, name=None, **kwargs):
+        job = FakeJob(callback, when, data, name)
+        self.jobs.append(job)
+        return job
+
+    def run_repeating(self, callback, interval, first=None, data=None, name=None, **kwargs):
+        return self.run_once(callback, first, data, name)
+
+    def get_jobs_by_name(self, name):
+        return [job for job in self.jobs if job.name == name]
+
+
+class FakeApplication:
+    def __init__(self, bot, job_queue):
+        self.bot = bot
+        self.job_queue = job_queue
+        self.bot_data = {}
+
+    def create_task(self, coroutine, **kwargs):
+        return asyncio.get_running_loop().create_task(coroutine)
+
+
+class FakeContext:
+    def __init__(self, bot, job_queue, args=None, user_data=None):
+        self.bot = bot
+        self.job_queue = job_queue
+        self.application = FakeApplication(bot, job_queue)
+        self.bot_data = self.application.bot_data
+        self.args = args or []
+        self.user_data = user_data if user_data is not None else {}
+        self.chat_data = {}
+
+
+class FakeUpdate:
+    """A private or group message update from one user"""
+
+    _update_ids = itertools.count(1)
+
+    def __init__(self, bot, user_id, text="", chat_id=None, chat_type="private", document=None):
+        chat_id = chat_id if chat_id is not None else user_id
+        self.update_id = next(self._update_ids)
+        self.effective_user = FakeUser(user_id)
+        self.effective_chat = FakeChat(chat_id, chat_type)
+        self.message = FakeMessage(bot, chat_id, next(bot._message_ids), text=text, document=document)
+        self.message.from_user = self.effective_user
+        self.effective_message = self.message
+        self.callback_query = None
@@ -0,0 +1,184 @@
+"""Benchmark the bot's hot paths against a fake Bot API.
+
+    python -m benchmarks.handlers [--files 100000] [--requests 2000] [--concurrency 50]
+                                  [--latency 0.02] [--only send_file,search_files]
+
+Writes a synthetic library to a temporary directory, imports bot.py there
+and drives send_file (single files and batches), search_files, store_file,
+check_user_token and schedule_message_deletion with FakeBot. For each it
+reports throughput, p50/p95/p99 latency and Bot API calls per request.
+"""
+import argparse
+import asyncio
+import importlib
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+# No-op versions of the deployment-only modules bot.py imports; last, so real ones win (see stand_ins/README.md)
+sys.path.append(os.path.join(REPO_ROOT, "benchmarks", "stand_ins"))
+
+from benchmarks.fake_bot import FakeBot, FakeContext, FakeDocument, FakeJobQueue, FakeUpdate  # noqa: E402
+from benchmarks.library import write_library  # noqa: E402
+
+SCENARIOS = ["send_file", "send_batch", "search_files", "store_file", "check_user_token", "schedule_message_deletion"]
+ADMIN_ID = 999999999
+SEARCH_TERMS = ["episode", "1080p", "720p", "date:2025-01-01", "nothing matches this"]
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+
+def import_bot(data_dir, args):
+    """Import bot.py with its data files in ``data_dir`` and a benchmark configuration"""
+    os.environ.update({
+        "BOT_TOKEN": "0:benchmark",
+        "ADMINS": str(ADMIN_ID),
+        "DATABASE_CHANNEL": "-1001000000001",
+        "LINKS_CHANNEL": "-1001000000002",
+        "FORCE_SUB": "0",
+        "AUTO_DELETE": str(args.auto_delete),
+        "DELIVERY_INTERVAL": str(args.delivery_interval),
+        "TOKEN_VERIFICATION_ENABLED": "1",
+        "TOKEN_MODE": "file",
+        "LOG_LEVEL": "WARNING",
+        "METRICS_PORT": "0",
+        "TRACE_EXPORT": ""
+    })
+    os.chdir(data_dir)
+    return importlib.import_module("bot")
+
+
+async def run_scenario(call, requests, concurrency):
+    """Run ``call(i)`` for i in range(requests), at most ``concurrency`` at a time
+
+    Returns (wall seconds, sorted per-call latencies, errors).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await call(i)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return time.perf_counter() - started, sorted(latencies), errors
+
+
+async def benchmark(bot, file_ids, batch_ids, args):
+    rng = random.Random(args.seed)
+    fake_bot = FakeBot(latency=args.latency, seed=args.seed)
+    job_queue = FakeJobQueue()
+
+    def context(call_args=None, user_data=None):
+        return FakeContext(fake_bot, job_queue, call_args, user_data)
+
+    async def send_file(i):
+        file_id = rng.choice(file_ids)
+        user_id = 1 + i % args.users
+        await bot.send_file(FakeUpdate(fake_bot, user_id, f"/start {file_id}"), context([file_id]))
+
+    async def send_batch(i):
+        batch_id = rng.choice(batch_ids)
+        user_id = 1 + (i + args.requests) % args.users
+        await bot.send_file(FakeUpdate(fake_bot, user_id, f"/start {batch_id}"), context([batch_id]))
+
+    async def search_files(i):
+        terms = rng.choice(SEARCH_TERMS).split()
+        await bot.search_files(FakeUpdate(fake_bot, 1 + i % args.users, "/search " + " ".join(terms)), context(terms))
+
+    async def store_file(i):
+        update = FakeUpdate(fake_bot, ADMIN_ID, document=FakeDocument(f"bench-{args.seed}-{i}"))
+        await bot.store_file(update, context(user_data={}))
+
+    async def check_user_token(i):
+        await bot.check_user_token(1 + i % args.users)
+
+    async def schedule_message_deletion(i):
+        await bot.schedule_message_deletion(context(), 1 + i % args.users, 1000 + i, 10)
+
+    calls = {
+        "send_file": send_file,
+        "send_batch": send_batch,
+        "search_files": search_files,
+        "store_file": store_file,
+        "check_user_token": check_user_token,
+        "schedule_message_deletion": schedule_message_deletion
+    }
+
+    print(f"{'scenario':<27}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'API/req':>9}{'errors':>8}")
+    for name in args.only:
+        api_before = sum(fake_bot.calls.values())
+        wall, latencies, errors = await run_scenario(calls[name], args.requests, args.concurrency)
+        if name == "store_file":
+            # The handler returns once the upload is queued; include the ingestion backlog
+            drain_started = time.perf_counter()
+            await bot.ingestion_queue.drain()
+            print(f"  (ingestion backlog drained in {(time.perf_counter() - drain_started) * 1000:.0f} ms)")
+        api_calls = sum(fake_bot.calls.values()) - api_before
+        print(
+            f"{name:<27}{args.requests / wall:>9.0f}{percentile(latencies, 0.5) * 1000:>9.1f}"
+            f"{percentile(latencies, 0.95) * 1000:>9.1f}{percentile(latencies, 0.99) * 1000:>9.1f}"
+            f"{api_calls / args.requests:>9.2f}{errors:>8}"
+        )
+
+    await bot.json_store.drain()
+    print(f"\nBot API calls: {dict(fake_bot.calls.most_common())}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=100000, help="Files in the synthetic library (10k-1M)")
+    parser.add_argument("--users", type=int, default=10000, help="Users holding a valid token")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=50, help="Requests in flight at once")
+    parser.add_argument("--latency", type=float, default=0.02, help="Simulated Bot API latency in seconds")
+    parser.add_argument("--auto-delete", type=int, default=10, help="AUTO_DELETE minutes (0 disables)")
+    parser.add_argument("--delivery-interval", type=float, default=0,
+                        help="DELIVERY_INTERVAL seconds between sends to one user (the bot defaults to 1)")
+    parser.add_argument("--only", default=",".join(SCENARIOS), help="Comma-separated scenarios to run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary data directory")
+    args = parser.parse_args(argv)
+    args.only = [name for name in args.only.split(",") if name]
+    unknown = set(args.only) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    data_dir = tempfile.mkdtemp(prefix="bot-bench-")
+    cwd = os.getcwd()
+    try:
+        started = time.perf_counter()
+        file_ids, batch_ids = write_library(data_dir, args.files, args.users, seed=args.seed)
+        print(f"Synthetic library: {len(file_ids)} files, {len(batch_ids)} batches, {args.users} token holders "
+              f"({time.perf_counter() - started:.1f}s) in {data_dir}")
+        bot = import_bot(data_dir, args)
+        print(f"Simulated API latency {args.latency * 1000:.0f} ms, {args.requests} requests per scenario, "
+              f"concurrency {args.concurrency}\n")
+        asyncio.run(benchmark(bot, file_ids, batch_ids, args))
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""Write a synthetic bot data directory for benchmarks and load tests."""
+import os
+import random
+import time
+import uuid
+
+from benchmarks.codec import make_library
+from json_store import write_json
+
+
+def write_library(directory, file_count, users=10000, banned=100, seed=0):
+    """Fill ``directory`` with the bot's data files and return (file IDs, batch IDs)
+
+    Users 1..``users`` each hold a valid token; ``banned`` other user IDs
+    (above that range) are banned.
+    """
+    rng = random.Random(seed)
+    files, batches, group_stats = make_library(file_count, seed)
+    expiry = int(time.time()) + 7 * 86400
+    tokens = {uuid.UUID(int=rng.getrandbits(128)).hex: {"user_id": user_id, "expiry": expiry}
+              for user_id in range(1, users + 1)}
+    banned_users = [str(users + 1 + i) for i in range(banned)]
+
+    os.makedirs(directory, exist_ok=True)
+    for name, data in [
+        ("files.json", files),
+        ("batches.json", batches),
+        ("group_stats.json", group_stats),
+        ("tokens.json", tokens),
+        ("banned_users.json", banned_users),
+        ("pending_deletes.json", {}),
+        ("group_settings.json", {})
+    ]:
+        write_json(os.path.join(directory, name), data)
+    return list(files), list(batches)
@@ -0,0 +1,173 @@
+"""Load-test a running bot end to end through the fake Bot API server.
+
+    python -m benchmarks.load --data-dir /tmp/loadtest [--files 100000] [--users 5000]
+                              [--rate 100] [--duration 60] [--search-share 0.2]
+
+Writes a synthetic library to --data-dir (unless one is already there),
+starts benchmarks.fake_api on --port and waits for the bot to connect:
+
+    cd /tmp/loadtest && BOT_TOKEN=0:load ADMINS=999999999 DATABASE_CHANNEL=-1001 \\
+        BOT_API_URL=http://127.0.0.1:8081 PYTHONPATH=/path/to/benchmarks/stand_ins python /path/to/bot.py
+
+PYTHONPATH supplies no-op versions of the modules bot.py imports that are
+deployed alongside it rather than kept in this repository (see
+benchmarks/stand_ins/README.md); leave it out where the real ones exist.
+
+To load-test dispatcher.py and its workers instead, start it the same way
+with WEBHOOK_URL=http://127.0.0.1:8443/ WEBHOOK_PORT=8443 WORKERS=<n> and pass
+--webhook http://127.0.0.1:8443/; updates are then posted to the webhook
+rather than served through getUpdates.
+
+It then replays simulated users at --rate requests per second. Each one
+either opens a /start link to a random file or batch, or runs /search. A
+request's latency runs from injecting the update to the bot's answer: the
+first copied file for /start, the first message for /search.
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import time
+from collections import defaultdict
+
+import httpx
+
+import json_codec
+from benchmarks.fake_api import FakeBotAPI, FakeBotAPIServer, FloodControl
+from benchmarks.library import write_library
+from json_store import read_bytes
+
+SEARCH_TERMS = ["episode", "1080p", "720p", "date:2025-01-01", "nothing matches this"]
+# The API method that answers each kind of request
+ANSWERED_BY = {"start": {"copyMessage", "copyMessages"}, "search": {"sendMessage"}}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+
+def load_ids(data_dir):
+    files = json_codec.loads(read_bytes(os.path.join(data_dir, "files.json")) or b"{}")
+    batches = json_codec.loads(read_bytes(os.path.join(data_dir, "batches.json")) or b"{}")
+    return list(files), list(batches)
+
+
+async def run(args):
+    if not os.path.exists(os.path.join(args.data_dir, "files.json")):
+        write_library(args.data_dir, args.files, args.users, seed=args.seed)
+        print(f"Wrote a synthetic library with {args.files} files to {args.data_dir}")
+    file_ids, batch_ids = load_ids(args.data_dir)
+    start_ids = file_ids + batch_ids
+
+    api = FakeBotAPI(
+        latency=args.latency, retry_after_rate=args.retry_after_rate,
+        flood=FloodControl(args.global_rate, args.chat_interval), seed=args.seed
+    )
+    pending = {}  # user_id -> (kind, injected at)
+    latencies = defaultdict(list)
+
+    def on_send(method, chat_id):
+        request = pending.get(chat_id)
+        if request and method in ANSWERED_BY[request[0]]:
+            del pending[chat_id]
+            latencies[request[0]].append(time.perf_counter() - request[1])
+
+    api.on_send = on_send
+    server = FakeBotAPIServer(api, args.host, args.port)
+    await server.start()
+    if args.webhook:
+        print(f"Fake Bot API listening on http://{args.host}:{args.port}; waiting for the dispatcher to set its webhook...")
+        while not api.calls["setWebhook"]:
+            await asyncio.sleep(0.2)
+        webhook = httpx.AsyncClient(headers={"X-Telegram-Bot-Api-Secret-Token": args.webhook_secret},
+                                    limits=httpx.Limits(max_connections=args.webhook_connections))
+    else:
+        print(f"Fake Bot API listening on http://{args.host}:{args.port}; waiting for the bot to poll getUpdates...")
+        while not api.calls["getUpdates"]:
+            await asyncio.sleep(0.2)
+    posts = set()
+
+    rng = random.Random(args.seed)
+    users = list(range(1, args.users + 1))
+    injected = defaultdict(int)
+    started = time.perf_counter()
+    print(f"Bot connected; replaying {args.rate} requests/s for {args.duration}s")
+    for tick in range(int(args.duration * args.rate)):
+        # Keep to the schedule even if injecting falls behind
+        delay = started + tick / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        user_id = rng.choice(users)
+        if user_id in pending:
+            continue  # One request per user at a time, so every answer can be attributed
+        if rng.random() < args.search_share:
+            kind, text = "search", "/search " + rng.choice(SEARCH_TERMS)
+        else:
+            kind, text = "start", "/start " + rng.choice(start_ids)
+        pending[user_id] = (kind, time.perf_counter())
+        injected[kind] += 1
+        if args.webhook:
+            # Like Telegram, post each update on its own request without waiting for earlier ones
+            post = asyncio.create_task(webhook.post(args.webhook, json=api.make_update(api.user_message(user_id, text))))
+            posts.add(post)
+            post.add_done_callback(posts.discard)
+        else:
+            api.inject(api.user_message(user_id, text))
+    load_time = time.perf_counter() - started
+
+    # Give requests still in flight a chance to finish
+    drain_until = time.perf_counter() + args.drain
+    while pending and time.perf_counter() < drain_until:
+        await asyncio.sleep(0.2)
+    if args.webhook:
+        await asyncio.gather(*posts, return_exceptions=True)
+        await webhook.aclose()
+    await server.stop()
+
+    print(f"\n{'request':<10}{'sent':>8}{'answered':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for kind in ("start", "search"):
+        values = sorted(latencies[kind])
+        print(
+            f"{kind:<10}{injected[kind]:>8}{len(values):>10}{percentile(values, 0.5) * 1000:>10.0f}"
+            f"{percentile(values, 0.95) * 1000:>10.0f}{percentile(values, 0.99) * 1000:>10.0f}"
+        )
+    answered = sum(len(values) for values in latencies.values())
+    print(f"\nAnswered {answered} of {sum(injected.values())} requests "
+          f"({answered / load_time:.0f}/s over the {load_time:.0f}s load window), {len(pending)} unanswered")
+    stats = api.stats()
+    print(f"Bot API calls: {stats['calls']}")
+    if stats["rate_limited"]:
+        print(f"Answered with 429: {stats['rate_limited']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data-dir", required=True, help="Directory the bot runs in")
+    parser.add_argument("--files", type=int, default=100000, help="Files in a newly written library")
+    parser.add_argument("--users", type=int, default=5000, help="Simulated users (all hold valid tokens)")
+    parser.add_argument("--rate", type=float, default=100, help="Requests injected per second")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of load")
+    parser.add_argument("--search-share", type=float, default=0.2, help="Fraction of requests that are /search")
+    parser.add_argument("--drain", type=float, default=30, help="Seconds to wait for answers after the load")
+    parser.add_argument("--latency", type=float, default=0.03, help="Simulated API latency in seconds")
+    parser.add_argument("--retry-after-rate", type=float, default=0, help="Fraction of sends answered with a 429")
+    parser.add_argument("--global-rate", type=int, default=0, help="Sends per second before 429s (0: no limit)")
+    parser.add_argument("--chat-interval", type=float, default=0, help="Minimum seconds between sends to one chat")
+    parser.add_argument("--webhook", help="Post updates to this dispatcher.py webhook URL instead of getUpdates")
+    parser.add_argument("--webhook-secret", default="", help="The dispatcher's WEBHOOK_SECRET")
+    parser.add_argument("--webhook-connections", type=int, default=40, help="Concurrent webhook connections")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
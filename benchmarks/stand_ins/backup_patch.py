@@ -0,0 +1 @@
+"""Benchmark stand-in for the deployment's backup_patch module (see README.md)"""
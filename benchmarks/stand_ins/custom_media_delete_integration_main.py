@@ -0,0 +1,5 @@
+"""Benchmark stand-in for the deployment's custom_media_delete_integration_main module (see README.md)"""
+
+
+def integrate_custom_media_delete(*args, **kwargs):
+    pass
@@ -0,0 +1,13 @@
+"""Benchmark stand-in for the deployment's search_links_channel module (see README.md)
+
+The benchmarks' libraries live entirely in the local store, so the links
+channel fallback never finds anything.
+"""
+
+
+async def search_links_channel_for_file(context, file_id):
+    return None
+
+
+async def search_links_channel_for_batch(context, batch_id):
+    return None
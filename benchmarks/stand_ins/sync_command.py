@@ -0,0 +1,5 @@
+"""Benchmark stand-in for the deployment's sync_command module (see README.md)"""
+
+
+def register_sync_command(application):
+    pass
@@ -1,5 +1,5 @@
 import os
-import json
+import functools
 import logging
 import random
 import uuid
@@ -12,7 +12,25 @@ from datetime import datetime, timedelta
 from dotenv import load_dotenv, set_key
 from sync_command import register_sync_command
 from custom_media_delete_integration_main import integrate_custom_media_delete
+from delivery_scheduler import DeliveryScheduler
+from signed_tokens import sign_token, verify_signed_token, VerifiedUsers
+from ingestion import IngestionQueue, is_transient, retry_after_seconds
+import json_codec
+from json_store import JsonStore, read_bytes, write_json
+from sqlite_store import SqliteStore
+from leader import LeaderLease
+from dispatcher import run_worker
+from backups import BackupStore
+from tenants import shared
+import metrics
+import tracing
+from profiler import profile_loop
+from loop_monitor import LoopMonitor, LOOP_LAG
+from async_logging import configure_logging
+from records import FileRecord, BatchRecord, parse_files, parse_batches, parse_tokens, parse_banned_users, parse_auto_delete
+from link_records import format_file_record, pack_batch_messages, parse_link_message, merge_link_files, merge_link_batch, read_batch_files
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -21,28 +39,39 @@ from telegram.ext import (
     ContextTypes,
     CallbackContext,
     CallbackQueryHandler,
-    ConversationHandler
+    ConversationHandler,
+    PicklePersistence,
+    PersistenceInput
 )
 
 
 # Import search functions for links channel
 from search_links_channel import search_links_channel_for_file, search_links_channel_for_batch
 
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
-logger = logging.getLogger(__name__)
-
-# Environment file path
-ENV_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
+# Environment file path (tenants.py points each bot at its own)
+ENV_FILE = os.getenv("ENV_FILE") or os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
 
 # Load environment variables
 load_dotenv(ENV_FILE)
 
+# This bot's settings as loaded; /customize and /tokentoggle keep it in step with ENV_FILE
+bot_env = dict(os.environ)
+
+# Configure logging; records are formatted and written on a background thread
+log_listener = shared("log_listener", lambda: configure_logging(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    json_output=os.getenv("LOG_FORMAT", "text") == "json",  # "json" for one structured object per line
+    burst=int(os.getenv("LOG_SAMPLE_BURST", 20)),  # INFO records per call site per minute logged in full
+    sample_rate=float(os.getenv("LOG_SAMPLE_RATE", 0.1))  # Fraction of INFO records kept past the burst (1 disables sampling)
+))
+logger = logging.getLogger(__name__)
+
 # Configuration
 TOKEN = os.getenv("BOT_TOKEN")
+TENANT = os.getenv("TENANT", "")  # Set by tenants.py when several bots share this process
+DATA_DIR = os.getenv("DATA_DIR", "")  # Directory for this bot's data files (each tenant has its own)
+API_POOL_SIZE = int(os.getenv("API_POOL_SIZE", 256))  # Bot API connections, shared by every bot in the process
+BOT_API_URL = os.getenv("BOT_API_URL", "https://api.telegram.org").rstrip("/")  # Bot API server (e.g. a local one or benchmarks.load)
 ADMINS = [int(id) for id in os.getenv("ADMINS", "").split(",") if id]
 OWNER_ID = int(os.getenv("ADMINS", "0").split(",")[0]) if os.getenv("ADMINS") else 0
 DATABASE_CHANNEL = int(os.getenv("DATABASE_CHANNEL", 0))
@@ -53,21 +82,53 @@ TOKEN_DURATION = int(os.getenv("TOKEN_DURATION", 24))  # Token duration in hours
 RENAME_TEMPLATE = os.getenv("RENAME_TEMPLATE", "")
 GET_TOKEN = os.getenv("GET_TOKEN", "")  # URL for the Get Token button
 TOKEN_VERIFICATION_ENABLED = os.getenv("TOKEN_VERIFICATION_ENABLED", "1") == "1"  # Token verification toggle
+TOKEN_MODE = os.getenv("TOKEN_MODE", "file")  # "file" (tokens.json) or "signed" (stateless HMAC tokens)
+TOKEN_SECRET = os.getenv("TOKEN_SECRET", "")  # HMAC secret for signed tokens, shared by all bot processes
+TOKEN_DIGEST_INTERVAL = int(os.getenv("TOKEN_DIGEST_INTERVAL", 300))  # Seconds between new-token digests to admins
+MAINTENANCE_INTERVAL = int(os.getenv("MAINTENANCE_INTERVAL", 6))  # Hours between data store compactions
+MAX_SEARCH_TERMS = int(os.getenv("MAX_SEARCH_TERMS", 0))  # Search terms kept per group by compaction, most frequent first (0 keeps all; /groupstats loses the rest)
+ALBUM_WINDOW = float(os.getenv("ALBUM_WINDOW", 1.5))  # Seconds to wait for the rest of an album
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 4))  # Background workers storing uploaded files
+DELIVERY_CONCURRENCY = int(os.getenv("DELIVERY_CONCURRENCY", 20))  # Max file sends in flight across all users
+DELIVERY_PER_USER = int(os.getenv("DELIVERY_PER_USER", 1))  # Max file sends in flight per user
+DELIVERY_INTERVAL = float(os.getenv("DELIVERY_INTERVAL", 1))  # Seconds between sends to the same user
+REINDEX_RATE = float(os.getenv("REINDEX_RATE", 1))  # Links channel messages read per second by /reindex (each is forwarded into one chat, which Telegram paces at ~1/s)
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", 10))  # Backup snapshots kept before the oldest are pruned
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))  # Local port for the Prometheus metrics endpoint (0 disables it)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")  # Interface the metrics endpoint listens on
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", 0.5))  # Seconds the event loop may stall before admins are alerted (0 disables)
+LOOP_LAG_DIGEST_INTERVAL = int(os.getenv("LOOP_LAG_DIGEST_INTERVAL", 300))  # Seconds between slow-loop alert digests
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "")  # "jsonl:<path>" or "otlp:<collector URL>" to trace updates; empty disables
+STORE_BACKEND = os.getenv("STORE_BACKEND", "json")  # "json" (one file per data store) or "sqlite" (shared by worker processes)
+STORE_PATH = os.getenv("STORE_PATH", "bot.sqlite3")  # Database file for the sqlite store
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", 0))  # Set by dispatcher.py for each worker process
+WORKER_PORT = int(os.getenv("WORKER_PORT", 0))  # Port this worker gets updates from dispatcher.py on (0 polls Telegram itself)
+LEADER_RETRY_INTERVAL = int(os.getenv("LEADER_RETRY_INTERVAL", 15))  # Seconds between attempts to take over as leader
+DELETE_SWEEP_INTERVAL = int(os.getenv("DELETE_SWEEP_INTERVAL", 30))  # Seconds between leader scans for auto-deletes queued by other workers
+RESTART_DRAIN_TIMEOUT = int(os.getenv("RESTART_DRAIN_TIMEOUT", 60))  # Seconds shutdown waits for uploads and deliveries in progress
+RESTART_NOTIFY_CHAT = int(os.environ.pop("RESTART_NOTIFY_CHAT", 0))  # Set by /restart so the new process can report back
 
-# File paths
-BANNED_USERS_FILE = "banned_users.json"
-FILE_DATABASE = "files.json"
-BATCHES_FILE = "batches.json"
-TOKENS_FILE = "tokens.json"
-PENDING_DELETES_FILE = "pending_deletes.json"
-GROUP_STATS_FILE = "group_stats.json"
-GROUP_SETTINGS_FILE = "group_settings.json"  # New file for group-specific settings
+# File paths, relative to DATA_DIR; with the sqlite store they name documents, namespaced the same way
+BANNED_USERS_FILE = os.path.join(DATA_DIR, "banned_users.json")
+FILE_DATABASE = os.path.join(DATA_DIR, "files.json")
+BATCHES_FILE = os.path.join(DATA_DIR, "batches.json")
+TOKENS_FILE = os.path.join(DATA_DIR, "tokens.json")
+VERIFIED_USERS_FILE = os.path.join(DATA_DIR, "verified_users.json")  # Users who redeemed a signed token, with their access expiry
+PENDING_DELETES_FILE = os.path.join(DATA_DIR, "pending_deletes.json")
+GROUP_STATS_FILE = os.path.join(DATA_DIR, "group_stats.json")
+GROUP_SETTINGS_FILE = os.path.join(DATA_DIR, "group_settings.json")  # New file for group-specific settings
+REINDEX_STATE_FILE = os.path.join(DATA_DIR, "reindex_state.json")  # Checkpoint for a resumable /reindex
+LEADER_LOCK_FILE = os.path.join(DATA_DIR, "leader.lock")  # Held by the process that runs scheduled jobs
+PERSISTENCE_FILE = os.path.join(DATA_DIR, f"user_data_{WORKER_INDEX}.pickle" if WORKER_PORT else "user_data.pickle")  # Batch sessions and conversations across restarts
+BACKUP_DIR = os.path.join(DATA_DIR, "backups")  # Compressed, incremental snapshots of the data files
+BACKUP_FILES = [TOKENS_FILE, VERIFIED_USERS_FILE, FILE_DATABASE, BATCHES_FILE, BANNED_USERS_FILE, PENDING_DELETES_FILE, GROUP_STATS_FILE, GROUP_SETTINGS_FILE]
+STORE_BACKUP_COPY = os.path.join(BACKUP_DIR, "store.sqlite3")  # Consistent copy of the sqlite store, snapshotted by /backup
 
-# Initialize data files
-for file in [BANNED_USERS_FILE, FILE_DATABASE, BATCHES_FILE, TOKENS_FILE, PENDING_DELETES_FILE, GROUP_STATS_FILE, GROUP_SETTINGS_FILE]:
-    if not os.path.exists(file):
-        with open(file, 'w') as f:
-            json.dump([] if file == BANNED_USERS_FILE else {}, f)
+# Signed tokens need a secret; without one fall back to the tokens file
+SIGNED_TOKENS = TOKEN_MODE == "signed"
+if SIGNED_TOKENS and not TOKEN_SECRET:
+    logging.warning("TOKEN_MODE is 'signed' but TOKEN_SECRET is not set, falling back to file tokens")
+    SIGNED_TOKENS = False
 
 # Mikasa's Personality Database
 MIKASA_QUOTES = {
@@ -82,10 +143,45 @@ MIKASA_QUOTES = {
     'welcome': ["Welcome to our group! I'll protect everyone here.", "A new comrade has joined our ranks. Together we'll fight!"]
 }
 
+if DATA_DIR:
+    os.makedirs(DATA_DIR, exist_ok=True)
+
+# Fair-queued delivery of files to users, one scheduler for every bot in the
+# process; users are queued per bot, since Telegram paces each bot separately
+delivery_scheduler = shared("delivery_scheduler", lambda: DeliveryScheduler(DELIVERY_CONCURRENCY, DELIVERY_PER_USER, DELIVERY_INTERVAL))
+
+# Data file reads and writes, kept off the event loop; bots with the same store settings share it
+json_store = shared(("store", STORE_BACKEND, STORE_PATH), lambda: SqliteStore(STORE_PATH) if STORE_BACKEND == "sqlite" else JsonStore())
+if STORE_BACKEND == "sqlite":
+    # Bring in the JSON files of a bot that used to run with the json store
+    json_store.import_files(BACKUP_FILES)
+
+# Initialize data files
+for file in [BANNED_USERS_FILE, FILE_DATABASE, BATCHES_FILE, TOKENS_FILE, VERIFIED_USERS_FILE, PENDING_DELETES_FILE, GROUP_STATS_FILE, GROUP_SETTINGS_FILE]:
+    if not json_store.exists(file):
+        json_store.write(file, [] if file == BANNED_USERS_FILE else {})
+
+# Scheduled jobs run only in the process holding this lease (see start_leader_jobs)
+leader_lease = LeaderLease(LEADER_LOCK_FILE)
+
+# Snapshots of the data files, taken by /backup and /cleanup
+backup_store = BackupStore(BACKUP_DIR, BACKUP_KEEP)
+
+# Prometheus endpoint, started in post_init when METRICS_PORT is set; worker N listens on METRICS_PORT + N
+metrics_server = shared("metrics_server", lambda: metrics.MetricsServer(METRICS_HOST, METRICS_PORT + WORKER_INDEX if METRICS_PORT else 0))
+
+# Event-loop lag and stall detection, started in post_init; the first bot in the process reports stalls
+loop_monitor = shared("loop_monitor", lambda: LoopMonitor(LOOP_LAG_THRESHOLD))
+loop_stall_reporter = shared("loop_stall_reporter", lambda: TENANT)
+
+# Per-update spans, exported only when TRACE_EXPORT is set
+shared("tracing", lambda: tracing.configure(TRACE_EXPORT))
+
 def mikasa_reply(category='default'):
     return random.choice(MIKASA_QUOTES.get(category, MIKASA_QUOTES['default'])) + "\n"
 
 def admin_only(func):
+    @functools.wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.effective_user.id not in ADMINS:
             await update.message.reply_text(mikasa_reply('warning') + "Unauthorized!")
@@ -94,6 +190,7 @@ def admin_only(func):
     return wrapper
 
 def owner_only(func):
+    @functools.wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.effective_user.id != OWNER_ID:
             await update.message.reply_text(mikasa_reply('warning') + "This command is only available to the owner!")
@@ -101,28 +198,57 @@ def owner_only(func):
         return await func(update, context)
     return wrapper
 
-async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
-    logging.error(f"Error: {context.error}")
+async def send_error_notification(bot, chat_id, text):
+    """Send an error notice to a chat, or to the first admin if there is none"""
     try:
-        # Safely get chat_id
-        chat_id = None
-        if update and hasattr(update, 'effective_chat') and update.effective_chat:
-            chat_id = update.effective_chat.id
-        else:
-            # If we can't get chat_id from update, use the first admin
+        if not chat_id:
+            # Without a chat to answer in, tell the first admin
             chat_id = ADMINS[0] if ADMINS else None
         
         # Only send message if we have a valid chat_id
         if chat_id:
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=mikasa_reply('error') + f"Error: {context.error}"
-            )
+            await bot.send_message(chat_id=chat_id, text=mikasa_reply('error') + text)
         else:
             logging.warning("Could not determine chat_id for error notification")
     except Exception as e:
         logging.error(f"Failed to send error message: {e}")
 
+async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
+    logging.error(f"Error: {context.error}")
+    # Safely get chat_id
+    chat_id = None
+    if update and hasattr(update, 'effective_chat') and update.effective_chat:
+        chat_id = update.effective_chat.id
+    await send_error_notification(context.bot, chat_id, f"Error: {context.error}")
+
+async def flush_loop_stalls(context: CallbackContext):
+    """Send admins one digest of the event-loop stalls since the last digest"""
+    stalls = loop_monitor.take_pending()
+    if not stalls:
+        return
+    
+    # Group by handler and blocking frame, worst first
+    groups = {}
+    for stall in stalls:
+        count, worst = groups.get((stall.handler, stall.culprit), (0, 0))
+        groups[(stall.handler, stall.culprit)] = (count + 1, max(worst, stall.lag))
+    
+    lines = [f"⏱ Event loop stalled {len(stalls)} time(s) over {LOOP_LAG_THRESHOLD}s in the last {LOOP_LAG_DIGEST_INTERVAL // 60} min:"]
+    for (handler, culprit), (count, worst) in sorted(groups.items(), key=lambda item: -item[1][1])[:15]:
+        lines.append(f"• {handler}: {count}x, worst {worst:.2f}s, blocked in {culprit}")
+    p99 = LOOP_LAG.quantile(0.99)
+    if p99 is not None:
+        lines.append(f"\nLoop lag p99 since startup: {p99 * 1000:.0f}ms")
+    if TENANT:
+        lines.append(f"\nThe loop is shared by every bot in this process; this digest covers all of them.")
+    text = "\n".join(lines)[:4000]
+    
+    for admin_id in ADMINS:
+        try:
+            await context.bot.send_message(chat_id=admin_id, text=text)
+        except Exception as e:
+            logging.error(f"Failed to send loop stall digest to admin {admin_id}: {e}")
+
 # ========== AUTO DELETE MECHANISM ========== #
 async def delete_message_after_delay(context: CallbackContext):
     job = context.job
@@ -133,82 +259,52 @@ async def delete_message_after_delay(context: CallbackContext):
         logging.info(f"Auto-deleted message {message_id} in chat {chat_id}")
         
         # Remove from pending deletes
-        remove_pending_delete(chat_id, message_id)
+        await remove_pending_delete(chat_id, message_id)
     except Exception as e:
         logging.error(f"Failed to auto-delete message: {e}")
 
-def save_pending_delete(chat_id, message_id, delete_time):
+async def save_pending_delete(chat_id, message_id, delete_time):
     """Save a pending delete to file for persistence across bot restarts"""
+    def add(pending):
+        # Convert chat_id to string for JSON
+        str_chat_id = str(chat_id)
+        if str_chat_id not in pending:
+            pending[str_chat_id] = {}
+        
+        # Store message_id with deletion timestamp
+        pending[str_chat_id][str(message_id)] = delete_time
+    
     try:
-        with open(PENDING_DELETES_FILE, 'r+') as f:
-            try:
-                pending = json.load(f)
-            except json.JSONDecodeError:
-                pending = {}
-            
-            # Ensure pending is a dictionary
-            if not isinstance(pending, dict):
-                pending = {}
-            
-            # Convert chat_id to string for JSON
-            str_chat_id = str(chat_id)
-            if str_chat_id not in pending:
-                pending[str_chat_id] = {}
-            
-            # Store message_id with deletion timestamp
-            pending[str_chat_id][str(message_id)] = delete_time
-            
-            # Write back to file
-            f.seek(0)
-            f.truncate()
-            json.dump(pending, f)
+        await json_store.update(PENDING_DELETES_FILE, add, {})
     except Exception as e:
         logging.error(f"Error saving pending delete: {e}")
 
-def remove_pending_delete(chat_id, message_id):
+async def remove_pending_delete(chat_id, message_id):
     """Remove a pending delete from file after it's been processed"""
-    try:
-        with open(PENDING_DELETES_FILE, 'r+') as f:
-            try:
-                pending = json.load(f)
-            except json.JSONDecodeError:
-                return
-            
-            # Ensure pending is a dictionary
-            if not isinstance(pending, dict):
-                return
+    def remove(pending):
+        # Convert chat_id to string for JSON
+        str_chat_id = str(chat_id)
+        if str_chat_id in pending and str(message_id) in pending[str_chat_id]:
+            del pending[str_chat_id][str(message_id)]
             
-            # Convert chat_id to string for JSON
-            str_chat_id = str(chat_id)
-            if str_chat_id in pending and str(message_id) in pending[str_chat_id]:
-                del pending[str_chat_id][str(message_id)]
-                
-                # Remove empty chat entries
-                if not pending[str_chat_id]:
-                    del pending[str_chat_id]
-                
-                # Write back to file
-                f.seek(0)
-                f.truncate()
-                json.dump(pending, f)
+            # Remove empty chat entries
+            if not pending[str_chat_id]:
+                del pending[str_chat_id]
+    
+    try:
+        await json_store.update(PENDING_DELETES_FILE, remove, {})
     except Exception as e:
         logging.error(f"Error removing pending delete: {e}")
 
 async def get_group_auto_delete_time(chat_id):
     """Get the auto-delete time for a specific group"""
     try:
-        with open(GROUP_SETTINGS_FILE, 'r') as f:
-            try:
-                settings = json.load(f)
-                if not isinstance(settings, dict):
-                    settings = {}
-            except json.JSONDecodeError:
-                settings = {}
-            
-            # Convert chat_id to string for JSON
-            str_chat_id = str(chat_id)
-            if str_chat_id in settings and "auto_delete" in settings[str_chat_id]:
-                return settings[str_chat_id]["auto_delete"]
+        auto_delete = await json_store.load_records(GROUP_SETTINGS_FILE, parse_auto_delete)
+        
+        # Convert chat_id to string for JSON
+        str_chat_id = str(chat_id)
+        if str_chat_id in auto_delete:
+            return auto_delete[str_chat_id]
     except Exception as e:
         logging.error(f"Error getting group auto-delete time: {e}")
     
@@ -217,33 +313,24 @@ async def get_group_auto_delete_time(chat_id):
 
 async def set_group_auto_delete_time(chat_id, minutes):
     """Set the auto-delete time for a specific group"""
+    def set_time(settings):
+        # Convert chat_id to string for JSON
+        str_chat_id = str(chat_id)
+        if str_chat_id not in settings:
+            settings[str_chat_id] = {}
+        
+        # Store auto-delete time
+        settings[str_chat_id]["auto_delete"] = minutes
+    
     try:
-        with open(GROUP_SETTINGS_FILE, 'r+') as f:
-            try:
-                settings = json.load(f)
-                if not isinstance(settings, dict):
-                    settings = {}
-            except json.JSONDecodeError:
-                settings = {}
-            
-            # Convert chat_id to string for JSON
-            str_chat_id = str(chat_id)
-            if str_chat_id not in settings:
-                settings[str_chat_id] = {}
-            
-            # Store auto-delete time
-            settings[str_chat_id]["auto_delete"] = minutes
-            
-            # Write back to file
-            f.seek(0)
-            f.truncate()
-            json.dump(settings, f)
-            logging.info(f"Set auto-delete time for group {chat_id} to {minutes} minutes")
-            return True
+        await json_store.update(GROUP_SETTINGS_FILE, set_time, {})
+        logging.info(f"Set auto-delete time for group {chat_id} to {minutes} minutes")
+        return True
     except Exception as e:
         logging.error(f"Error setting group auto-delete time: {e}")
         return False
 
+@tracing.traced("schedule_deletion")
 async def schedule_message_deletion(context, chat_id, message_id, minutes=None):
     """Schedule a message for deletion and save it for persistence"""
     # If minutes is not provided, get from group settings or global setting
@@ -257,7 +344,12 @@ async def schedule_message_deletion(context, chat_id, message_id, minutes=None):
     delete_time = int(time.time() + (minutes * 60))
     
     # Save to pending deletes file
-    save_pending_delete(chat_id, message_id, delete_time)
+    await save_pending_delete(chat_id, message_id, delete_time)
+    
+    if not leader_lease.held:
+        # The leader's next sweep of the pending deletes schedules it
+        logging.info(f"Queued deletion of message {message_id} in chat {chat_id} for the leader in {minutes} minutes")
+        return
     
     # Schedule the job
     context.job_queue.run_once(
@@ -269,76 +361,87 @@ async def schedule_message_deletion(context, chat_id, message_id, minutes=None):
     logging.info(f"Scheduled deletion for message {message_id} in chat {chat_id} in {minutes} minutes")
 
 async def restore_pending_deletes(context):
-    """Restore pending deletes from file when bot starts"""
+    """Schedule every pending delete that has no job yet, deleting overdue messages right away
+
+    Runs when the bot becomes the leader and then every DELETE_SWEEP_INTERVAL
+    seconds, to pick up deletes queued by the other workers.
+    """
     try:
-        with open(PENDING_DELETES_FILE, 'r') as f:
-            try:
-                pending = json.load(f)
-            except json.JSONDecodeError:
-                return
-            
-            # Ensure pending is a dictionary
-            if not isinstance(pending, dict):
-                return
+        pending = await json_store.load(PENDING_DELETES_FILE, {})
+        current_time = int(time.time())
+        for str_chat_id, messages in pending.items():
+            if not isinstance(messages, dict):
+                continue
             
-            current_time = int(time.time())
-            for str_chat_id, messages in pending.items():
-                if not isinstance(messages, dict):
-                    continue
-                
-                try:
-                    chat_id = int(str_chat_id)
-                    for str_message_id, delete_time in messages.items():
-                        try:
-                            message_id = int(str_message_id)
-                            
-                            # Calculate remaining time
-                            remaining_seconds = delete_time - current_time
-                            
-                            if remaining_seconds <= 0:
-                                # Delete immediately if time has passed
-                                try:
-                                    await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-                                    logging.info(f"Immediately deleted expired message {message_id} in chat {chat_id}")
-                                except Exception as e:
-                                    logging.error(f"Failed to delete expired message: {e}")
-                                remove_pending_delete(chat_id, message_id)
-                            else:
-                                # Schedule deletion for remaining time
-                                context.job_queue.run_once(
-                                    delete_message_after_delay,
-                                    remaining_seconds,
-                                    data=(chat_id, message_id),
-                                    name=f"delete_{chat_id}_{message_id}"
-                                )
-                                logging.info(f"Restored scheduled deletion for message {message_id} in chat {chat_id} in {remaining_seconds/60:.1f} minutes")
-                        except (ValueError, TypeError) as e:
-                            logging.error(f"Error processing message ID {str_message_id}: {e}")
-                except ValueError as e:
-                    logging.error(f"Error processing chat ID {str_chat_id}: {e}")
+            try:
+                chat_id = int(str_chat_id)
+                for str_message_id, delete_time in messages.items():
+                    try:
+                        message_id = int(str_message_id)
+                        
+                        # Calculate remaining time
+                        remaining_seconds = delete_time - current_time
+                        
+                        if remaining_seconds <= 0:
+                            # Delete immediately if time has passed
+                            try:
+                                await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
+                                logging.info(f"Immediately deleted expired message {message_id} in chat {chat_id}")
+                            except Exception as e:
+                                logging.error(f"Failed to delete expired message: {e}")
+                            await remove_pending_delete(chat_id, message_id)
+                        elif not context.job_queue.get_jobs_by_name(f"delete_{chat_id}_{message_id}"):
+                            # Schedule deletion for remaining time
+                            context.job_queue.run_once(
+                                delete_message_after_delay,
+                                remaining_seconds,
+                                data=(chat_id, message_id),
+                                name=f"delete_{chat_id}_{message_id}"
+                            )
+                            logging.info(f"Restored scheduled deletion for message {message_id} in chat {chat_id} in {remaining_seconds/60:.1f} minutes")
+                    except (ValueError, TypeError) as e:
+                        logging.error(f"Error processing message ID {str_message_id}: {e}")
+            except ValueError as e:
+                logging.error(f"Error processing chat ID {str_chat_id}: {e}")
     except Exception as e:
         logging.error(f"Error restoring pending deletes: {e}")
 
 # ========== TOKEN VERIFICATION SYSTEM ========== #
+# Users who redeemed a signed token, with their access expiry (loaded from VERIFIED_USERS_FILE by post_init)
+verified_users = VerifiedUsers()
+
+async def load_verified_users():
+    """Load the saved verified users, dropping those whose access has expired"""
+    try:
+        loaded = verified_users.load(await json_store.load(VERIFIED_USERS_FILE, {}))
+        logging.info(f"Loaded {loaded} verified users")
+    except Exception as e:
+        logging.error(f"Error loading verified users: {e}")
+
+async def save_verified_user(user_id, expiry):
+    """Record a verified user so access survives a restart"""
+    def grant(users):
+        if expiry > users.get(str(user_id), 0):
+            users[str(user_id)] = expiry
+    
+    try:
+        await json_store.update(VERIFIED_USERS_FILE, grant, {})
+    except Exception as e:
+        logging.error(f"Error saving verified user {user_id}: {e}")
+
 # New function to check for existing valid tokens
-def get_valid_token():
+async def get_valid_token():
     """Check if there's a valid token already in the tokens file"""
+    if SIGNED_TOKENS:
+        # Signed tokens are never stored, so only the token issued by this process is known
+        cached = issued_tokens.get(0)
+        if cached and cached[2] > time.time():
+            return cached[0], cached[2]
+        return None
+    
     try:
-        # Make sure the tokens file exists
-        if not os.path.exists(TOKENS_FILE):
-            logging.warning("Tokens file does not exist")
-            return None
-        
         # Read tokens from file
-        with open(TOKENS_FILE, 'r') as f:
-            try:
-                tokens = json.load(f)
-                if not isinstance(tokens, dict):
-                    logging.warning("Tokens file does not contain a dictionary")
-                    return None
-            except json.JSONDecodeError:
-                logging.warning("Tokens file contains invalid JSON")
-                return None
+        tokens = await json_store.load_records(TOKENS_FILE, parse_tokens)
         
         current_time = int(time.time())
         
@@ -346,19 +449,13 @@ def get_valid_token():
         latest_token = None
         latest_expiry = 0
         
-        for token, data in tokens.items():
-            if not isinstance(data, dict):
-                continue
-            
-            if "user_id" not in data or "expiry" not in data:
-                continue
-            
+        for token, record in tokens.items():
             # Check if token is for placeholder user (0) and not expired
-            if data["user_id"] == 0 and data["expiry"] > current_time:
+            if record.user_id == 0 and record.expiry > current_time:
                 # If this token expires later than our current latest, update it
-                if data["expiry"] > latest_expiry:
+                if record.expiry > latest_expiry:
                     latest_token = token
-                    latest_expiry = data["expiry"]
+                    latest_expiry = record.expiry
         
         if latest_token:
             logging.info(f"Found existing valid token that expires at {datetime.fromtimestamp(latest_expiry).strftime('%Y-%m-%d %H:%M:%S')}")
@@ -370,44 +467,62 @@ def get_valid_token():
         logging.error(f"Error checking for valid tokens: {e}")
         return None
 
-async def generate_token(user_id, context):
-    """Generate a unique token for a user and distribute to admins"""
-    token = str(uuid.uuid4())
-    expiry = int(time.time() + TOKEN_DURATION * 3600)  # Current time + duration in hours
-    
-    # Create verification URL
-    bot_username = context.bot.username
-    verification_url = f"https://t.me/{bot_username}?start=verify_{token}"
-    
-    # Store token in file
-    try:
-        # Make sure the tokens file exists
-        if not os.path.exists(TOKENS_FILE):
-            with open(TOKENS_FILE, 'w') as f:
-                json.dump({}, f)
-        
-        # Read existing tokens
-        with open(TOKENS_FILE, 'r') as f:
-            try:
-                tokens = json.load(f)
-                if not isinstance(tokens, dict):
-                    tokens = {}
-            except json.JSONDecodeError:
-                tokens = {}
-        
-        # Add new token
+# Pending per-user tokens, reused while still valid: user_id -> (token, verification_url, expiry)
+issued_tokens = {}
+# Per-user tokens waiting to be announced in the next digest: (user_id, verification_url, expiry)
+token_digest = []
+# Message ID of the currently pinned access token in the database channel
+pinned_token_msg_id = None
+
+# Don't hand out a cached token that is about to expire
+TOKEN_REUSE_MARGIN = 300
+
+async def store_token(token, user_id, expiry):
+    """Add a token to the tokens file"""
+    def add(tokens):
         tokens[token] = {
             "user_id": user_id,
             "expiry": expiry
         }
-        
-        # Write updated tokens back to file
-        with open(TOKENS_FILE, 'w') as f:
-            json.dump(tokens, f)
-            
+    
+    try:
+        await json_store.update(TOKENS_FILE, add, {})
         logging.info(f"Stored token {token} in tokens file")
     except Exception as e:
         logging.error(f"Error storing token in file: {e}")
+
+async def generate_token(user_id, context):
+    """Generate a unique token for a user and distribute to admins
+    
+    Per-user tokens are reused while a valid one is pending and announced in
+    periodic digests (see flush_token_digest), so a burst of unverified users
+    costs no Bot API calls. Global tokens (user_id 0) are announced and pinned
+    right away.
+    """
+    if user_id != 0:
+        cached = issued_tokens.get(user_id)
+        if cached and cached[2] - time.time() > TOKEN_REUSE_MARGIN:
+            return cached[0], cached[1]
+    
+    expiry = int(time.time() + TOKEN_DURATION * 3600)  # Current time + duration in hours
+    token = sign_token(user_id, expiry, TOKEN_SECRET) if SIGNED_TOKENS else str(uuid.uuid4())
+    
+    # Create verification URL
+    bot_username = context.bot.username
+    verification_url = f"https://t.me/{bot_username}?start=verify_{token}"
+    
+    # Cache the token before the first await, so a concurrent /start from the same user reuses it
+    issued_tokens[user_id] = (token, verification_url, expiry)
+    if user_id != 0:
+        # Announce in the next digest instead of messaging admins per user
+        token_digest.append((user_id, verification_url, expiry))
+    
+    # Store token in file (signed tokens carry their own scope and expiry)
+    if not SIGNED_TOKENS:
+        await store_token(token, user_id, expiry)
+    
+    if user_id != 0:
+        return token, verification_url
     
     # Send direct token URL to all admins
     expiry_time = datetime.fromtimestamp(expiry).strftime('%Y-%m-%d %H:%M:%S')
@@ -424,6 +539,7 @@ async def generate_token(user_id, context):
             logging.error(f"Failed to send token URL to admin {admin_id}: {e}")
     
     # Send and pin token URL in database channel
+    global pinned_token_msg_id
     try:
         # Send message to database channel
         db_msg = await context.bot.send_message(
@@ -439,104 +555,131 @@ async def generate_token(user_id, context):
         )
         logging.info(f"Pinned token URL message {db_msg.message_id} in database channel")
         
-        # Unpin previous pinned messages
+        # Unpin the previous token message, looking it up only if we don't remember it
         try:
-            chat = await context.bot.get_chat(DATABASE_CHANNEL)
-            if chat.pinned_message and chat.pinned_message.message_id != db_msg.message_id:
+            previous_msg_id = pinned_token_msg_id
+            if previous_msg_id is None:
+                chat = await context.bot.get_chat(DATABASE_CHANNEL)
+                if chat.pinned_message:
+                    previous_msg_id = chat.pinned_message.message_id
+            if previous_msg_id and previous_msg_id != db_msg.message_id:
                 await context.bot.unpin_chat_message(
                     chat_id=DATABASE_CHANNEL,
-                    message_id=chat.pinned_message.message_id
+                    message_id=previous_msg_id
                 )
         except Exception as e:
             logging.error(f"Error unpinning previous message: {e}")
+        pinned_token_msg_id = db_msg.message_id
     except Exception as e:
         logging.error(f"Failed to send/pin token URL in database channel: {e}")
     
     return token, verification_url
 
-def verify_token(token):
+async def flush_token_digest(context: CallbackContext):
+    """Send one digest of newly issued per-user tokens to each admin and the database channel"""
+    # Forget cached tokens that can no longer be reused
+    current_time = time.time()
+    for user_id in [u for u, (_, _, expiry) in issued_tokens.items() if expiry - current_time <= TOKEN_REUSE_MARGIN]:
+        del issued_tokens[user_id]
+    
+    if not token_digest:
+        return
+    
+    entries = token_digest[:]
+    token_digest.clear()
+    
+    header = f"🔑 {len(entries)} New Token(s) Generated\n\n"
+    lines = []
+    length = len(header)
+    for user_id, verification_url, expiry in entries:
+        expiry_time = datetime.fromtimestamp(expiry).strftime('%Y-%m-%d %H:%M:%S')
+        line = f"• User {user_id} (expires {expiry_time}): {verification_url}\n"
+        # Stay under Telegram's 4096 character limit
+        if length + len(line) > 4000:
+            lines.append(f"...and {len(entries) - len(lines)} more")
+            break
+        lines.append(line)
+        length += len(line)
+    digest_message = header + "".join(lines)
+    
+    for admin_id in ADMINS:
+        try:
+            await context.bot.send_message(chat_id=admin_id, text=digest_message)
+        except Exception as e:
+            logging.error(f"Failed to send token digest to admin {admin_id}: {e}")
+    
+    try:
+        await context.bot.send_message(chat_id=DATABASE_CHANNEL, text=digest_message)
+    except Exception as e:
+        logging.error(f"Failed to send token digest to database channel: {e}")
+    
+    logging.info(f"Sent token digest with {len(entries)} tokens")
+
+async def verify_token(token):
     """Verify if a token is valid and not expired"""
     try:
-        # Make sure the tokens file exists
-        if not os.path.exists(TOKENS_FILE):
-            logging.warning("Tokens file does not exist")
-            return None
-        
         # Read tokens from file
-        with open(TOKENS_FILE, 'r') as f:
-            try:
-                tokens = json.load(f)
-                if not isinstance(tokens, dict):
-                    logging.warning("Tokens file does not contain a dictionary")
-                    return None
-            except json.JSONDecodeError:
-                logging.warning("Tokens file contains invalid JSON")
-                return None
+        tokens = await json_store.load_records(TOKENS_FILE, parse_tokens)
         
-        # Check if token exists
-        if token not in tokens:
+        # Check if token exists (malformed entries are dropped when the records are parsed)
+        record = tokens.get(token)
+        if record is None:
             logging.warning(f"Token {token} not found in tokens file")
             return None
         
-        token_data = tokens[token]
-        
-        # Check if token_data has the expected structure
-        if not isinstance(token_data, dict) or "user_id" not in token_data or "expiry" not in token_data:
-            logging.warning(f"Token {token} has invalid data structure")
-            return None
-        
         current_time = int(time.time())
         
         # Check if token is expired
-        if token_data["expiry"] <= current_time:
+        if record.expiry <= current_time:
             logging.info(f"Token {token} has expired")
             
             # Remove expired token
-            tokens.pop(token)
-            with open(TOKENS_FILE, 'w') as f:
-                json.dump(tokens, f)
+            await json_store.update(TOKENS_FILE, lambda tokens: tokens.pop(token, None), {})
             
             return None
         
         # Token is valid
-        logging.info(f"Token {token} is valid for user {token_data['user_id']}")
-        return token_data["user_id"]
+        logging.info(f"Token {token} is valid for user {record.user_id}")
+        return record.user_id
     except Exception as e:
         logging.error(f"Error verifying token: {e}")
         return None
 
-def check_user_token(user_id):
+async def redeem_token(token, user_id):
+    """Check a token from a /start link for this user, recording the user as verified in signed mode"""
+    if SIGNED_TOKENS:
+        claims = verify_signed_token(token, TOKEN_SECRET)
+        if claims is None:
+            logging.info(f"Signed token rejected for user {user_id}")
+            return False
+        token_user_id, expiry = claims
+        if token_user_id != user_id and token_user_id != 0:
+            logging.info(f"Signed token for user {token_user_id} presented by user {user_id}")
+            return False
+        verified_users.grant(user_id, expiry)
+        await save_verified_user(user_id, expiry)
+        return True
+    
+    verified_user_id = await verify_token(token)
+    logging.info(f"Verification result: {verified_user_id}")
+    return verified_user_id is not None and (verified_user_id == user_id or verified_user_id == 0)
+
+async def check_user_token(user_id):
     """Check if a user has a valid token"""
+    if SIGNED_TOKENS:
+        return verified_users.is_verified(user_id)
+    
     try:
-        # Make sure the tokens file exists
-        if not os.path.exists(TOKENS_FILE):
-            logging.warning("Tokens file does not exist")
-            return False
-        
         # Read tokens from file
-        with open(TOKENS_FILE, 'r') as f:
-            try:
-                tokens = json.load(f)
-                if not isinstance(tokens, dict):
-                    logging.warning("Tokens file does not contain a dictionary")
-                    return False
-            except json.JSONDecodeError:
-                logging.warning("Tokens file contains invalid JSON")
-                return False
+        tokens = await json_store.load_records(TOKENS_FILE, parse_tokens)
         
         current_time = int(time.time())
         
         # Check each token
-        for token, data in tokens.items():
-            if not isinstance(data, dict):
-                continue
-            
-            if "user_id" not in data or "expiry" not in data:
-                continue
-            
+        for record in tokens.values():
             # Check if token belongs to user and is not expired
             # Also check if token is for placeholder user (0) which means it's valid for all users
-            if (data["user_id"] == user_id or data["user_id"] == 0) and data["expiry"] > current_time:
+            if (record.user_id == user_id or record.user_id == 0) and record.expiry > current_time:
                 logging.info(f"Found valid token for user {user_id}")
                 return True
         
@@ -552,7 +695,7 @@ async def refresh_token(context: CallbackContext):
     logging.info("Scheduled token refresh triggered")
     
     # Check if there's already a valid token
-    token_info = get_valid_token()
+    token_info = await get_valid_token()
     
     if token_info:
         token, expiry = token_info
@@ -574,14 +717,10 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Check ban status
     try:
-        with open(BANNED_USERS_FILE, 'r') as f:
-            banned_users = json.load(f)
-            if not isinstance(banned_users, list):
-                banned_users = []
-            
-            if str(user_id) in banned_users or user_id in banned_users:
-                await update.message.reply_text(mikasa_reply('ban') + "You are banned from using this bot!")
-                return
+        banned_users = await json_store.load_records(BANNED_USERS_FILE, parse_banned_users)
+        if str(user_id) in banned_users:
+            await update.message.reply_text(mikasa_reply('ban') + "You are banned from using this bot!")
+            return
     except Exception as e:
         logging.error(f"Error checking ban status: {e}")
     
@@ -594,10 +733,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             token = arg[7:]  # Remove "verify_" prefix
             logging.info(f"Verifying token: {token} for user {user_id}")
             
-            verified_user_id = verify_token(token)
-            logging.info(f"Verification result: {verified_user_id}")
-            
-            if verified_user_id is not None and (verified_user_id == user_id or verified_user_id == 0):
+            if await redeem_token(token, user_id):
                 # Token is valid for this user
                 await update.message.reply_text(
                     mikasa_reply('success') + "Token verified successfully! You now have access for 24 hours."
@@ -612,7 +748,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Check if user has a valid token (only if token verification is enabled)
         if TOKEN_VERIFICATION_ENABLED:
-            has_valid_token = check_user_token(user_id)
+            has_valid_token = await check_user_token(user_id)
             
             if not has_valid_token:
                 # User doesn't have a valid token
@@ -656,7 +792,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Check if user has a valid token (only if token verification is enabled)
     if TOKEN_VERIFICATION_ENABLED:
-        has_valid_token = check_user_token(user_id)
+        has_valid_token = await check_user_token(user_id)
         
         if not has_valid_token:
             # User doesn't have a valid token
@@ -706,7 +842,7 @@ async def token_toggle_command(update: Update, context: ContextTypes.DEFAULT_TYP
     # Update the environment variable
     try:
         # Update in memory
-        os.environ["TOKEN_VERIFICATION_ENABLED"] = "1" if TOKEN_VERIFICATION_ENABLED else "0"
+        bot_env["TOKEN_VERIFICATION_ENABLED"] = "1" if TOKEN_VERIFICATION_ENABLED else "0"
         
         # Update in .env file
         set_key(ENV_FILE, "TOKEN_VERIFICATION_ENABLED", "1" if TOKEN_VERIFICATION_ENABLED else "0")
@@ -741,7 +877,7 @@ async def customize_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Create keyboard with variable options
     keyboard = []
     for var in customizable_vars:
-        keyboard.append([InlineKeyboardButton(f"{var} = {os.getenv(var, 'Not set')}", callback_data=f"customize_{var}")])
+        keyboard.append([InlineKeyboardButton(f"{var} = {bot_env.get(var, 'Not set')}", callback_data=f"customize_{var}")])
     
     keyboard.append([InlineKeyboardButton("Cancel", callback_data="customize_cancel")])
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -774,7 +910,7 @@ async def customize_button_handler(update: Update, context: ContextTypes.DEFAULT
         
         # Ask for the new value
         await query.edit_message_text(
-            mikasa_reply('info') + f"Enter a new value for {var_name}:\n\nCurrent value: {os.getenv(var_name, 'Not set')}"
+            mikasa_reply('info') + f"Enter a new value for {var_name}:\n\nCurrent value: {bot_env.get(var_name, 'Not set')}"
         )
         
         # Update state
@@ -806,7 +942,7 @@ async def customize_value_handler(update: Update, context: ContextTypes.DEFAULT_
     # Update the environment variable
     try:
         # Update in memory
-        os.environ[var_name] = new_value
+        bot_env[var_name] = new_value
         
         # Update in .env file
         set_key(ENV_FILE, var_name, new_value)
@@ -843,98 +979,97 @@ async def customize_value_handler(update: Update, context: ContextTypes.DEFAULT_
 @admin_only
 async def start_batch(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['batch'] = []
+    context.user_data['batch_records'] = {}
     logging.info(f"Started new batch for user {update.effective_user.id}")
     await update.message.reply_text(mikasa_reply('success') + "Batch collection started!")
 
-@admin_only
-async def end_batch(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if 'batch' not in context.user_data or not context.user_data['batch']:
-        await update.message.reply_text(mikasa_reply('warning') + "No active batch!")
-        return
+async def save_batch(context: ContextTypes.DEFAULT_TYPE):
+    """Store the user's active batch and write its records to the links channel
     
+    File records collected during the batch are written as a few packed
+    messages rather than one links channel post per file. Returns
+    (batch_link, failed_count), or None if the batch could not be saved.
+    """
     batch_files = context.user_data['batch']
+    batch_records = context.user_data.get('batch_records', {})
     logging.info(f"Ending batch with {len(batch_files)} files: {batch_files}")
     
-    batch_id = str(uuid.uuid4())
-    try:
-        with open(BATCHES_FILE, 'r+') as f:
-            try:
-                batches = json.load(f)
-                if not isinstance(batches, dict):
-                    batches = {}
-            except json.JSONDecodeError:
-                batches = {}
-            
-            batches[batch_id] = batch_files
-            f.seek(0)
-            f.truncate()
-            json.dump(batches, f)
-            logging.info(f"Saved batch {batch_id} with files: {batch_files}")
-    except Exception as e:
-        logging.error(f"Error saving batch: {e}")
-        await update.message.reply_text(mikasa_reply('error') + "Failed to save batch!")
-        return
+    # Make sure every file in the batch has been stored
+    await ingestion_queue.wait_for(batch_files)
+    
+    # Files added before records were buffered take their record from the store
+    unbuffered = [fid for fid in batch_files if fid not in batch_records]
+    if unbuffered:
+        files = await json_store.load_records(FILE_DATABASE, parse_files)
+        batch_records.update({fid: files[fid].to_dict() for fid in unbuffered if fid in files})
     
+    # Leave out files whose ingestion failed; they have no message to send
+    stored_files = [fid for fid in batch_files if batch_records.get(fid, {}).get("message_id")]
+    failed_count = len(batch_files) - len(stored_files)
+    if not stored_files:
+        return None
+    
+    batch_id = str(uuid.uuid4())
     batch_link = f"t.me/{context.bot.username}?start={batch_id}"
+    date_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
-    # Store batch link in links channel if configured
+    # Store batch records in links channel if configured
     link_msg_id = None
     if LINKS_CHANNEL:
+        records = [
+            format_file_record(fid, batch_records[fid]["message_id"], batch_records[fid].get("media_type"), batch_records[fid].get("custom_name"))
+            for fid in stored_files
+        ]
+        
         try:
-            # Get file names for the batch
-            file_names = []
-            with open(FILE_DATABASE, 'r') as f:
-                try:
-                    files = json.load(f)
-                    for file_id in batch_files:
-                        if file_id in files and isinstance(files[file_id], dict):
-                            name = files[file_id].get("custom_name", "Unnamed file")
-                            file_names.append(name)
-                except json.JSONDecodeError:
-                    pass
-            
-            file_list = "\n".join([f"• {name}" for name in file_names]) if file_names else "• Files in batch"
-            date_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            link_msg = await context.bot.send_message(
-                chat_id=LINKS_CHANNEL,
-                text=f"🔗 Batch Link (contains {len(batch_files)} files)\n\n"
-                     f"Date: {date_str}\n"
-                     f"Files:\n{file_list}\n\n"
-                     f"Link: {batch_link}\n\n"
-                     f"#batch_{batch_id}"  # Add hashtag for easier searching
-            )
-            link_msg_id = link_msg.message_id
-            logging.info(f"Stored batch link in links channel, message ID: {link_msg_id}")
-            
-            # Update batch info with link to links channel message
-            with open(BATCHES_FILE, 'r+') as f:
-                try:
-                    batches = json.load(f)
-                    if batch_id in batches:
-                        # Convert to dict if it's a list
-                        if isinstance(batches[batch_id], list):
-                            file_list = batches[batch_id]
-                            batches[batch_id] = {
-                                "files": file_list,
-                                "links_channel_msg_id": link_msg_id
-                            }
-                        # Or update if it's already a dict
-                        elif isinstance(batches[batch_id], dict):
-                            batches[batch_id]["links_channel_msg_id"] = link_msg_id
-                        
-                        f.seek(0)
-                        f.truncate()
-                        json.dump(batches, f)
-                except Exception as e:
-                    logging.error(f"Error updating batch with links channel message ID: {e}")
+            for text in pack_batch_messages(batch_id, batch_link, date_str, records):
+                link_msg = await context.bot.send_message(chat_id=LINKS_CHANNEL, text=text)
+                if link_msg_id is None:
+                    link_msg_id = link_msg.message_id
+            logging.info(f"Stored {len(records)} batch records in links channel, first message ID: {link_msg_id}")
         except Exception as e:
-            logging.error(f"Failed to store batch link in links channel: {e}")
+            logging.error(f"Failed to store batch records in links channel: {e}")
+    
+    def add_batch(batches):
+        batches[batch_id] = {
+            "files": stored_files,
+            "date": date_str,
+            "total_files": len(stored_files),
+            "links_channel_msg_id": link_msg_id
+        }
     
+    try:
+        await json_store.update(BATCHES_FILE, add_batch, {})
+        logging.info(f"Saved batch {batch_id} with files: {stored_files}")
+    except Exception as e:
+        logging.error(f"Error saving batch: {e}")
+        return None
+    
+    context.user_data.pop('batch')
+    context.user_data.pop('batch_records', None)
+    return batch_link, failed_count
+
+@admin_only
+async def end_batch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # An album still inside its collection window belongs to this batch
+    for key, album in list(album_buffers.items()):
+        if album["user_data"] is context.user_data:
+            await flush_album(context, key)
+    
+    if 'batch' not in context.user_data or not context.user_data['batch']:
+        await update.message.reply_text(mikasa_reply('warning') + "No active batch!")
+        return
+    
+    result = await save_batch(context)
+    if not result:
+        await update.message.reply_text(mikasa_reply('error') + "Failed to save batch!")
+        return
+    
+    batch_link, failed_count = result
+    failed_text = f"\n\n{failed_count} file(s) failed to store and were left out." if failed_count else ""
     await update.message.reply_text(
-        mikasa_reply('success') + f"Batch stored!\nShare link:\n{batch_link}"
+        mikasa_reply('success') + f"Batch stored!\nShare link:\n{batch_link}{failed_text}"
     )
-    context.user_data.pop('batch')
 
 # ========== FILE HANDLING ========== #
 @admin_only
@@ -946,6 +1081,7 @@ async def rename_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return ConversationHandler.END
 
+@metrics.timed("store_file")
 @admin_only
 async def store_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Check if update.message exists
@@ -975,84 +1111,427 @@ async def store_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         custom_filename = context.user_data.pop('custom_filename')
         logging.info(f"Using custom filename '{custom_filename}' for file {file_id}")
     
+    # Album messages are collected and stored together
+    if update.message.media_group_id:
+        buffer_album_message(update, context, file_id, custom_filename)
+        return
+    
+    file_link = f"t.me/{context.bot.username}?start={file_id}"
+    
+    in_batch = 'batch' in context.user_data
+    
+    # Check whether this exact media is already stored
+    unique_id = get_file_unique_id(update.message)
+    existing = await find_stored_duplicate(unique_id)
+    if existing:
+        existing_id, existing_data = existing
+        if not custom_filename or custom_filename == existing_data.get("custom_name"):
+            # Plain re-upload: hand back the existing file instead of storing a copy
+            existing_link = f"t.me/{context.bot.username}?start={existing_id}"
+            logging.info(f"Upload is a duplicate of stored file {existing_id}")
+            if in_batch:
+                context.user_data['batch'].append(existing_id)
+                context.user_data.setdefault('batch_records', {})[existing_id] = existing_data
+                reply_text = "File already stored, added to batch! Send more or /lastbatch"
+            else:
+                reply_text = f"File already stored!\nLink: {existing_link}"
+            await update.message.reply_text(mikasa_reply('success') + reply_text)
+            return
+        logging.info(f"Upload is a duplicate of stored file {existing_id}, aliasing it as '{custom_filename}'")
+    
     try:
-        # Forward the message to the database channel
-        msg = await context.bot.forward_message(
-            chat_id=DATABASE_CHANNEL,
-            from_chat_id=update.message.chat_id,
-            message_id=update.message.message_id
-        )
-        
-        file_link = f"t.me/{context.bot.username}?start={file_id}"
-        
-        # Store complete file metadata in links channel if configured
-        link_msg_id = None
-        if LINKS_CHANNEL:
-            try:
-                # Include ALL metadata in the links channel message
-                media_type = get_media_type(update.message)
-                caption = update.message.caption or ""
-                date_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                
-                # Enhanced metadata format with ALL necessary information
-                link_msg = await context.bot.send_message(
-                    chat_id=LINKS_CHANNEL,
-                    text=f"🔗 File Link\n\n"
-                         f"ID: {file_id}\n"
-                         f"Name: {custom_filename if custom_filename else 'Unnamed file'}\n"
-                         f"Type: {media_type}\n"
-                         f"Date: {date_str}\n"
-                         f"Caption: {caption}\n"
-                         f"Message ID: {msg.message_id}\n\n"
-                         f"Link: {file_link}\n\n"
-                         f"#file_{file_id}"  # Add hashtag for easier searching
-                )
-                link_msg_id = link_msg.message_id
-                logging.info(f"Stored complete file metadata in links channel, message ID: {link_msg_id}")
-            except Exception as e:
-                logging.error(f"Failed to store file metadata in links channel: {e}")
-        
-        # For backward compatibility, still store minimal metadata locally
-        # This will be phased out in future versions
-        try:
-            with open(FILE_DATABASE, 'r+') as f:
-                try:
-                    files = json.load(f)
-                    if not isinstance(files, dict):
-                        files = {}
-                except json.JSONDecodeError:
-                    files = {}
-                
-                # Store only essential metadata for link recognition
-                files[file_id] = {
-                    "message_id": msg.message_id,
-                    "custom_name": custom_filename,
-                    "media_type": get_media_type(update.message),
-                    "file_link": file_link,
-                    "links_channel_msg_id": link_msg_id  # Store reference to links channel message
-                }
-                f.seek(0)
-                f.truncate()
-                json.dump(files, f)
-                logging.info(f"Stored minimal file metadata locally for backward compatibility")
-        except Exception as e:
-            # If local storage fails, it's not critical anymore since we have complete metadata in links channel
-            logging.warning(f"Failed to store local metadata, but links channel storage succeeded: {e}")
+        # Hand the channel writes and persistence to the ingestion workers.
+        # An alias of a stored file reuses its database channel message, so nothing is forwarded.
+        job = ingestion_queue.submit(file_id, update.message.chat_id, context.bot, {
+            "file_id": file_id,
+            "from_chat_id": update.message.chat_id,
+            "source_message_id": update.message.message_id,
+            "custom_name": custom_filename,
+            "media_type": get_media_type(update.message),
+            "caption": update.message.caption or "",
+            "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "file_link": file_link,
+            "file_unique_id": unique_id,
+            "message_id": existing[1]["message_id"] if existing else None,
+            "links_channel_msg_id": None,
+            # Batch files are written to the links channel together by /lastbatch
+            "defer_links": in_batch
+        })
+        if not existing:
+            await register_unique_file(unique_id, file_id, job)
         
         # Handle batch
-        if 'batch' in context.user_data:
+        if in_batch:
             context.user_data['batch'].append(file_id)
+            context.user_data.setdefault('batch_records', {})[file_id] = job.data
             batch_files = context.user_data['batch']
             logging.info(f"Added file {file_id} to batch, now contains {len(batch_files)} files")
             reply_text = "File added to batch! Send more or /lastbatch"
         else:
-            reply_text = f"File stored!\nLink: {file_link}"
+            reply_text = f"File queued for storage!\nLink: {file_link}"
         
         await update.message.reply_text(mikasa_reply('success') + reply_text)
     except Exception as e:
         logging.error(f"Error storing file: {e}")
         await update.message.reply_text(mikasa_reply('error') + "Failed to store file!")
 
+def get_file_unique_id(message):
+    """Return the file_unique_id of the media in a message, or None"""
+    if message.photo:
+        return message.photo[-1].file_unique_id
+    for media in (message.video, message.audio, message.document, message.animation,
+                  message.voice, message.video_note, message.sticker):
+        if media:
+            return media.file_unique_id
+    return None
+
+async def get_unique_file_index():
+    """Return the file_unique_id -> file_id index, building it from the file database on first use"""
+    global unique_file_index
+    metrics.record_cache("unique_file_index", unique_file_index is not None)
+    if unique_file_index is None:
+        index = {}
+        try:
+            files = await json_store.load_records(FILE_DATABASE, parse_files)
+            for fid, record in files.items():
+                if record.file_unique_id:
+                    # Aliases share the unique ID; keep the first stored copy
+                    index.setdefault(record.file_unique_id, fid)
+        except Exception as e:
+            logging.error(f"Error building unique file index: {e}")
+        unique_file_index = index
+        logging.info(f"Built unique file index with {len(index)} entries")
+    return unique_file_index
+
+async def register_unique_file(unique_id, file_id, job):
+    """Index a file being ingested, dropping it again if ingestion fails"""
+    if not unique_id:
+        return
+    index = await get_unique_file_index()
+    index.setdefault(unique_id, file_id)
+    
+    def forget_on_failure(future):
+        if (future.cancelled() or future.exception()) and index.get(unique_id) == file_id:
+            del index[unique_id]
+    job.future.add_done_callback(forget_on_failure)
+
+async def get_local_file(file_id):
+    """Return a file's record from the local file database, or None"""
+    try:
+        files = await json_store.load_records(FILE_DATABASE, parse_files)
+        if file_id in files:
+            return files[file_id].to_dict()
+    except Exception as e:
+        logging.warning(f"Error reading local file database: {e}")
+    return None
+
+async def find_stored_duplicate(unique_id):
+    """Return (file_id, record) of an already stored copy of the same media, or None"""
+    if not unique_id:
+        return None
+    index = await get_unique_file_index()
+    existing_id = index.get(unique_id)
+    if not existing_id:
+        return None
+    
+    # The earlier copy may still be on its way to storage
+    await ingestion_queue.wait_for([existing_id], timeout=30)
+    existing_data = await get_local_file(existing_id)
+    if not existing_data or not existing_data.get("message_id"):
+        # Stale index entry
+        if index.get(unique_id) == existing_id:
+            del index[unique_id]
+        return None
+    return existing_id, existing_data
+
+def buffer_album_message(update: Update, context: ContextTypes.DEFAULT_TYPE, file_id, custom_filename):
+    """Collect a message that belongs to an album until the whole album has arrived"""
+    message = update.message
+    key = (message.chat_id, message.media_group_id)
+    
+    album = album_buffers.get(key)
+    if album is None:
+        album = album_buffers[key] = {
+            "chat_id": message.chat_id,
+            "user_data": context.user_data,
+            "entries": []
+        }
+        # Telegram delivers album messages back to back, so a short window catches all of them
+        context.job_queue.run_once(flush_album, ALBUM_WINDOW, data=key, name=f"album_{message.media_group_id}")
+    
+    album["entries"].append({
+        "file_id": file_id,
+        "file_unique_id": get_file_unique_id(message),
+        "source_message_id": message.message_id,
+        "custom_name": custom_filename,
+        "media_type": get_media_type(message),
+        "caption": message.caption or ""
+    })
+    logging.info(f"Buffered album message {message.message_id} as file {file_id}")
+
+async def flush_album(context: CallbackContext, key=None):
+    """Queue a buffered album as a single ingestion job (the job's album, or ``key``'s)"""
+    if key is None:
+        key = context.job.data
+    album = album_buffers.pop(key, None)
+    if not album:
+        return
+    media_group_id = key[1]
+    
+    entries = sorted(album["entries"], key=lambda entry: entry["source_message_id"])
+    user_data = album["user_data"]
+    chat_id = album["chat_id"]
+    date_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    # Media that is already stored is reused instead of forwarded again
+    file_ids = []
+    new_entries = []
+    existing_records = {}
+    for entry in entries:
+        existing = await find_stored_duplicate(entry["file_unique_id"])
+        if existing:
+            existing_id, existing_data = existing
+            logging.info(f"Album message {entry['source_message_id']} is a duplicate of stored file {existing_id}")
+            file_ids.append(existing_id)
+            existing_records[existing_id] = existing_data
+        else:
+            entry["file_link"] = f"t.me/{context.bot.username}?start={entry['file_id']}"
+            entry["date"] = date_str
+            file_ids.append(entry["file_id"])
+            new_entries.append(entry)
+    
+    # In batch mode the album joins the active batch, otherwise it becomes its own batch
+    in_batch = 'batch' in user_data
+    batch_id = None if in_batch else str(uuid.uuid4())
+    
+    try:
+        if new_entries or batch_id:
+            # Keyed by the album, not its first file, which may be a stored duplicate with a job of its own
+            job = ingestion_queue.submit(batch_id or f"album_{media_group_id}", chat_id, context.bot, {
+                "album": True,
+                "batch_id": batch_id,
+                "batch_files": file_ids,
+                "from_chat_id": chat_id,
+                "entries": new_entries,
+                "existing": existing_records,
+                "date": date_str,
+                "message_ids": None,
+                "links_channel_msg_id": None
+            }, ids=[entry["file_id"] for entry in new_entries])
+            for entry in new_entries:
+                await register_unique_file(entry["file_unique_id"], entry["file_id"], job)
+        
+        if in_batch:
+            user_data['batch'].extend(file_ids)
+            batch_records = user_data.setdefault('batch_records', {})
+            batch_records.update(existing_records)
+            for entry in new_entries:
+                batch_records[entry["file_id"]] = entry
+            logging.info(f"Added album of {len(file_ids)} files to batch, now contains {len(user_data['batch'])} files")
+            reply_text = f"Album of {len(file_ids)} files added to batch! Send more or /lastbatch"
+        else:
+            reply_text = f"Album of {len(file_ids)} files queued for storage!\nShare link:\nt.me/{context.bot.username}?start={batch_id}"
+        
+        if existing_records:
+            reply_text += f"\n\n{len(existing_records)} of them were already stored and have been reused."
+        
+        await context.bot.send_message(chat_id=chat_id, text=mikasa_reply('success') + reply_text)
+    except Exception as e:
+        logging.error(f"Error storing album: {e}")
+        await context.bot.send_message(chat_id=chat_id, text=mikasa_reply('error') + "Failed to store album!")
+
+async def ingest_upload(job, final_attempt):
+    """Ingestion worker step, dispatching albums and single files"""
+    if job.data.get("album"):
+        return await ingest_album(job, final_attempt)
+    return await ingest_file(job, final_attempt)
+
+async def ingest_album(job, final_attempt):
+    """Forward a whole album with one call and record it with a single links channel message"""
+    data = job.data
+    entries = data["entries"]
+    
+    if data["message_ids"] is None and not entries:
+        data["message_ids"] = []
+    elif data["message_ids"] is None:
+        forwarded = await job.bot.forward_messages(
+            chat_id=DATABASE_CHANNEL,
+            from_chat_id=data["from_chat_id"],
+            message_ids=[entry["source_message_id"] for entry in entries]
+        )
+        # Telegram silently skips messages it can't forward, which would break the mapping
+        if len(forwarded) != len(entries):
+            raise ValueError(f"Forwarded {len(forwarded)} of {len(entries)} album messages")
+        data["message_ids"] = [msg.message_id for msg in forwarded]
+    
+    for entry, message_id in zip(entries, data["message_ids"]):
+        entry["message_id"] = message_id
+    
+    # In batch mode the album's records are written by /lastbatch with the rest of the batch
+    batch_id = data["batch_id"]
+    if LINKS_CHANNEL and batch_id and data["links_channel_msg_id"] is None:
+        try:
+            new_records = {entry["file_id"]: entry for entry in entries}
+            records = []
+            for fid in data["batch_files"]:
+                record = new_records.get(fid) or data["existing"][fid]
+                records.append(format_file_record(fid, record["message_id"], record.get("media_type"), record.get("custom_name")))
+            batch_link = f"t.me/{job.bot.username}?start={batch_id}"
+            # An album has at most 10 files, which always fits in one message
+            text = pack_batch_messages(batch_id, batch_link, data["date"], records)[0]
+            link_msg = await job.bot.send_message(chat_id=LINKS_CHANNEL, text=text)
+            data["links_channel_msg_id"] = link_msg.message_id
+            logging.info(f"Stored album metadata in links channel, message ID: {link_msg.message_id}")
+        except Exception as e:
+            # The files are already safe in the database channel, so only retry transient failures
+            if final_attempt or not is_transient(e):
+                logging.error(f"Failed to store album metadata in links channel: {e}")
+            else:
+                raise
+    
+    records = [("file", entry["file_id"], {
+        "message_id": entry["message_id"],
+        "custom_name": entry["custom_name"],
+        "media_type": entry["media_type"],
+        "file_link": entry["file_link"],
+        "file_unique_id": entry["file_unique_id"],
+        "links_channel_msg_id": data["links_channel_msg_id"]
+    }) for entry in entries]
+    if batch_id:
+        records.append(("batch", batch_id, {
+            "files": data["batch_files"],
+            "date": data["date"],
+            "total_files": len(data["batch_files"]),
+            "links_channel_msg_id": data["links_channel_msg_id"]
+        }))
+    return records
+
+async def ingest_file(job, final_attempt):
+    """Ingestion worker step: forward the file to the database channel and record it in the links channel"""
+    data = job.data
+    file_id = data["file_id"]
+    
+    # Forward the message to the database channel (skipped when retrying after it succeeded)
+    if data["message_id"] is None:
+        msg = await job.bot.forward_message(
+            chat_id=DATABASE_CHANNEL,
+            from_chat_id=data["from_chat_id"],
+            message_id=data["source_message_id"]
+        )
+        data["message_id"] = msg.message_id
+    
+    # Store complete file metadata in links channel if configured
+    if LINKS_CHANNEL and data["links_channel_msg_id"] is None and not data["defer_links"]:
+        try:
+            # Enhanced metadata format with ALL necessary information
+            link_msg = await job.bot.send_message(
+                chat_id=LINKS_CHANNEL,
+                text=f"🔗 File Link\n\n"
+                     f"ID: {file_id}\n"
+                     f"Name: {data['custom_name'] if data['custom_name'] else 'Unnamed file'}\n"
+                     f"Type: {data['media_type']}\n"
+                     f"Date: {data['date']}\n"
+                     f"Caption: {data['caption']}\n"
+                     f"Message ID: {data['message_id']}\n\n"
+                     f"Link: {data['file_link']}\n\n"
+                     f"#file_{file_id}"  # Add hashtag for easier searching
+            )
+            data["links_channel_msg_id"] = link_msg.message_id
+            logging.info(f"Stored complete file metadata in links channel, message ID: {link_msg.message_id}")
+        except Exception as e:
+            # The file is already safe in the database channel, so only retry transient failures
+            if final_attempt or not is_transient(e):
+                logging.error(f"Failed to store file metadata in links channel: {e}")
+            else:
+                raise
+    
+    # Store only essential metadata for link recognition
+    return [("file", file_id, {
+        "message_id": data["message_id"],
+        "custom_name": data["custom_name"],
+        "media_type": data["media_type"],
+        "file_link": data["file_link"],
+        "file_unique_id": data["file_unique_id"],
+        "links_channel_msg_id": data["links_channel_msg_id"]  # Store reference to links channel message
+    })]
+
+async def persist_records(records):
+    """Write a group of ingested file and batch records locally, one rewrite per data file"""
+    updates = {FILE_DATABASE: {}, BATCHES_FILE: {}}
+    for job_records in records:
+        for kind, record_id, record in job_records:
+            updates[FILE_DATABASE if kind == "file" else BATCHES_FILE][record_id] = record
+    
+    for path, new_records in updates.items():
+        if not new_records:
+            continue
+        await json_store.update(path, lambda data, new_records=new_records: data.update(new_records), {})
+        logging.info(f"Stored {len(new_records)} ingested records in {path}")
+
+async def report_ingestion(bot, chat_id, status):
+    """Create or update the admin's ingestion status message"""
+    done, queued, failed = status["done"], status["queued"], status["failed"]
+    
+    # A single successful upload is already acknowledged by its link reply
+    if status["message_id"] is None and queued == 0 and done == 1 and not failed:
+        return
+    
+    if queued:
+        text = f"📥 Storing files: {done} stored, {queued} in progress"
+    else:
+        text = f"✅ Finished storing files: {done} stored"
+    if failed:
+        text += f", {failed} failed"
+    
+    if status["message_id"] is None:
+        msg = await bot.send_message(chat_id=chat_id, text=text)
+        status["message_id"] = msg.message_id
+    else:
+        await bot.edit_message_text(chat_id=chat_id, message_id=status["message_id"], text=text)
+
+async def report_ingestion_failure(job, error):
+    """Tell the admin that an upload was not stored and which link it already handed out is dead"""
+    data = job.data
+    message_ids = data.get("message_ids") if data.get("album") else [data["message_id"]]
+    if job.record is not None:
+        # Forwarded and recorded in the links channel, but the local store rejected the record
+        await job.bot.send_message(
+            chat_id=job.chat_id,
+            text=mikasa_reply('warning') + f"Couldn't save the record for database channel message(s) "
+                 f"{', '.join(map(str, message_ids))}: {error}\n\n"
+                 "The record is kept and saving is retried in the background; the link works once it succeeds."
+        )
+        return
+    
+    if data.get("album"):
+        what = f"an album of {len(data['entries'])} files"
+        if data["batch_id"]:
+            note = f"Discard this share link, it won't work:\nt.me/{job.bot.username}?start={data['batch_id']}"
+        else:
+            note = "Those files will be missing from your batch."
+    else:
+        what = data["custom_name"] or "a file"
+        if data["defer_links"]:
+            note = "It will be missing from your batch."
+        else:
+            note = f"Discard this link, it won't work:\n{data['file_link']}"
+    if message_ids and all(message_ids):
+        note = f"It was already forwarded to the database channel as message(s) {', '.join(map(str, message_ids))}.\n" + note
+    await job.bot.send_message(
+        chat_id=job.chat_id,
+        text=mikasa_reply('error') + f"Failed to store {what}: {error}\n\n{note}\nPlease send it again."
+    )
+
+# Background workers that store uploaded files
+ingestion_queue = IngestionQueue(ingest_upload, persist_records, report_ingestion, workers=INGEST_WORKERS,
+                                 on_failure=report_ingestion_failure)
+
+# Albums being collected: (chat_id, media_group_id) -> buffered messages
+album_buffers = {}
+
+# file_unique_id -> file_id of the stored copy, built lazily by get_unique_file_index
+unique_file_index = None
+
 def get_media_type(message):
     """Determine the type of media in a message"""
     if message.photo:
@@ -1074,26 +1553,68 @@ def get_media_type(message):
     else:
         return "unknown"
 
+async def notify_delivery_queued(update: Update, user_id):
+    """Tell the user where they are in the delivery queue when the bot is saturated"""
+    position = delivery_scheduler.position((TENANT, user_id))
+    if position:
+        try:
+            await update.message.reply_text(
+                mikasa_reply('info') + f"Delivery queued, position {position}. Your files will arrive shortly."
+            )
+        except Exception as e:
+            logging.error(f"Failed to send queue position to user {user_id}: {e}")
+
+async def read_packed_batch_files(bot, batch_id, first_message_id):
+    """Return file_id -> record for a batch's files from its links channel posts, saving them locally
+    
+    Posts are read by forwarding them to the database channel, and the
+    copies are deleted afterwards.
+    """
+    forwarded = []
+    
+    async def read_text(message_id):
+        msg = await read_links_channel_message(bot, DATABASE_CHANNEL, message_id)
+        if not msg:
+            return None
+        forwarded.append(msg.message_id)
+        return msg.text
+    
+    try:
+        files = await read_batch_files(read_text, batch_id, first_message_id)
+    finally:
+        if forwarded:
+            try:
+                await bot.delete_messages(chat_id=DATABASE_CHANNEL, message_ids=forwarded)
+            except Exception as e:
+                logging.error(f"Error deleting batch record forwards: {e}")
+    
+    if files:
+        def add(data):
+            for fid, record in files.items():
+                data.setdefault(fid, record)
+        await json_store.update(FILE_DATABASE, add, {})
+        logging.info(f"Recovered {len(files)} records of batch {batch_id} from the links channel")
+    return files
+
+@metrics.timed("send_file")
 async def send_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     file_id = context.args[0] if context.args else None
     
     # Check ban status
     try:
-        with open(BANNED_USERS_FILE, 'r') as f:
-            banned_users = json.load(f)
-            if not isinstance(banned_users, list):
-                banned_users = []
-            
-            if str(user_id) in banned_users or user_id in banned_users:
-                await update.message.reply_text(mikasa_reply('ban') + "Banned!")
-                return
+        with tracing.span("ban_check"):
+            banned_users = await json_store.load_records(BANNED_USERS_FILE, parse_banned_users)
+        if str(user_id) in banned_users:
+            await update.message.reply_text(mikasa_reply('ban') + "Banned!")
+            return
     except Exception as e:
         logging.error(f"Error checking ban status: {e}")
     
     # Check token verification only if enabled
     if TOKEN_VERIFICATION_ENABLED:
-        has_valid_token = check_user_token(user_id)
+        with tracing.span("token_check"):
+            has_valid_token = await check_user_token(user_id)
         
         if not has_valid_token:
             # User doesn't have a valid token
@@ -1125,7 +1646,8 @@ async def send_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Force subscription check
     if FORCE_SUB != 0:
         try:
-            member = await context.bot.get_chat_member(FORCE_SUB, user_id)
+            with tracing.span("force_sub"):
+                member = await context.bot.get_chat_member(FORCE_SUB, user_id)
             if member.status not in ['member', 'administrator', 'creator']:
                 await update.message.reply_text(
                     mikasa_reply('warning') + "Join channel first!",
@@ -1143,49 +1665,50 @@ async def send_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Handle file/batch sending
     try:
-        # First try to get file data from local storage (for backward compatibility)
-        file_data = None
-        try:
-            with open(FILE_DATABASE, 'r') as f:
-                try:
-                    files = json.load(f)
-                    if isinstance(files, dict) and file_id in files:
-                        file_data = files[file_id]
-                        logging.info(f"Found file {file_id} in local storage")
-                except json.JSONDecodeError:
-                    pass
-        except Exception as e:
-            logging.warning(f"Error reading local file database: {e}")
-        
-        # If file not found in local storage, search in links channel
-        if not file_data or not isinstance(file_data, dict):
-            logging.info(f"File {file_id} not found in local storage, searching links channel")
-            file_data = await search_links_channel_for_file(context, file_id)
+        # A freshly uploaded file may still be on its way to storage
+        with tracing.span("ingestion_wait"):
+            await ingestion_queue.wait_for([file_id], timeout=30)
+        
+        with tracing.span("resolve", file_id=file_id):
+            # First try to get file data from local storage (for backward compatibility)
+            file_record = None
+            files = {}
+            try:
+                files = await json_store.load_records(FILE_DATABASE, parse_files)
+                file_record = files.get(file_id)
+                if file_record:
+                    logging.info(f"Found file {file_id} in local storage")
+            except Exception as e:
+                logging.warning(f"Error reading local file database: {e}")
             
-            if file_data:
-                logging.info(f"Found file {file_id} in links channel")
-            else:
-                logging.warning(f"File {file_id} not found in links channel")
+            # If file not found in local storage, search in links channel
+            if not file_record:
+                logging.info(f"File {file_id} not found in local storage, searching links channel")
+                file_record = FileRecord.from_dict(await search_links_channel_for_file(context, file_id))
+                
+                if file_record:
+                    logging.info(f"Found file {file_id} in links channel")
+                else:
+                    logging.warning(f"File {file_id} not found in links channel")
         
-        if file_data and isinstance(file_data, dict):
+        if file_record:
             # Single file found either in local storage or links channel
-            message_id = file_data.get("message_id")
-            if not message_id:
-                await update.message.reply_text(mikasa_reply('warning') + "Invalid file data - missing message ID!")
-                return
-            
-            custom_name = file_data.get("custom_name")
-            caption = f"{custom_name}" if custom_name else None
+            message_id = file_record.message_id
+            caption = file_record.custom_name or None
             
             try:
-                # Copy the message
-                sent_msg = await context.bot.copy_message(
-                    chat_id=update.effective_chat.id,
-                    from_chat_id=DATABASE_CHANNEL,
-                    message_id=message_id,
-                    caption=caption,
-                    protect_content=True
-                )
+                with tracing.span("copy", message_id=message_id):
+                    # Copy the message through the delivery scheduler
+                    delivery = delivery_scheduler.submit((TENANT, user_id), tracing.bind(functools.partial(
+                        context.bot.copy_message,
+                        chat_id=update.effective_chat.id,
+                        from_chat_id=DATABASE_CHANNEL,
+                        message_id=message_id,
+                        caption=caption,
+                        protect_content=True
+                    )))
+                    await notify_delivery_queued(update, user_id)
+                    sent_msg = await delivery
                 logging.info(f"Sent file {file_id} (message ID {message_id}) to user {user_id}")
                 
                 # Schedule auto-delete if enabled
@@ -1204,114 +1727,90 @@ async def send_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             # File not found, check if it's a batch
             # First try local storage for backward compatibility
-            batch_data = None
+            batch_record = None
             try:
-                with open(BATCHES_FILE, 'r') as bf:
-                    try:
-                        batches = json.load(bf)
-                        if isinstance(batches, dict) and file_id in batches:
-                            batch_data = batches[file_id]
-                            logging.info(f"Found batch {file_id} in local storage")
-                    except json.JSONDecodeError:
-                        pass
+                batches = await json_store.load_records(BATCHES_FILE, parse_batches)
+                batch_record = batches.get(file_id)
+                if batch_record:
+                    logging.info(f"Found batch {file_id} in local storage")
             except Exception as e:
                 logging.warning(f"Error reading local batch database: {e}")
             
             # If batch not found in local storage, search in links channel
-            if not batch_data:
+            if not batch_record:
                 logging.info(f"Batch {file_id} not found in local storage, searching links channel")
                 batch_data = await search_links_channel_for_batch(context, file_id)
                 
-                if batch_data:
-                    logging.info(f"Found batch {file_id} in links channel")
-                else:
+                if not batch_data:
                     logging.warning(f"Batch {file_id} not found in links channel")
                     await update.message.reply_text(mikasa_reply('warning') + "File or batch not found!")
                     return
-            
-            if batch_data:
-                # Get batch files
-                batch_files = []
                 
-                # Handle different batch data formats
-                if isinstance(batch_data, list):
-                    # Old format: just a list of file IDs
-                    batch_files = batch_data
-                    logging.info(f"Processing batch {file_id} with files (old format): {batch_files}")
-                elif isinstance(batch_data, dict):
-                    # New format: dict with files and metadata
-                    if "files" in batch_data and isinstance(batch_data["files"], list):
-                        batch_files = batch_data["files"]
-                        logging.info(f"Processing batch {file_id} with files (new format): {batch_files}")
-                    else:
-                        logging.warning(f"Invalid batch data format for {file_id}: {batch_data}")
-                else:
-                    logging.warning(f"Unrecognized batch data type for {file_id}: {type(batch_data)}")
-                
-                if not batch_files:
+                # Both the old (list) and new (dict) batch formats load into one record type
+                batch_record = BatchRecord.from_data(batch_data)
+                if not batch_record:
+                    logging.warning(f"Invalid batch data format for {file_id}: {batch_data}")
                     await update.message.reply_text(mikasa_reply('warning') + "Invalid batch data!")
                     return
+                logging.info(f"Found batch {file_id} in links channel")
+            
+            if batch_record:
+                batch_files = batch_record.files
+                logging.info(f"Processing batch {file_id} with {len(batch_files)} files")
                 
                 sent_messages = []
                 missing_files = []
+                deliveries = []
                 
-                # Process each file in the batch
-                for fid in batch_files:
-                    # First try to get file data from local storage
-                    file_data = None
+                # Files missing locally are read from the batch's packed links channel posts
+                packed_files = {}
+                if LINKS_CHANNEL and batch_record.links_channel_msg_id and any(fid not in files for fid in batch_files):
                     try:
-                        with open(FILE_DATABASE, 'r') as f:
-                            try:
-                                files = json.load(f)
-                                if isinstance(files, dict) and fid in files:
-                                    file_data = files[fid]
-                                    logging.info(f"Found batch file {fid} in local storage")
-                            except json.JSONDecodeError:
-                                pass
+                        packed_files = await read_packed_batch_files(context.bot, file_id, batch_record.links_channel_msg_id)
                     except Exception as e:
-                        logging.warning(f"Error reading local file database for batch file {fid}: {e}")
+                        logging.error(f"Error reading batch {file_id} records from links channel: {e}")
+                
+                # Resolve each file in the batch, then queue all copies at once so the
+                # scheduler can interleave them fairly with other users' deliveries
+                for fid in batch_files:
+                    # First try to get file data from local storage (loaded once above)
+                    file_record = files.get(fid) or FileRecord.from_dict(packed_files.get(fid))
                     
                     # If file not found in local storage, search in links channel
-                    if not file_data or not isinstance(file_data, dict):
+                    if not file_record:
                         logging.info(f"Batch file {fid} not found in local storage, searching links channel")
-                        file_data = await search_links_channel_for_file(context, fid)
+                        file_record = FileRecord.from_dict(await search_links_channel_for_file(context, fid))
                         
-                        if file_data:
+                        if file_record:
                             logging.info(f"Found batch file {fid} in links channel")
                         else:
                             logging.warning(f"Batch file {fid} not found in links channel")
                             missing_files.append(fid)
                             continue
                     
-                    # Process the file if found
-                    if file_data and isinstance(file_data, dict):
-                        message_id = file_data.get("message_id")
-                        if not message_id:
-                            logging.warning(f"Missing message_id for batch file {fid}")
-                            missing_files.append(fid)
-                            continue
-                        
-                        custom_name = file_data.get("custom_name")
-                        caption = f"{custom_name}" if custom_name else None
-                        
+                    # Queue the file
+                    deliveries.append((fid, file_record.message_id, delivery_scheduler.submit((TENANT, user_id), tracing.bind(functools.partial(
+                        context.bot.copy_message,
+                        chat_id=update.effective_chat.id,
+                        from_chat_id=DATABASE_CHANNEL,
+                        message_id=file_record.message_id,
+                        caption=file_record.custom_name or None,
+                        protect_content=True
+                    )))))
+                
+                if deliveries:
+                    await notify_delivery_queued(update, user_id)
+                
+                # Wait for the queued copies in batch order
+                with tracing.span("copy", files=len(deliveries)):
+                    for fid, message_id, delivery in deliveries:
                         try:
-                            sent_msg = await context.bot.copy_message(
-                                chat_id=update.effective_chat.id,
-                                from_chat_id=DATABASE_CHANNEL,
-                                message_id=message_id,
-                                caption=caption,
-                                protect_content=True
-                            )
+                            sent_msg = await delivery
                             sent_messages.append(sent_msg.message_id)
                             logging.info(f"Sent batch file {fid} (message ID {message_id}) to user {user_id}")
                         except Exception as e:
                             logging.error(f"Error sending batch file {fid}: {e}")
                             missing_files.append(fid)
-                        
-                        await asyncio.sleep(1)  # Prevent flooding
-                    else:
-                        logging.warning(f"Invalid data for batch file {fid}")
-                        missing_files.append(fid)
                 
                 # Notify user about missing files if any
                 if missing_files:
@@ -1442,6 +1941,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "/unban <user_id> - Unban a user\n"
                 "/listbanned - List banned users\n"
                 "/settings - Show current settings\n"
+                "/metrics - Show latency, API call and storage stats\n"
                 "/restart - Restart the bot"
             )
         
@@ -1450,7 +1950,10 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             help_text += (
                 "\n\nOwner Commands:\n"
                 "/customize - Modify bot settings without redeploying\n"
-                "/cleanup - Clean all metadata from owner's device"
+                "/cleanup - Clean all metadata from owner's device\n"
+                "/backup - Snapshot the data files\n"
+                "/restore [snapshot] - List snapshots or restore one\n"
+                "/profile <seconds> [cprofile] - Profile the running bot"
             )
         
         keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="menu")]]
@@ -1544,6 +2047,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     elif query.data == "start_batch" and query.from_user.id in ADMINS:
         context.user_data['batch'] = []
+        context.user_data['batch_records'] = {}
         logging.info(f"Started new batch for user {query.from_user.id} via menu")
         
         keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="menu")]]
@@ -1555,111 +2059,30 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
     
     elif query.data == "end_batch" and query.from_user.id in ADMINS:
+        keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="menu")]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
         if 'batch' not in context.user_data or not context.user_data['batch']:
-            keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="menu")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
             await query.edit_message_text(
                 mikasa_reply('warning') + "No active batch!",
                 reply_markup=reply_markup
             )
             return
         
-        batch_files = context.user_data['batch']
-        logging.info(f"Ending batch with {len(batch_files)} files via menu: {batch_files}")
-        
-        batch_id = str(uuid.uuid4())
-        try:
-            with open(BATCHES_FILE, 'r+') as f:
-                try:
-                    batches = json.load(f)
-                    if not isinstance(batches, dict):
-                        batches = {}
-                except json.JSONDecodeError:
-                    batches = {}
-                
-                batches[batch_id] = batch_files
-                f.seek(0)
-                f.truncate()
-                json.dump(batches, f)
-                logging.info(f"Saved batch {batch_id} with files: {batch_files}")
-        except Exception as e:
-            logging.error(f"Error saving batch: {e}")
-            keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="menu")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
+        result = await save_batch(context)
+        if not result:
             await query.edit_message_text(
                 mikasa_reply('error') + "Failed to save batch!",
                 reply_markup=reply_markup
             )
             return
         
-        batch_link = f"t.me/{context.bot.username}?start={batch_id}"
-        
-        # Store complete batch metadata in links channel if configured
-        link_msg_id = None
-        if LINKS_CHANNEL:
-            try:
-                # Include ALL metadata in the links channel message
-                date_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                
-                # Format the file list for display
-                files_str = ", ".join(batch_files)
-                if len(files_str) > 100:  # Truncate if too long
-                    files_str = files_str[:97] + "..."
-                
-                # Enhanced metadata format with ALL necessary information
-                link_msg = await context.bot.send_message(
-                    chat_id=LINKS_CHANNEL,
-                    text=f"🔗 Batch Link\n\n"
-                         f"ID: {batch_id}\n"
-                         f"Files: {files_str}\n"
-                         f"Date: {date_str}\n"
-                         f"Total Files: {len(batch_files)}\n"
-                         f"Link: {batch_link}\n\n"
-                         f"#batch_{batch_id}\n"
-                         f"#batch_files_{','.join(batch_files)}"  # Store file IDs in a searchable format
-                )
-                link_msg_id = link_msg.message_id
-                logging.info(f"Stored complete batch metadata in links channel, message ID: {link_msg_id}")
-            except Exception as e:
-                logging.error(f"Failed to store batch metadata in links channel: {e}")
-        
-        # For backward compatibility, still store batch data locally
-        # This will be phased out in future versions
-        try:
-            with open(BATCHES_FILE, 'r+') as f:
-                try:
-                    batches = json.load(f)
-                    if not isinstance(batches, dict):
-                        batches = {}
-                except json.JSONDecodeError:
-                    batches = {}
-                
-                # Store batch data with enhanced metadata
-                batches[batch_id] = {
-                    "files": batch_files,
-                    "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "total_files": len(batch_files),
-                    "links_channel_msg_id": link_msg_id
-                }
-                
-                f.seek(0)
-                f.truncate()
-                json.dump(batches, f)
-                logging.info(f"Stored batch metadata locally for backward compatibility")
-        except Exception as e:
-            # If local storage fails, it's not critical anymore since we have complete metadata in links channel
-            logging.warning(f"Failed to store local batch metadata, but links channel storage succeeded: {e}")
-        
-        keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
+        batch_link, failed_count = result
+        failed_text = f"\n\n{failed_count} file(s) failed to store and were left out." if failed_count else ""
         await query.edit_message_text(
-            mikasa_reply('success') + f"Batch stored!\nShare link:\n{batch_link}",
+            mikasa_reply('success') + f"Batch stored!\nShare link:\n{batch_link}{failed_text}",
             reply_markup=reply_markup
         )
-        context.user_data.pop('batch')
     
     elif query.data == "rename_file" and query.from_user.id in ADMINS:
         # Set awaiting_rename flag
@@ -1836,106 +2259,89 @@ async def group_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     await update.message.reply_text(stats_text)
 async def update_group_stats(chat_id, action_type, user_id=None, search_term=None):
     """Update statistics for a group chat"""
+    def record(stats):
+        # Initialize group stats if not exists
+        if chat_id not in stats:
+            stats[chat_id] = {
+                "total_files": 0,
+                "total_searches": 0,
+                "active_members": {},
+                "search_terms": {},
+                "last_activity": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+        
+        # Update stats based on action type
+        if action_type == "file":
+            stats[chat_id]["total_files"] += 1
+        elif action_type == "search":
+            stats[chat_id]["total_searches"] += 1
+            if search_term:
+                if search_term not in stats[chat_id]["search_terms"]:
+                    stats[chat_id]["search_terms"][search_term] = 0
+                stats[chat_id]["search_terms"][search_term] += 1
+        
+        # Update active members
+        if user_id:
+            user_id_str = str(user_id)
+            if user_id_str not in stats[chat_id]["active_members"]:
+                stats[chat_id]["active_members"][user_id_str] = 0
+            stats[chat_id]["active_members"][user_id_str] += 1
+        
+        # Update last activity
+        stats[chat_id]["last_activity"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
     try:
-        with open(GROUP_STATS_FILE, 'r+') as f:
-            try:
-                stats = json.load(f)
-                if not isinstance(stats, dict):
-                    stats = {}
-            except json.JSONDecodeError:
-                stats = {}
-            
-            # Initialize group stats if not exists
-            if chat_id not in stats:
-                stats[chat_id] = {
-                    "total_files": 0,
-                    "total_searches": 0,
-                    "active_members": {},
-                    "search_terms": {},
-                    "last_activity": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }
-            
-            # Update stats based on action type
-            if action_type == "file":
-                stats[chat_id]["total_files"] += 1
-            elif action_type == "search":
-                stats[chat_id]["total_searches"] += 1
-                if search_term:
-                    if search_term not in stats[chat_id]["search_terms"]:
-                        stats[chat_id]["search_terms"][search_term] = 0
-                    stats[chat_id]["search_terms"][search_term] += 1
-            
-            # Update active members
-            if user_id:
-                user_id_str = str(user_id)
-                if user_id_str not in stats[chat_id]["active_members"]:
-                    stats[chat_id]["active_members"][user_id_str] = 0
-                stats[chat_id]["active_members"][user_id_str] += 1
-            
-            # Update last activity
-            stats[chat_id]["last_activity"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            # Write updated stats back to file
-            f.seek(0)
-            f.truncate()
-            json.dump(stats, f)
-            
-            logging.info(f"Updated group stats for chat {chat_id}, action: {action_type}")
+        await json_store.update(GROUP_STATS_FILE, record, {})
+        logging.info(f"Updated group stats for chat {chat_id}, action: {action_type}")
     except Exception as e:
         logging.error(f"Error updating group stats: {e}")
 
 async def get_group_stats(chat_id, context):
     """Get group statistics"""
     try:
-        with open(GROUP_STATS_FILE, 'r') as f:
-            try:
-                stats = json.load(f)
-                if not isinstance(stats, dict):
-                    stats = {}
-            except json.JSONDecodeError:
-                stats = {}
-            
-            # Return default stats if group not found
-            if chat_id not in stats:
-                return {
-                    "total_files": 0,
-                    "total_searches": 0,
-                    "active_members": 0,
-                    "most_active_user": "None",
-                    "most_searched_term": "None",
-                    "last_activity": "Never"
-                }
-            
-            group_stats = stats[chat_id]
-            
-            # Get most active user
-            most_active_user = "None"
-            max_activity = 0
-            for user_id, activity in group_stats.get("active_members", {}).items():
-                if activity > max_activity:
-                    max_activity = activity
-                    try:
-                        user = await context.bot.get_chat_member(int(chat_id), int(user_id))
-                        most_active_user = user.user.first_name
-                    except:
-                        most_active_user = f"User {user_id}"
-            
-            # Get most searched term
-            most_searched_term = "None"
-            max_searches = 0
-            for term, count in group_stats.get("search_terms", {}).items():
-                if count > max_searches:
-                    max_searches = count
-                    most_searched_term = term
-            
+        stats = await json_store.load(GROUP_STATS_FILE, {})
+        
+        # Return default stats if group not found
+        if chat_id not in stats:
             return {
-                "total_files": group_stats.get("total_files", 0),
-                "total_searches": group_stats.get("total_searches", 0),
-                "active_members": len(group_stats.get("active_members", {})),
-                "most_active_user": most_active_user,
-                "most_searched_term": most_searched_term,
-                "last_activity": group_stats.get("last_activity", "Never")
+                "total_files": 0,
+                "total_searches": 0,
+                "active_members": 0,
+                "most_active_user": "None",
+                "most_searched_term": "None",
+                "last_activity": "Never"
             }
+        
+        group_stats = stats[chat_id]
+        
+        # Get most active user
+        most_active_user = "None"
+        max_activity = 0
+        for user_id, activity in group_stats.get("active_members", {}).items():
+            if activity > max_activity:
+                max_activity = activity
+                try:
+                    user = await context.bot.get_chat_member(int(chat_id), int(user_id))
+                    most_active_user = user.user.first_name
+                except:
+                    most_active_user = f"User {user_id}"
+        
+        # Get most searched term
+        most_searched_term = "None"
+        max_searches = 0
+        for term, count in group_stats.get("search_terms", {}).items():
+            if count > max_searches:
+                max_searches = count
+                most_searched_term = term
+        
+        return {
+            "total_files": group_stats.get("total_files", 0),
+            "total_searches": group_stats.get("total_searches", 0),
+            "active_members": len(group_stats.get("active_members", {})),
+            "most_active_user": most_active_user,
+            "most_searched_term": most_searched_term,
+            "last_activity": group_stats.get("last_activity", "Never")
+        }
     except Exception as e:
         logging.error(f"Error getting group stats: {e}")
         return {
@@ -1956,22 +2362,17 @@ async def ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         user_id = int(context.args[0])
-        with open(BANNED_USERS_FILE, 'r+') as f:
-            try:
-                banned = json.load(f)
-                if not isinstance(banned, list):
-                    banned = []
-            except json.JSONDecodeError:
-                banned = []
-            
+        
+        def ban(banned):
             if user_id in banned or str(user_id) in banned:
-                await update.message.reply_text(mikasa_reply('warning') + "Already banned!")
-            else:
-                banned.append(user_id)
-                f.seek(0)
-                f.truncate()
-                json.dump(banned, f)
-                await update.message.reply_text(mikasa_reply('ban') + f"Banned {user_id}!")
+                return False
+            banned.append(user_id)
+            return True
+        
+        if await json_store.update(BANNED_USERS_FILE, ban, []):
+            await update.message.reply_text(mikasa_reply('ban') + f"Banned {user_id}!")
+        else:
+            await update.message.reply_text(mikasa_reply('warning') + "Already banned!")
     except ValueError:
         await update.message.reply_text(mikasa_reply('warning') + "Invalid ID!")
     except Exception as e:
@@ -1986,28 +2387,18 @@ async def unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         user_id = int(context.args[0])
-        with open(BANNED_USERS_FILE, 'r+') as f:
-            try:
-                banned = json.load(f)
-                if not isinstance(banned, list):
-                    banned = []
-            except json.JSONDecodeError:
-                banned = []
-            
-            if user_id in banned:
-                banned.remove(user_id)
-                f.seek(0)
-                f.truncate()
-                json.dump(banned, f)
-                await update.message.reply_text(mikasa_reply('unban') + f"Unbanned {user_id}!")
-            elif str(user_id) in banned:
-                banned.remove(str(user_id))
-                f.seek(0)
-                f.truncate()
-                json.dump(banned, f)
-                await update.message.reply_text(mikasa_reply('unban') + f"Unbanned {user_id}!")
-            else:
-                await update.message.reply_text(mikasa_reply('warning') + "User not banned!")
+        
+        def unban(banned):
+            for entry in (user_id, str(user_id)):
+                if entry in banned:
+                    banned.remove(entry)
+                    return True
+            return False
+        
+        if await json_store.update(BANNED_USERS_FILE, unban, []):
+            await update.message.reply_text(mikasa_reply('unban') + f"Unbanned {user_id}!")
+        else:
+            await update.message.reply_text(mikasa_reply('warning') + "User not banned!")
     except ValueError:
         await update.message.reply_text(mikasa_reply('warning') + "Invalid ID!")
     except Exception as e:
@@ -2017,18 +2408,11 @@ async def unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
 @admin_only
 async def list_banned(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        with open(BANNED_USERS_FILE, 'r') as f:
-            try:
-                banned = json.load(f)
-                if not isinstance(banned, list):
-                    banned = []
-            except json.JSONDecodeError:
-                banned = []
-            
-            if banned:
-                await update.message.reply_text(mikasa_reply('info') + f"Banned users: {', '.join(map(str, banned))}")
-            else:
-                await update.message.reply_text(mikasa_reply('info') + "No banned users!")
+        banned = await json_store.load(BANNED_USERS_FILE, [])
+        if banned:
+            await update.message.reply_text(mikasa_reply('info') + f"Banned users: {', '.join(map(str, banned))}")
+        else:
+            await update.message.reply_text(mikasa_reply('info') + "No banned users!")
     except Exception as e:
         logging.error(f"Error listing banned users: {e}")
         await update.message.reply_text(mikasa_reply('error') + "Failed to list banned users!")
@@ -2047,9 +2431,37 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 """
     await update.message.reply_text(settings_msg)
 
+# Chat that asked for a restart; the process is replaced once the application has shut down
+restart_requested_by = None
+
 @admin_only
 async def restart(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(mikasa_reply('default') + "Rebooting...")
+    """Restart gracefully: stop taking updates, finish work in progress and save state, then exec"""
+    global restart_requested_by
+    if restart_requested_by is not None:
+        await update.message.reply_text(mikasa_reply('warning') + "A restart is already in progress.")
+        return
+    
+    restart_requested_by = update.effective_chat.id
+    note = ""
+    if reindex_task:
+        # The reindex checkpoints every chunk, so /reindex picks up where it stopped
+        reindex_task.cancel()
+        note = "\nThe running reindex was paused; use /reindex to resume it."
+    await update.message.reply_text(
+        mikasa_reply('default') + "Rebooting... finishing uploads and deliveries in progress first." + note
+    )
+    # Returns from run_polling (or run_worker), which runs post_stop and post_shutdown
+    context.application.stop_running()
+
+def exec_restart():
+    """Replace this process with a fresh copy of the bot"""
+    logging.info("Restarting")
+    # tenants.py reads back which bot should report
+    os.environ["RESTART_NOTIFY_CHAT"] = f"{TENANT}:{restart_requested_by}" if TENANT else str(restart_requested_by)
+    log_listener.stop()  # Nothing runs atexit handlers across exec
+    sys.stdout.flush()
+    sys.stderr.flush()
     os.execv(sys.executable, [sys.executable] + sys.argv)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2098,6 +2510,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "/unban <user_id> - Unban a user\n"
             "/listbanned - List banned users\n"
             "/settings - Show current settings\n"
+            "/reindex [restart] - Rebuild the local store from the links channel\n"
+            "/metrics - Show latency, API call and storage stats\n"
             "/restart - Restart the bot"
         )
     
@@ -2106,7 +2520,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         help_text += (
             "\n\nOwner Commands:\n"
             "/customize - Modify bot settings without redeploying\n"
-            "/cleanup - Clean all metadata from owner's device"
+            "/cleanup - Clean all metadata from owner's device\n"
+            "/backup - Snapshot the data files\n"
+            "/restore [snapshot] - List snapshots or restore one\n"
+            "/profile <seconds> [cprofile] - Profile the running bot"
         )
     
     keyboard = [[InlineKeyboardButton("📋 Main Menu", callback_data="menu")]]
@@ -2235,6 +2652,7 @@ async def auto_delete_button_handler(update: Update, context: ContextTypes.DEFAU
             mikasa_reply('error') + f"An error occurred: {str(e)}"
         )
 # ========== GROUP CHAT SEARCH FEATURE ========== #
+@metrics.timed("search_files")
 async def search_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Search for files by keywords, caption, link, or date in any chat"""
     # Get search query
@@ -2279,35 +2697,16 @@ async def search_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         # Load file database
-        with open(FILE_DATABASE, 'r') as f:
-            try:
-                files = json.load(f)
-                if not isinstance(files, dict):
-                    files = {}
-            except json.JSONDecodeError:
-                files = {}
+        files = await json_store.load_records(FILE_DATABASE, parse_files)
         
         # Search for matching files
         matching_files = []
-        for file_id, file_data in files.items():
-            if not isinstance(file_data, dict):
-                continue
-            
-            # Get file metadata
-            custom_name = file_data.get("custom_name", "")
-            caption = file_data.get("caption", "")
-            file_date = file_data.get("date", "")
-            file_link = file_data.get("file_link", "")
-            
-            # Ensure all values are strings to prevent type errors
-            if custom_name is None:
-                custom_name = ""
-            if caption is None:
-                caption = ""
-            if file_date is None:
-                file_date = ""
-            if file_link is None:
-                file_link = ""
+        for file_id, record in files.items():
+            # Record string fields are never None
+            custom_name = record.custom_name
+            caption = record.caption
+            file_date = record.date
+            file_link = record.file_link
             
             # Check if search criteria match
             name_match = search_query and search_query in custom_name.lower()
@@ -2333,43 +2732,25 @@ async def search_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     "caption": caption,
                     "date": file_date,
                     "match_type": match_type,
-                    "media_type": file_data.get("media_type", "unknown")
+                    "media_type": record.media_type
                 })
         
         # Load batch database to include batch names in search
         try:
-            with open(BATCHES_FILE, 'r') as f:
-                try:
-                    batches = json.load(f)
-                    if not isinstance(batches, dict):
-                        batches = {}
-                except json.JSONDecodeError:
-                    batches = {}
+            batches = await json_store.load_records(BATCHES_FILE, parse_batches)
             
             # For each batch, check if it contains files with matching criteria
-            for batch_id, batch_files in batches.items():
-                if not isinstance(batch_files, list):
-                    continue
-                
+            for batch_id, batch_record in batches.items():
                 batch_matches = []
                 match_types = set()
                 
-                for file_id in batch_files:
-                    if file_id in files and isinstance(files[file_id], dict):
-                        custom_name = files[file_id].get("custom_name", "")
-                        caption = files[file_id].get("caption", "")
-                        file_date = files[file_id].get("date", "")
-                        file_link = files[file_id].get("file_link", "")
-                        
-                        # Ensure all values are strings to prevent type errors
-                        if custom_name is None:
-                            custom_name = ""
-                        if caption is None:
-                            caption = ""
-                        if file_date is None:
-                            file_date = ""
-                        if file_link is None:
-                            file_link = ""
+                for file_id in batch_record.files:
+                    record = files.get(file_id)
+                    if record:
+                        custom_name = record.custom_name
+                        caption = record.caption
+                        file_date = record.date
+                        file_link = record.file_link
                         
                         # Check if search criteria match
                         name_match = search_query and search_query in custom_name.lower()
@@ -2510,6 +2891,333 @@ async def refine_search_handler(update: Update, context: ContextTypes.DEFAULT_TY
         "/search anime date:2025-04-01"
     )
 
+# ========== SCHEDULED MAINTENANCE ========== #
+# Telegram won't let bots delete messages older than 48 hours, so older pending deletes are dead weight
+PENDING_DELETE_GRACE = 48 * 3600
+last_compaction = None  # Summary of the last compaction run, for /metrics
+
+async def compact_json_file(path, default, compact):
+    """Apply compact(data) -> (data, removed) to a data file and return (removed, bytes reclaimed, size)
+
+    The compaction runs inside a data store commit, so entries written while
+    it runs aren't lost.
+    """
+    size_before = await json_store.run(json_store.size, path)
+    if size_before is None:
+        return 0, 0, 0
+    
+    removed = await json_store.transform(path, compact, default)
+    if not removed:
+        return 0, 0, size_before
+    
+    size_after = await json_store.run(json_store.size, path) or 0
+    # Writes committed alongside the compaction can make the file grow
+    return removed, max(0, size_before - size_after), size_after
+
+def compact_tokens(tokens):
+    """Drop expired and malformed tokens"""
+    current_time = int(time.time())
+    kept = {
+        token: data for token, data in tokens.items()
+        if isinstance(data, dict) and "user_id" in data and isinstance(data.get("expiry"), (int, float)) and data["expiry"] > current_time
+    }
+    return kept, len(tokens) - len(kept)
+
+def make_pending_deletes_compactor(job_queue):
+    """Return a compactor that drops pending deletes that can no longer happen"""
+    def compact(pending):
+        current_time = int(time.time())
+        removed = 0
+        kept = {}
+        for str_chat_id, messages in pending.items():
+            if not isinstance(messages, dict):
+                removed += 1
+                continue
+            
+            kept_messages = {}
+            for str_message_id, delete_time in messages.items():
+                if not isinstance(delete_time, (int, float)):
+                    removed += 1
+                    continue
+                
+                # Too old for Telegram to delete, or overdue with no job left to delete it (failed delete)
+                overdue = current_time - delete_time
+                orphaned = overdue > 3600 and not job_queue.get_jobs_by_name(f"delete_{str_chat_id}_{str_message_id}")
+                if overdue > PENDING_DELETE_GRACE or orphaned:
+                    removed += 1
+                    continue
+                kept_messages[str_message_id] = delete_time
+            
+            if kept_messages:
+                kept[str_chat_id] = kept_messages
+            elif not messages:
+                removed += 1  # Leftover empty chat entry
+        return kept, removed
+    return compact
+
+def compact_group_stats(stats):
+    """Trim each group's search term counts to the MAX_SEARCH_TERMS most frequent, if a cap is set"""
+    removed = 0
+    if not MAX_SEARCH_TERMS:
+        return stats, removed
+    for chat_stats in stats.values():
+        if not isinstance(chat_stats, dict):
+            continue
+        terms = chat_stats.get("search_terms")
+        if isinstance(terms, dict) and len(terms) > MAX_SEARCH_TERMS:
+            top_terms = sorted(terms.items(), key=lambda item: item[1], reverse=True)[:MAX_SEARCH_TERMS]
+            removed += len(terms) - len(top_terms)
+            chat_stats["search_terms"] = dict(top_terms)
+    return stats, removed
+
+def compact_verified_users(users):
+    """Drop users whose access has expired, and malformed entries"""
+    current_time = int(time.time())
+    kept = {user_id: expiry for user_id, expiry in users.items() if isinstance(expiry, (int, float)) and expiry > current_time}
+    return kept, len(users) - len(kept)
+
+def compact_group_settings(settings):
+    """Drop groups with no settings left"""
+    kept = {chat_id: data for chat_id, data in settings.items() if isinstance(data, dict) and data}
+    return kept, len(settings) - len(kept)
+
+async def compact_data_stores(context: CallbackContext):
+    """Scheduled job that prunes expired and stale entries from the data files"""
+    logging.info("Scheduled data store compaction triggered")
+    
+    compactions = [
+        (TOKENS_FILE, {}, compact_tokens),
+        (VERIFIED_USERS_FILE, {}, compact_verified_users),
+        (PENDING_DELETES_FILE, {}, make_pending_deletes_compactor(context.job_queue)),
+        (GROUP_STATS_FILE, {}, compact_group_stats),
+        (GROUP_SETTINGS_FILE, {}, compact_group_settings),
+    ]
+    
+    global last_compaction
+    total_removed = 0
+    total_reclaimed = 0
+    file_sizes = {}
+    for path, default, compact in compactions:
+        try:
+            removed, reclaimed, size = await compact_json_file(path, default, compact)
+            if removed:
+                logging.info(f"Compacted {path}: removed {removed} entries, reclaimed {reclaimed} bytes")
+            total_removed += removed
+            total_reclaimed += reclaimed
+            file_sizes[os.path.basename(path)] = size
+            metrics.COMPACTION_REMOVED.inc(removed, file=path)
+            metrics.COMPACTION_RECLAIMED_BYTES.inc(reclaimed, file=path)
+            metrics.DATA_FILE_BYTES.set(size, file=path)
+        except Exception as e:
+            logging.error(f"Error compacting {path}: {e}")
+    
+    # Prune in-memory token state as well
+    expired_users = verified_users.prune()
+    current_time = time.time()
+    for user_id in [u for u, (_, _, expiry) in issued_tokens.items() if expiry <= current_time]:
+        del issued_tokens[user_id]
+    metrics.TOKEN_STATE_ENTRIES.set(len(verified_users), tenant=TENANT, state="verified_users")
+    metrics.TOKEN_STATE_ENTRIES.set(len(issued_tokens), tenant=TENANT, state="issued_tokens")
+    
+    # Shown by /metrics
+    last_compaction = {
+        "time": int(current_time),
+        "removed": total_removed,
+        "reclaimed": total_reclaimed,
+        "expired_users": expired_users,
+        "file_sizes": file_sizes,
+    }
+    logging.info(
+        f"Compaction finished: removed {total_removed} entries, reclaimed {total_reclaimed} bytes, "
+        f"expired {expired_users} verified users"
+    )
+
+# ========== LINKS CHANNEL REINDEX ========== #
+REINDEX_CHUNK = 100  # Links channel messages per checkpoint
+reindex_task = None
+
+def load_reindex_state():
+    """Return the saved reindex checkpoint, or None if there isn't one"""
+    try:
+        state = read_bytes(REINDEX_STATE_FILE)
+        state = json_codec.loads(state) if state is not None else None
+        return state if isinstance(state, dict) else None
+    except Exception as e:
+        logging.error(f"Error loading reindex state: {e}")
+        return None
+
+def save_reindex_state(state):
+    write_json(REINDEX_STATE_FILE, state)
+
+async def checkpoint_reindex(messages, state):
+    await merge_reindexed_messages(messages, state)
+    await json_store.run(save_reindex_state, state)
+
+async def merge_reindexed_messages(messages, state):
+    """Merge parsed links channel messages into the local store, one update per data file
+
+    Each data file is read, merged and written inside a data store commit
+    (a transaction with the sqlite store), so records stored meanwhile by
+    uploads or other workers aren't lost.
+    """
+    def add_files(files):
+        return sum(merge_link_files(parsed, links_msg_id, files) for links_msg_id, parsed in messages)
+    
+    def add_batches(batches):
+        # Work on a copy so the checkpoint only changes once the commit succeeds
+        assembling = set(state["assembling"])
+        added = sum(merge_link_batch(parsed, links_msg_id, batches, assembling) for links_msg_id, parsed in messages)
+        return added, assembling
+    
+    files_added = batches_added = 0
+    if any(parsed["files"] for _, parsed in messages):
+        files_added = await json_store.update(FILE_DATABASE, add_files, {})
+    if any(parsed["batch"] for _, parsed in messages):
+        batches_added, assembling = await json_store.update(BATCHES_FILE, add_batches, {})
+        state["assembling"] = sorted(assembling)
+    
+    state["files_added"] += files_added
+    state["batches_added"] += batches_added
+
+# BadRequest reasons that mean a links channel message can't be read, rather than a failed request
+LINKS_CHANNEL_MISSES = ("message to forward not found", "message not found", "message can't be forwarded")
+
+async def read_links_channel_message(bot, chat_id, message_id):
+    """Return a links channel message by forwarding it to ``chat_id``, or None if it no longer exists
+
+    The Bot API has no way to read channel history, so each message is
+    forwarded silently and the copy is deleted by the caller afterwards.
+    """
+    while True:
+        try:
+            return await bot.forward_message(
+                chat_id=chat_id,
+                from_chat_id=LINKS_CHANNEL,
+                message_id=message_id,
+                disable_notification=True
+            )
+        except RetryAfter as e:
+            await asyncio.sleep(retry_after_seconds(e))
+        except BadRequest as e:
+            # Deleted message or a service message that can't be forwarded
+            if any(reason in e.message.lower() for reason in LINKS_CHANNEL_MISSES):
+                return None
+            logging.error(f"Error reading links channel message {message_id}: {e}")
+            raise
+
+async def run_reindex(bot, chat_id, status_message_id, state):
+    """Stream the links channel into the local store, checkpointing after every chunk"""
+    global reindex_task, unique_file_index
+    
+    async def report(text):
+        try:
+            await bot.edit_message_text(chat_id=chat_id, message_id=status_message_id, text=text)
+        except Exception as e:
+            logging.error(f"Error updating reindex status: {e}")
+    
+    try:
+        delay = 1 / REINDEX_RATE if REINDEX_RATE > 0 else 0
+        while state["next_message_id"] <= state["last_message_id"]:
+            start = state["next_message_id"]
+            end = min(start + REINDEX_CHUNK - 1, state["last_message_id"])
+            
+            messages = []
+            forwarded = []
+            try:
+                for message_id in range(start, end + 1):
+                    msg = await read_links_channel_message(bot, chat_id, message_id)
+                    if msg:
+                        forwarded.append(msg.message_id)
+                        parsed = parse_link_message(msg.text)
+                        if parsed:
+                            messages.append((message_id, parsed))
+                    await asyncio.sleep(delay)
+            finally:
+                # Delete the copies even when a read fails and stops the reindex
+                if forwarded:
+                    try:
+                        await bot.delete_messages(chat_id=chat_id, message_ids=forwarded)
+                    except Exception as e:
+                        logging.error(f"Error deleting reindex forwards: {e}")
+            
+            state["next_message_id"] = end + 1
+            await checkpoint_reindex(messages, state)
+            
+            await report(
+                mikasa_reply('info') + f"Reindexing links channel...\n\n"
+                f"Scanned: {end}/{state['last_message_id']} messages\n"
+                f"Files added: {state['files_added']}\n"
+                f"Batches added: {state['batches_added']}"
+            )
+        
+        await json_store.run(os.remove, REINDEX_STATE_FILE)
+        await report(
+            mikasa_reply('success') + f"Reindex complete!\n\n"
+            f"Scanned: {state['last_message_id']} messages\n"
+            f"Files added: {state['files_added']}\n"
+            f"Batches added: {state['batches_added']}"
+        )
+        logging.info(f"Reindex complete: {state['files_added']} files, {state['batches_added']} batches added")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logging.error(f"Reindex stopped at message {state['next_message_id']}: {e}")
+        await report(
+            mikasa_reply('error') + f"Reindex stopped at message {state['next_message_id']}: {str(e)}\n"
+            "Use /reindex to resume."
+        )
+    finally:
+        # The dedupe index is rebuilt from the file database on next use
+        unique_file_index = None
+        reindex_task = None
+
+@admin_only
+async def reindex_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Rebuild the local file and batch store from the links channel history"""
+    global reindex_task
+    
+    if not LINKS_CHANNEL:
+        await update.message.reply_text(mikasa_reply('error') + "LINKS_CHANNEL is not configured.")
+        return
+    if reindex_task:
+        await update.message.reply_text(mikasa_reply('warning') + "A reindex is already running.")
+        return
+    
+    restart_scan = bool(context.args) and context.args[0].lower() == "restart"
+    state = None if restart_scan else await json_store.run(load_reindex_state)
+    
+    # Post and remove a probe message to learn the newest message ID in the channel
+    try:
+        probe = await context.bot.send_message(
+            chat_id=LINKS_CHANNEL,
+            text="🔄 Reindex probe",
+            disable_notification=True
+        )
+        await context.bot.delete_message(chat_id=LINKS_CHANNEL, message_id=probe.message_id)
+    except Exception as e:
+        logging.error(f"Error probing links channel for reindex: {e}")
+        await update.message.reply_text(mikasa_reply('error') + f"Can't access the links channel: {str(e)}")
+        return
+    
+    if state:
+        state["last_message_id"] = probe.message_id - 1
+        intro = f"Resuming reindex from message {state['next_message_id']}..."
+    else:
+        state = {
+            "next_message_id": 1,
+            "last_message_id": probe.message_id - 1,
+            "files_added": 0,
+            "batches_added": 0,
+            "assembling": []
+        }
+        intro = "Starting reindex of the links channel..."
+    await json_store.run(save_reindex_state, state)
+    
+    status = await update.message.reply_text(mikasa_reply('info') + intro)
+    reindex_task = context.application.create_task(
+        run_reindex(context.bot, update.effective_chat.id, status.message_id, state)
+    )
+
 # ========== OWNER CLEANUP COMMAND ========== #
 @owner_only
 async def cleanup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2529,40 +3237,44 @@ async def cleanup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             BATCHES_FILE
         ]
         
+        def keep_active_tokens(tokens):
+            current_time = int(time.time())
+            active_tokens = {}
+            # Keep only active tokens
+            for token, data in tokens.items():
+                if isinstance(data, dict) and "expiry" in data:
+                    if data["expiry"] > current_time:
+                        active_tokens[token] = data
+                        logging.info(f"Preserving active token that expires at {datetime.fromtimestamp(data['expiry']).strftime('%Y-%m-%d %H:%M:%S')}")
+            return active_tokens, active_tokens
+        
+        def keep_link_data(files):
+            preserved_data = {}
+            for file_id, file_info in files.items():
+                if isinstance(file_info, dict):
+                    # Only keep essential fields for link recognition
+                    preserved_data[file_id] = {
+                        "message_id": file_info.get("message_id"),
+                        "file_link": file_info.get("file_link", ""),
+                        "custom_name": file_info.get("custom_name", ""),
+                        "media_type": file_info.get("media_type", "unknown"),
+                        "file_unique_id": file_info.get("file_unique_id"),
+                        "links_channel_msg_id": file_info.get("links_channel_msg_id")
+                    }
+            return preserved_data, len(preserved_data)
+        
         cleaned_files = []
         preserved_files = []
         
-        # Backup files before cleaning
-        backup_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-        os.makedirs("backups", exist_ok=True)
+        # Snapshot every data file before cleaning; nothing is cleaned if this fails
+        await json_store.drain()
+        snapshot_id, _ = await json_store.run(snapshot_data_files)
         
         # Handle tokens file separately to preserve active tokens
         active_tokens = {}
-        if os.path.exists(TOKENS_FILE):
+        if await json_store.run(json_store.exists, TOKENS_FILE):
             try:
-                # Create backup of tokens file
-                backup_file = f"backups/{TOKENS_FILE}_{backup_time}.bak"
-                with open(TOKENS_FILE, 'r') as src, open(backup_file, 'w') as dst:
-                    dst.write(src.read())
-                
-                # Read current tokens
-                with open(TOKENS_FILE, 'r') as f:
-                    try:
-                        tokens = json.load(f)
-                        if isinstance(tokens, dict):
-                            current_time = int(time.time())
-                            # Keep only active tokens
-                            for token, data in tokens.items():
-                                if isinstance(data, dict) and "expiry" in data:
-                                    if data["expiry"] > current_time:
-                                        active_tokens[token] = data
-                                        logging.info(f"Preserving active token that expires at {datetime.fromtimestamp(data['expiry']).strftime('%Y-%m-%d %H:%M:%S')}")
-                    except json.JSONDecodeError:
-                        logging.warning("Tokens file contains invalid JSON")
-                
-                # Write back only active tokens
-                with open(TOKENS_FILE, 'w') as f:
-                    json.dump(active_tokens, f)
+                active_tokens = await json_store.transform(TOKENS_FILE, keep_active_tokens, {})
                 
                 if active_tokens:
                     logging.info(f"Preserved {len(active_tokens)} active tokens")
@@ -2575,49 +3287,18 @@ async def cleanup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Handle link data files to preserve file links
         for file in link_data_files:
-            if os.path.exists(file):
+            if await json_store.run(json_store.exists, file):
                 try:
-                    # Create backup
-                    backup_file = f"backups/{file}_{backup_time}.bak"
-                    with open(file, 'r') as src, open(backup_file, 'w') as dst:
-                        dst.write(src.read())
-                    
-                    # Read current data
-                    with open(file, 'r') as f:
-                        try:
-                            data = json.load(f)
-                            if not isinstance(data, dict):
-                                data = {}
-                        except json.JSONDecodeError:
-                            data = {}
-                    
                     # For FILE_DATABASE, preserve only essential link data
                     if file == FILE_DATABASE:
-                        preserved_data = {}
-                        preserved_count = 0
-                        
-                        for file_id, file_info in data.items():
-                            if isinstance(file_info, dict):
-                                # Only keep essential fields for link recognition
-                                preserved_data[file_id] = {
-                                    "message_id": file_info.get("message_id"),
-                                    "file_link": file_info.get("file_link", ""),
-                                    "custom_name": file_info.get("custom_name", ""),
-                                    "media_type": file_info.get("media_type", "unknown"),
-                                    "links_channel_msg_id": file_info.get("links_channel_msg_id")
-                                }
-                                preserved_count += 1
-                        
-                        # Write back preserved data
-                        with open(file, 'w') as f:
-                            json.dump(preserved_data, f)
+                        preserved_count = await json_store.transform(file, keep_link_data, {})
                         
                         logging.info(f"Preserved link data for {preserved_count} files in {file}")
                         preserved_files.append(f"{file} (preserved link data for {preserved_count} files)")
                     
                     # For BATCHES_FILE, keep all batch data as is
                     elif file == BATCHES_FILE:
-                        # No changes needed, just keep the backup
+                        # No changes needed
                         preserved_files.append(f"{file} (preserved batch data)")
                         
                 except Exception as e:
@@ -2625,19 +3306,10 @@ async def cleanup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Clean other files
         for file in files_to_clean:
-            if os.path.exists(file):
-                # Create backup
-                backup_file = f"backups/{file}_{backup_time}.bak"
+            if await json_store.run(json_store.exists, file):
                 try:
-                    with open(file, 'r') as src, open(backup_file, 'w') as dst:
-                        dst.write(src.read())
-                    
                     # Clean the file
-                    with open(file, 'w') as f:
-                        if file == BANNED_USERS_FILE:
-                            json.dump([], f)
-                        else:
-                            json.dump({}, f)
+                    await json_store.save(file, [] if file == BANNED_USERS_FILE else {})
                     
                     cleaned_files.append(file)
                 except Exception as e:
@@ -2655,7 +3327,7 @@ async def cleanup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             await update.message.reply_text(
                 mikasa_reply('success') + f"Successfully cleaned metadata while preserving link data and active tokens.{preserved_msg}{cleaned_msg}{active_token_msg}{links_channel_msg}\n\n"
-                f"Backups saved in 'backups' folder with timestamp {backup_time}."
+                f"Backup snapshot {snapshot_id} saved; use /restore {snapshot_id} to undo."
             )
         else:
             await update.message.reply_text(
@@ -2667,6 +3339,180 @@ async def cleanup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             mikasa_reply('error') + f"An error occurred during cleanup: {str(e)}"
         )
 
+# ========== BACKUPS ========== #
+def snapshot_data_files():
+    """Snapshot the data files, or a copy of this bot's documents in the sqlite store; runs on the data store's I/O thread
+
+    Unchanged files are shared with earlier snapshots, but a changed file (or
+    the sqlite copy, after any change) is stored again in full.
+    """
+    if isinstance(json_store, SqliteStore):
+        json_store.copy_to(STORE_BACKUP_COPY, BACKUP_FILES)
+        return backup_store.snapshot([STORE_BACKUP_COPY])
+    return backup_store.snapshot(BACKUP_FILES)
+
+def restore_data_files(snapshot_id):
+    """Restore a snapshot into the data store and return the restored paths; runs on the I/O thread"""
+    restored = backup_store.restore(snapshot_id)
+    if isinstance(json_store, SqliteStore):
+        if STORE_BACKUP_COPY in restored:
+            json_store.copy_from(STORE_BACKUP_COPY, BACKUP_FILES)
+        else:
+            # A snapshot of the JSON files from before the switch to sqlite
+            json_store.import_files(restored, replace=True)
+    return restored
+
+@owner_only
+async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Snapshot the data files, storing only what changed since the last snapshot"""
+    try:
+        await json_store.drain()
+        snapshot_id, stored = await json_store.run(snapshot_data_files)
+        await update.message.reply_text(
+            mikasa_reply('success') + f"Backup snapshot {snapshot_id} saved ({stored / 1024:.1f} KB of new data).\n"
+            f"Keeping the last {backup_store.keep} snapshots."
+        )
+    except Exception as e:
+        logging.error(f"Error in backup command: {e}")
+        await update.message.reply_text(mikasa_reply('error') + f"Backup failed: {str(e)}")
+
+@owner_only
+async def restore_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List backup snapshots, or restore the data files from one"""
+    global unique_file_index
+    try:
+        if not context.args:
+            snapshots = await json_store.run(backup_store.list_snapshots)
+            if not snapshots:
+                await update.message.reply_text(mikasa_reply('info') + "No backup snapshots yet. Use /backup to take one.")
+                return
+            lines = []
+            for snapshot_id, manifest in snapshots:
+                size = sum(entry.get("size", 0) for entry in manifest["files"].values())
+                lines.append(f"• {snapshot_id} - {len(manifest['files'])} files, {size / 1024:.1f} KB")
+            await update.message.reply_text(
+                mikasa_reply('info') + "Backup snapshots (newest first):\n" + "\n".join(lines) +
+                "\n\nUse /restore <snapshot> to restore one, or /restore latest."
+            )
+            return
+        
+        snapshot_id = None if context.args[0] == "latest" else context.args[0]
+        # Let queued writes land first so they can't overwrite the restored files
+        await json_store.drain()
+        restored = await json_store.run(restore_data_files, snapshot_id)
+        unique_file_index = None
+        await update.message.reply_text(
+            mikasa_reply('success') + f"Restored {len(restored)} files: {', '.join(restored)}"
+        )
+    except FileNotFoundError as e:
+        await update.message.reply_text(mikasa_reply('warning') + str(e))
+    except Exception as e:
+        logging.error(f"Error in restore command: {e}")
+        await update.message.reply_text(mikasa_reply('error') + f"Restore failed: {str(e)}")
+
+# ========== METRICS ========== #
+def format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    return f"{seconds * 1000:.0f}ms" if seconds < 1 else f"{seconds:.1f}s"
+
+@admin_only
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Summarize handler latency, Bot API calls and storage I/O since startup"""
+    lines = ["Handlers (calls, p50 / p95 / p99, errors):"]
+    for labels in metrics.HANDLER_SECONDS.label_values():
+        histogram = metrics.HANDLER_SECONDS
+        lines.append(
+            f"• {labels['handler']}: {histogram.count(**labels)}, "
+            f"{format_seconds(histogram.quantile(0.5, **labels))} / {format_seconds(histogram.quantile(0.95, **labels))} / "
+            f"{format_seconds(histogram.quantile(0.99, **labels))}, {metrics.HANDLER_ERRORS.get(**labels)} errors"
+        )
+    
+    lines.append("\nBot API (calls, p95, errors, RetryAfter):")
+    api_calls = sorted(metrics.API_SECONDS.label_values(), key=lambda labels: -metrics.API_SECONDS.count(**labels))
+    for labels in api_calls[:10]:
+        method = labels["method"]
+        errors = sum(value for key, value in metrics.API_ERRORS.values.items() if key[0] == method)
+        lines.append(
+            f"• {method}: {metrics.API_SECONDS.count(**labels)}, {format_seconds(metrics.API_SECONDS.quantile(0.95, **labels))}, "
+            f"{errors}, {metrics.API_RETRY_AFTER.get(method=method)}"
+        )
+    
+    lines.append("\nStorage (operations, total time, p95):")
+    for labels in metrics.STORAGE_SECONDS.label_values():
+        histogram = metrics.STORAGE_SECONDS
+        lines.append(
+            f"• {labels['operation']}: {histogram.count(**labels)}, {format_seconds(histogram.total(**labels))}, "
+            f"{format_seconds(histogram.quantile(0.95, **labels))}"
+        )
+    
+    lines.append(
+        f"\nEvent loop lag p50 / p99: {format_seconds(LOOP_LAG.quantile(0.5))} / {format_seconds(LOOP_LAG.quantile(0.99))}, "
+        f"{len(loop_monitor.stalls)} recent stalls over {LOOP_LAG_THRESHOLD}s"
+    )
+    
+    lines.append("\nCache hit ratio:")
+    for cache in ("records", "unique_file_index"):
+        ratio = metrics.cache_hit_ratio(cache)
+        lines.append(f"• {cache}: {'-' if ratio is None else f'{ratio:.1%}'}")
+    
+    if last_compaction:
+        sizes = ", ".join(f"{name} {size:,}B" for name, size in last_compaction["file_sizes"].items())
+        lines.append(
+            f"\nLast compaction ({datetime.fromtimestamp(last_compaction['time']).strftime('%Y-%m-%d %H:%M')}): "
+            f"removed {last_compaction['removed']} entries, reclaimed {last_compaction['reclaimed']:,} bytes, "
+            f"expired {last_compaction['expired_users']} verified users; {len(verified_users)} verified users, "
+            f"{len(issued_tokens)} issued tokens in memory\nData file sizes: {sizes or '-'}"
+        )
+    
+    if METRICS_PORT:
+        lines.append(f"\nPrometheus endpoint: http://{METRICS_HOST}:{metrics_server.port}/metrics")
+    await update.message.reply_text(mikasa_reply('info') + "\n" + "\n".join(lines))
+
+# ========== PROFILING ========== #
+PROFILE_MAX_SECONDS = 120  # Longest window /profile will run for
+# One profile at a time per process: cProfile can't run twice, even for different bots
+profile_lock = shared("profile_lock", asyncio.Lock)
+
+@owner_only
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Profile the live event loop for a few seconds and send the report"""
+    try:
+        seconds = int(context.args[0]) if context.args else 10
+    except ValueError:
+        await update.message.reply_text(mikasa_reply('warning') + "Usage: /profile <seconds> [cprofile]")
+        return
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    mode = "cprofile" if len(context.args) > 1 and context.args[1].lower() == "cprofile" else "sample"
+    
+    if profile_lock.locked():
+        await update.message.reply_text(mikasa_reply('warning') + "A profile is already running.")
+        return
+    
+    async with profile_lock:
+        try:
+            await update.message.reply_text(mikasa_reply('info') + f"Profiling the event loop for {seconds}s ({mode})...")
+            summary, filename, report = await profile_loop(seconds, mode)
+            await update.message.reply_document(document=report, filename=filename)
+            await update.message.reply_text(mikasa_reply('info') + summary[:4000])
+        except Exception as e:
+            logging.error(f"Error in profile command: {e}")
+            await update.message.reply_text(mikasa_reply('error') + f"Profiling failed: {str(e)}")
+
+def instrument_handlers(handlers):
+    """Time and trace every handler callback, including those nested in conversation handlers"""
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                instrument_handlers(state_handlers)
+            instrument_handlers(handler.fallbacks)
+        else:
+            callback = handler.callback
+            if not getattr(callback, "timed", False):
+                callback = metrics.timed(callback.__name__, callback)
+            handler.callback = tracing.trace_handler(callback.__name__, callback)
+
 # Handle all messages
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle all messages"""
@@ -2696,10 +3542,16 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
 
 # Modified to check for existing valid tokens before generating a new one
-async def post_init(application):
-    """Run after application initialization"""
-    # Restore pending deletes
+async def start_leader_jobs(application):
+    """Start the jobs that must run once per deployment, not once per worker"""
+    # Restore pending deletes, then keep picking up the ones other workers queue
     await restore_pending_deletes(application)
+    application.job_queue.run_repeating(
+        restore_pending_deletes,
+        interval=DELETE_SWEEP_INTERVAL,
+        first=DELETE_SWEEP_INTERVAL,
+        name="pending_delete_sweep"
+    )
     
     # Schedule token refresh job
     application.job_queue.run_repeating(
@@ -2710,8 +3562,17 @@ async def post_init(application):
     )
     logging.info(f"Scheduled token refresh every {TOKEN_DURATION} hours")
     
+    # Schedule data store compaction
+    application.job_queue.run_repeating(
+        compact_data_stores,
+        interval=MAINTENANCE_INTERVAL * 3600,
+        first=600,  # Shortly after startup, then every MAINTENANCE_INTERVAL hours
+        name="maintenance"
+    )
+    logging.info(f"Scheduled data store compaction every {MAINTENANCE_INTERVAL} hours")
+    
     # Check if there's already a valid token before generating a new one
-    token_info = get_valid_token()
+    token_info = await get_valid_token()
     
     if token_info:
         token, expiry = token_info
@@ -2721,9 +3582,145 @@ async def post_init(application):
         logging.info("No valid token found, generating initial token")
         await generate_token(0, application)
 
-if __name__ == "__main__":
+async def claim_leadership(context: CallbackContext):
+    """Take over the scheduled jobs once the current leader has exited"""
+    if leader_lease.acquire():
+        context.job.schedule_removal()
+        logging.info(f"Worker {WORKER_INDEX} is now the leader")
+        await start_leader_jobs(context.application)
+
+async def warm_caches():
+    """Load the data stores and build the dedupe index before the first update arrives"""
+    started = time.perf_counter()
+    for path, parse in [
+        (FILE_DATABASE, parse_files), (BATCHES_FILE, parse_batches), (TOKENS_FILE, parse_tokens),
+        (BANNED_USERS_FILE, parse_banned_users), (GROUP_SETTINGS_FILE, parse_auto_delete)
+    ]:
+        try:
+            await json_store.load_records(path, parse)
+        except Exception as e:
+            logging.error(f"Error warming {path}: {e}")
+    await get_unique_file_index()
+    return time.perf_counter() - started
+
+async def post_init(application):
+    """Run after application initialization, before updates are fetched"""
+    warm_seconds = await warm_caches()
+    logging.info(f"Warmed caches in {warm_seconds:.2f}s")
+    
+    if SIGNED_TOKENS:
+        await load_verified_users()
+    
+    # One process runs the scheduled jobs; the others wait to take over
+    if leader_lease.acquire():
+        await start_leader_jobs(application)
+    else:
+        application.job_queue.run_repeating(
+            claim_leadership,
+            interval=LEADER_RETRY_INTERVAL,
+            first=LEADER_RETRY_INTERVAL,
+            name="leader_claim"
+        )
+        logging.info(f"Worker {WORKER_INDEX} is a follower; another process holds {LEADER_LOCK_FILE}")
+    
+    # Schedule the new-token digest for admins
+    application.job_queue.run_repeating(
+        flush_token_digest,
+        interval=TOKEN_DIGEST_INTERVAL,
+        first=TOKEN_DIGEST_INTERVAL,
+        name="token_digest"
+    )
+    
+    # Watch for handlers that block the event loop
+    if LOOP_LAG_THRESHOLD > 0:
+        loop_monitor.start()
+        if loop_stall_reporter == TENANT:
+            application.job_queue.run_repeating(
+                flush_loop_stalls,
+                interval=LOOP_LAG_DIGEST_INTERVAL,
+                first=LOOP_LAG_DIGEST_INTERVAL,
+                name="loop_stall_digest"
+            )
+        logging.info(f"Monitoring event loop stalls over {LOOP_LAG_THRESHOLD}s")
+    
+    # Serve metrics to a local Prometheus scraper
+    if METRICS_PORT:
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            logging.error(f"Could not start metrics endpoint on port {metrics_server.port}: {e}")
+    
+    # Report back to whoever ran /restart
+    if RESTART_NOTIFY_CHAT:
+        try:
+            await application.bot.send_message(
+                chat_id=RESTART_NOTIFY_CHAT,
+                text=mikasa_reply('success') + f"Back online. Caches warmed in {warm_seconds:.1f}s."
+            )
+        except Exception as e:
+            logging.error(f"Error sending restart notification: {e}")
+
+async def post_stop(application):
+    """Finish work started by handlers once updates have stopped, while the bot can still send
+
+    PTB has already waited for running handlers, so every delivery they
+    queued is done; what remains is background work.
+    """
+    # Albums still inside their collection window; the job queue that would flush them has stopped
+    for key in list(album_buffers):
+        await flush_album(application, key)
+    
+    # Uploads still being stored and any sends still in flight
+    deadline = time.monotonic() + RESTART_DRAIN_TIMEOUT
+    await ingestion_queue.drain(timeout=RESTART_DRAIN_TIMEOUT)
+    unfinished = len(ingestion_queue.in_flight())
+    if unfinished:
+        logging.warning(f"Shutting down with {unfinished} uploads still being stored")
+    # Records the store kept rejecting; log them so the files in the channels can be recovered
+    for job_records in ingestion_queue.unpersisted:
+        for kind, record_id, record in job_records:
+            logging.error(f"Unsaved {kind} record {record_id}: {json_codec.dumps(record).decode()}")
+    if not await delivery_scheduler.drain(timeout=max(0, deadline - time.monotonic())):
+        logging.warning(f"Shutting down with {delivery_scheduler.queued + delivery_scheduler.in_flight} deliveries unfinished")
+    
+    # Tokens waiting for the next digest would otherwise never be announced
+    await flush_token_digest(application)
+
+async def post_shutdown(application):
+    """Flush queued data file writes before exiting"""
+    await json_store.drain()
+    leader_lease.release()
+    # Under tenants.py the other bots may still be shutting down; it calls this once they all have
+    if not TENANT:
+        await shutdown_shared()
+
+async def shutdown_shared():
+    """Stop the metrics endpoint, loop monitor, data store writes and tracing shared by the process"""
+    await metrics_server.stop()
+    await loop_monitor.stop()
+    await json_store.drain()
+    tracing.shutdown()
+
+def build_application():
+    """Build the application with every handler registered"""
     # Initialize application with post_init
-    application = ApplicationBuilder().token(TOKEN).post_init(post_init).build()
+    builder = (
+        ApplicationBuilder().token(TOKEN)
+        # One connection pool for every bot in the process
+        .request(shared("api_request", lambda: metrics.InstrumentedRequest(connection_pool_size=API_POOL_SIZE)))
+        .base_url(f"{BOT_API_URL}/bot").base_file_url(f"{BOT_API_URL}/file/bot")
+        .post_init(post_init).post_stop(post_stop).post_shutdown(post_shutdown)
+        # Batch sessions and conversation state survive restarts. on_flush writes the pickle once, on
+        # shutdown; otherwise every new user's empty user_data would rewrite the whole file on the loop
+        .persistence(PicklePersistence(
+            PERSISTENCE_FILE, on_flush=True,
+            store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False)
+        ))
+    )
+    if WORKER_PORT:
+        # Updates come from dispatcher.py, which owns the webhook
+        builder = builder.updater(None)
+    application = builder.build()
     
 # Register sync command - MOVED HERE AFTER APPLICATION INITIALIZATION
     register_sync_command(application)
@@ -2733,7 +3730,10 @@ if __name__ == "__main__":
 
     # Command Handlers
     handlers = [
-        CommandHandler("start", start_command),
+        # Deliveries run concurrently so the scheduler, not the update queue, decides who goes next.
+        # /start's only per-user state is the issued token, which generate_token caches before it
+        # awaits anything, so concurrent /starts from one user share a token
+        CommandHandler("start", start_command, block=False),
         CommandHandler("menu", menu_command),
         CommandHandler("help", help_command),
         CommandHandler("getlink", store_file),
@@ -2745,8 +3745,13 @@ if __name__ == "__main__":
         CommandHandler("listbanned", list_banned),
         CommandHandler("settings", settings_command),
         CommandHandler("restart", restart),
+        CommandHandler("reindex", reindex_command),
+        CommandHandler("metrics", metrics_command),
         CommandHandler("search", search_files),  # Works in all chat types now
         CommandHandler("cleanup", cleanup_command),  # New cleanup command
+        CommandHandler("backup", backup_command),
+        CommandHandler("restore", restore_command),
+        CommandHandler("profile", profile_command, block=False),  # Profiles the loop while other updates keep flowing
         CommandHandler("groupstats", group_stats_command),  # New group stats command
         CommandHandler("tokentoggle", token_toggle_command),  # New token toggle command
         CommandHandler("setautodelete", set_auto_delete_command),  # New auto-delete command
@@ -2761,7 +3766,9 @@ if __name__ == "__main__":
                 ENTERING_VALUE: [MessageHandler(filters.TEXT & ~filters.COMMAND, customize_value_handler)]
             },
             fallbacks=[CallbackQueryHandler(customize_button_handler, pattern=r"^customize_cancel$")],
-            per_message=False
+            per_message=False,
+            name="customize",
+            persistent=True
         ),
         
         # Group welcome handler
@@ -2773,12 +3780,23 @@ if __name__ == "__main__":
         MessageHandler(filters.ALL & ~filters.COMMAND, message_handler)
     ]
     
+    instrument_handlers(handlers)
     for handler in handlers:
         application.add_handler(handler)
     
     application.add_error_handler(error_handler)
+    return application
+
+if __name__ == "__main__":
+    application = build_application()
     
     print("⚔️ TATAKAE")
     
     # Start the bot
-    application.run_polling()
+    if WORKER_PORT:
+        run_worker(application, WORKER_PORT)
+    else:
+        application.run_polling()
+    
+    if restart_requested_by is not None:
+        exec_restart()
@@ -0,0 +1,177 @@
+import asyncio
+import time
+from collections import deque
+
+
+class DeliveryScheduler:
+    """Fair-queued scheduler that sits between file delivery and the Bot API.
+
+    Every user gets their own queue. Queued users are served round-robin, one
+    job per turn, so a user pulling a 200-file batch cannot starve someone who
+    asked for a single file. Each user is capped at ``per_user_limit`` in-flight
+    sends and paced at ``user_interval`` seconds between sends (Telegram allows
+    roughly one message per second per chat), and ``global_limit`` caps the
+    number of sends in flight across all users.
+    """
+
+    def __init__(self, global_limit=20, per_user_limit=1, user_interval=1.0):
+        self.global_limit = max(1, global_limit)
+        self.per_user_limit = max(1, per_user_limit)
+        self.user_interval = max(0.0, user_interval)
+
+        self._queues = {}       # user_id -> deque of (factory, future)
+        self._ring = deque()    # users with queued jobs, in service order
+        self._active = {}       # user_id -> in-flight jobs
+        self._next_ready = {}   # user_id -> monotonic time of next allowed send
+        self._in_flight = 0
+        self._wakeup = None
+        self._task = None
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def queued(self):
+        return sum(len(q) for q in self._queues.values())
+
+    def saturated(self):
+        """Return True if new jobs cannot start right away"""
+        return self._in_flight >= self.global_limit
+
+    def submit(self, user_id, factory):
+        """Queue ``factory()`` (a coroutine factory) for ``user_id`` and return a future for its result"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = self._queues[user_id] = deque()
+            # Users that just became active go to the front of the ring so
+            # small one-off requests are not stuck behind long batches.
+            self._ring.appendleft(user_id)
+        queue.append((factory, future))
+
+        self._dispatch()
+        self._wakeup.set()
+        return future
+
+    async def deliver(self, user_id, factory):
+        """Submit a single job and wait for its result"""
+        return await self.submit(user_id, factory)
+
+    def position(self, user_id):
+        """Return how many sends start before the user's next one, plus one, or None if nothing is waiting
+
+        Follows the dispatch order: when a slot frees up the ring is walked
+        from the front, skipping users that are paced or at their in-flight
+        cap, so only users ahead of this one that could start right now are
+        counted. Only reported while the scheduler is saturated, since
+        otherwise the wait is just the per-user pacing.
+        """
+        if not self.saturated() or not self._queues.get(user_id):
+            return None
+        now = time.monotonic()
+        ahead = 0
+        for queued_user in self._ring:
+            if queued_user == user_id:
+                return ahead + 1
+            if self._next_ready.get(queued_user, 0) <= now and self._active.get(queued_user, 0) < self.per_user_limit:
+                ahead += 1
+        return None
+
+    async def drain(self, timeout=None):
+        """Wait until no jobs are queued or in flight; returns False if ``timeout`` ran out first"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queues or self._in_flight:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.1)
+        return True
+
+    async def stop(self):
+        """Stop the dispatcher task; queued jobs are left untouched"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def _dispatch(self):
+        """Start as many queued jobs as the limits allow; return seconds until the next paced user is ready"""
+        now = time.monotonic()
+        next_wake = None
+
+        for _ in range(len(self._ring)):
+            if not self._ring or self._in_flight >= self.global_limit:
+                break
+
+            user_id = self._ring[0]
+            self._ring.rotate(-1)
+
+            ready_at = self._next_ready.get(user_id, 0)
+            if ready_at > now:
+                delay = ready_at - now
+                next_wake = delay if next_wake is None else min(next_wake, delay)
+                continue
+            if self._active.get(user_id, 0) >= self.per_user_limit:
+                continue
+
+            queue = self._queues[user_id]
+            factory, future = queue.popleft()
+            if not queue:
+                del self._queues[user_id]
+                self._ring.remove(user_id)
+
+            if future.cancelled():
+                continue
+
+            self._active[user_id] = self._active.get(user_id, 0) + 1
+            self._next_ready[user_id] = now + self.user_interval
+            self._in_flight += 1
+            asyncio.get_running_loop().create_task(self._run_job(user_id, factory, future))
+
+        return next_wake
+
+    async def _run_job(self, user_id, factory, future):
+        try:
+            result = await factory()
+            if not future.done():
+                future.set_result(result)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        except BaseException:
+            # Cancelled (e.g. on shutdown): don't leave the submitter waiting forever
+            if not future.done():
+                future.cancel()
+            raise
+        finally:
+            self._in_flight -= 1
+            self._active[user_id] -= 1
+            if not self._active[user_id]:
+                del self._active[user_id]
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            timeout = self._dispatch()
+
+            # Forget pacing state for users that are no longer waiting
+            if len(self._next_ready) > len(self._queues) + len(self._active):
+                now = time.monotonic()
+                for user_id in [u for u, t in self._next_ready.items() if t <= now and u not in self._queues]:
+                    del self._next_ready[user_id]
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,371 @@
+"""Run the bot as several worker processes behind one webhook receiver.
+
+    WEBHOOK_URL=https://bot.example.com/webhook WORKERS=4 python dispatcher.py
+
+The dispatcher registers WEBHOOK_URL with Telegram, accepts the webhook
+POSTs on WEBHOOK_LISTEN:WEBHOOK_PORT and hands each update to one of WORKERS
+``bot.py`` processes, chosen by chat ID. All updates from a chat go to the
+same worker, in order, so conversations, batch sessions and per-user
+delivery queues stay in one process while different chats are handled on
+different cores.
+
+Workers are started and restarted by the dispatcher. They share one SQLite
+store (see sqlite_store.py) and elect a leader through a lock file (see
+leader.py) to run the scheduled jobs. Each worker listens on
+127.0.0.1:WORKER_BASE_PORT + index for newline-delimited update JSON and
+acknowledges each update with one byte.
+"""
+import asyncio
+import hmac
+import logging
+import os
+import signal
+import sys
+from collections import deque
+
+from dotenv import load_dotenv
+from telegram import Bot, Update
+
+import json_codec
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+WORKER_HOST = "127.0.0.1"
+RECONNECT_DELAY = 0.5  # Seconds between attempts to reach a worker that isn't listening
+RESTART_DELAYS = [1, 2, 5, 10, 30]  # Backoff between restarts of a worker that keeps exiting
+STOP_TIMEOUT = 30  # Seconds a worker gets to shut down before it is killed
+
+# Update fields that carry the chat (or, failing that, the user) an update belongs to
+_CHAT_FIELDS = ("chat", "message")
+_USER_FIELDS = ("from", "user")
+
+
+def shard_key(update):
+    """Return the chat ID an update (a Bot API dict) belongs to, or 0 if it has none"""
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        for field in _CHAT_FIELDS:
+            chat = value.get(field)
+            if field == "message" and isinstance(chat, dict):
+                chat = chat.get("chat")  # A callback query's message
+            if isinstance(chat, dict) and isinstance(chat.get("id"), int):
+                return chat["id"]
+        for field in _USER_FIELDS:
+            user = value.get(field)
+            if isinstance(user, dict) and isinstance(user.get("id"), int):
+                return user["id"]
+    return 0
+
+
+class WorkerLink:
+    """Forwards updates to one worker over a persistent connection, queueing them while it is down
+
+    The worker acknowledges every update with one byte once it is on the
+    application's update queue. Updates not yet acknowledged when the
+    connection drops, for example because the worker is restarting, are sent
+    again on the next connection, so none are lost in the socket buffers.
+    """
+
+    def __init__(self, index, port, queue_size):
+        self.index = index
+        self.port = port
+        self.queue = asyncio.Queue(queue_size)
+        self._unacked = deque()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._forward())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _forward(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(WORKER_HOST, self.port)
+            except OSError:
+                # Worker not up yet or restarting
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            logging.info(f"Connected to worker {self.index} on port {self.port}")
+            try:
+                await self._send(reader, writer)
+            except (ConnectionError, OSError):
+                pass
+            finally:
+                writer.close()
+            logging.warning(f"Lost connection to worker {self.index}, {len(self._unacked)} updates to resend")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _send(self, reader, writer):
+        """Send updates until the worker closes the connection"""
+        for line in self._unacked:
+            writer.write(line)
+        acks = asyncio.ensure_future(self._read_acks(reader))
+        try:
+            while not acks.done():
+                get = asyncio.ensure_future(self.queue.get())
+                await asyncio.wait({get, acks}, return_when=asyncio.FIRST_COMPLETED)
+                if not get.done():
+                    get.cancel()
+                    break
+                line = get.result()
+                self._unacked.append(line)
+                writer.write(line)
+                await writer.drain()
+        finally:
+            acks.cancel()
+            await asyncio.gather(acks, return_exceptions=True)
+
+    async def _read_acks(self, reader):
+        while data := await reader.read(4096):
+            for _ in range(min(len(data), len(self._unacked))):
+                self._unacked.popleft()
+
+
+class Dispatcher:
+    """Webhook receiver that shards updates across ``workers`` supervised bot.py processes"""
+
+    def __init__(self, token, webhook_url, listen="0.0.0.0", port=8443, secret="", workers=2,
+                 worker_base_port=9100, queue_size=1000, base_url="https://api.telegram.org"):
+        self.token = token
+        self.webhook_url = webhook_url
+        self.listen = listen
+        self.port = port
+        self.secret = secret
+        self.base_url = base_url
+        self.links = [WorkerLink(i, worker_base_port + i, queue_size) for i in range(workers)]
+        self.processes = {}
+        self._server = None
+        self._supervisors = []
+        self._stopping = False
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.listen, self.port)
+        for link in self.links:
+            link.start()
+            self._supervisors.append(asyncio.get_running_loop().create_task(self._supervise(link)))
+        async with Bot(self.token, base_url=f"{self.base_url}/bot") as bot:
+            await bot.set_webhook(self.webhook_url, secret_token=self.secret or None,
+                                  max_connections=100, allowed_updates=Update.ALL_TYPES)
+        logging.info(f"Dispatching {self.webhook_url} from {self.listen}:{self.port} to {len(self.links)} workers")
+
+    async def stop(self):
+        self._stopping = True
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        for process in self.processes.values():
+            if process.returncode is None:
+                process.send_signal(signal.SIGTERM)
+        await asyncio.gather(*self._supervisors, return_exceptions=True)
+        for link in self.links:
+            await link.stop()
+
+    def _worker_env(self, link):
+        env = dict(os.environ)
+        if env.get("STORE_BACKEND", "sqlite") != "sqlite":
+            logging.warning("Workers need a shared store; overriding STORE_BACKEND with sqlite")
+        env.update({
+            "STORE_BACKEND": "sqlite",
+            "WORKER_INDEX": str(link.index),
+            "WORKER_COUNT": str(len(self.links)),
+            "WORKER_PORT": str(link.port)
+        })
+        return env
+
+    async def _supervise(self, link):
+        """Run one worker, restarting it with backoff whenever it exits"""
+        failures = 0
+        while not self._stopping:
+            process = await asyncio.create_subprocess_exec(sys.executable, BOT_SCRIPT, env=self._worker_env(link))
+            self.processes[link.index] = process
+            logging.info(f"Started worker {link.index} (pid {process.pid})")
+            started = asyncio.get_running_loop().time()
+            try:
+                returncode = await process.wait()
+            except asyncio.CancelledError:
+                process.kill()
+                raise
+            if self._stopping:
+                return
+            if asyncio.get_running_loop().time() - started > 60:
+                failures = 0  # Ran for a while, so this isn't a crash loop
+            delay = RESTART_DELAYS[min(failures, len(RESTART_DELAYS) - 1)]
+            failures += 1
+            logging.error(f"Worker {link.index} exited with code {returncode}, restarting in {delay}s")
+            await asyncio.sleep(delay)
+
+    async def wait_stopped(self):
+        """Wait for every worker to exit, killing those that take longer than STOP_TIMEOUT"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(p.wait() for p in self.processes.values())), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            for process in self.processes.values():
+                if process.returncode is None:
+                    process.kill()
+
+    def dispatch(self, body):
+        """Queue one webhook body for its worker; returns False if that worker's queue is full"""
+        update = json_codec.loads(body)
+        link = self.links[shard_key(update) % len(self.links)]
+        try:
+            link.queue.put_nowait(json_codec.dumps(update) + b"\n")
+        except asyncio.QueueFull:
+            logging.warning(f"Worker {link.index} is {link.queue.maxsize} updates behind, refusing update")
+            return False
+        return True
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                method = request_line.decode("latin-1").split()[0]
+                if method != "POST":
+                    status = "405 Method Not Allowed"
+                elif self.secret and not hmac.compare_digest(
+                        headers.get("x-telegram-bot-api-secret-token", ""), self.secret):
+                    status = "403 Forbidden"
+                else:
+                    try:
+                        # 503 makes Telegram redeliver the update later
+                        status = "200 OK" if self.dispatch(body) else "503 Service Unavailable"
+                    except json_codec.DECODE_ERRORS:
+                        status = "400 Bad Request"
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n".encode())
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    return
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+# ========== WORKER SIDE ========== #
+class UpdateReceiver:
+    """Accepts updates from the dispatcher and feeds them to an Application's update queue"""
+
+    def __init__(self, application, port, host=WORKER_HOST):
+        self.application = application
+        self.host = host
+        self.port = port
+        self._server = None
+        self._writers = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=1 << 24)
+
+    async def stop(self):
+        """Stop accepting updates; the dispatcher queues new ones until the worker is back"""
+        if self._server:
+            self._server.close()
+            for writer in self._writers:
+                writer.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while line := await reader.readline():
+                try:
+                    update = Update.de_json(json_codec.loads(line), self.application.bot)
+                except Exception as e:
+                    logging.error(f"Dropping malformed update from the dispatcher: {e}")
+                else:
+                    await self.application.update_queue.put(update)
+                # Queued updates are processed before the application stops, so it is safe to acknowledge
+                writer.write(b"+")
+        except (asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+def run_worker(application, port):
+    """Run ``application`` on updates from the dispatcher until SIGTERM, SIGINT or stop_running()
+
+    Mirrors Application.run_polling, including the post_init, post_stop and
+    post_shutdown hooks; like it, the event loop runs with run_forever so
+    Application.stop_running works.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, loop.stop)
+
+    receiver = UpdateReceiver(application, port)
+    try:
+        loop.run_until_complete(application.initialize())
+        if application.post_init:
+            loop.run_until_complete(application.post_init(application))
+        loop.run_until_complete(application.start())
+        loop.run_until_complete(receiver.start())
+        logging.info(f"Worker listening for updates on {receiver.host}:{port}")
+        loop.run_forever()
+    finally:
+        try:
+            loop.run_until_complete(receiver.stop())
+            if application.running:
+                loop.run_until_complete(application.stop())
+                if application.post_stop:
+                    loop.run_until_complete(application.post_stop(application))
+            loop.run_until_complete(application.shutdown())
+            if application.post_shutdown:
+                loop.run_until_complete(application.post_shutdown(application))
+        finally:
+            loop.close()
+
+
+def main():
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+    logging.basicConfig(format="%(asctime)s - dispatcher - %(levelname)s - %(message)s", level=logging.INFO)
+    webhook_url = os.getenv("WEBHOOK_URL")
+    if not webhook_url:
+        sys.exit("Set WEBHOOK_URL to the public HTTPS URL Telegram should post updates to")
+
+    dispatcher = Dispatcher(
+        os.getenv("BOT_TOKEN"),
+        webhook_url,
+        listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+        port=int(os.getenv("WEBHOOK_PORT", 8443)),
+        secret=os.getenv("WEBHOOK_SECRET", ""),
+        workers=int(os.getenv("WORKERS", os.cpu_count() or 2)),
+        worker_base_port=int(os.getenv("WORKER_BASE_PORT", 9100)),
+        queue_size=int(os.getenv("WORKER_QUEUE_SIZE", 1000)),
+        base_url=os.getenv("BOT_API_URL", "https://api.telegram.org")
+    )
+
+    async def run():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        try:
+            await dispatcher.start()
+            await stop.wait()
+        finally:
+            logging.info("Stopping workers...")
+            stop_task = loop.create_task(dispatcher.stop())
+            await dispatcher.wait_stopped()
+            await stop_task
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Import a Telegram Desktop JSON export of the links channel into the local store.
+
+Usage:
+    python import_export.py result.json [--files files.json] [--batches batches.json]
+
+The export's "messages" array is decoded one message at a time, so memory
+use is bounded by the size of the local store rather than the export.
+Records already in the local store are kept as they are.
+"""
+import argparse
+import json
+import logging
+import re
+import sys
+import time
+
+import json_codec
+from json_store import read_bytes, write_json
+from link_records import parse_link_message, merge_link_message
+
+FILE_DATABASE = "files.json"
+BATCHES_FILE = "batches.json"
+
+READ_SIZE = 1 << 20  # Bytes read from the export at a time
+
+_MESSAGES_RE = re.compile(r'"messages"\s*:\s*\[')
+_decoder = json.JSONDecoder()
+
+
+def iter_export_messages(f, read_size=READ_SIZE):
+    """Yield the objects of the export's top-level "messages" array one at a time"""
+    buffer = ""
+    eof = False
+
+    def fill():
+        nonlocal buffer, eof
+        chunk = f.read(read_size)
+        if not chunk:
+            eof = True
+        buffer += chunk
+
+    # Skip ahead to the start of the array
+    while True:
+        match = _MESSAGES_RE.search(buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+        if eof:
+            raise ValueError('No "messages" array found in export')
+        # Keep a tail in case the key spans two reads
+        buffer = buffer[-32:]
+        fill()
+
+    pos = 0
+    while True:
+        # Skip whitespace and separators between messages
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("Export ended inside the messages array")
+            buffer, pos = "", 0
+            fill()
+            continue
+        if buffer[pos] == "]":
+            return
+
+        try:
+            message, end = _decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # The message continues past the end of the buffer
+            buffer, pos = buffer[pos:], 0
+            fill()
+            continue
+
+        yield message
+        pos = end
+        if pos > read_size:
+            buffer, pos = buffer[pos:], 0
+
+
+def message_text(message):
+    """Return the plain text of an exported message"""
+    text = message.get("text", "")
+    if isinstance(text, list):
+        return "".join(part if isinstance(part, str) else part.get("text", "") for part in text)
+    return text
+
+
+def load_store(path):
+    raw = read_bytes(path)
+    if raw is None:
+        return {}
+    data = json_codec.loads(raw)
+    return data if isinstance(data, dict) else {}
+
+
+def import_export(export_path, files_path=FILE_DATABASE, batches_path=BATCHES_FILE, dry_run=False):
+    """Merge every file and batch record in the export into the local store
+
+    Returns a dict of counters.
+    """
+    files = load_store(files_path)
+    batches = load_store(batches_path)
+    assembling = set()
+    batches_changed = False
+    stats = {"messages": 0, "records": 0, "files_added": 0, "batches_added": 0}
+
+    with open(export_path, 'r', encoding='utf-8') as f:
+        for message in iter_export_messages(f):
+            stats["messages"] += 1
+            if message.get("type") != "message":
+                continue
+            parsed = parse_link_message(message_text(message))
+            if not parsed:
+                continue
+            stats["records"] += 1
+            files_added, batches_added = merge_link_message(parsed, message.get("id"), files, batches, assembling)
+            stats["files_added"] += files_added
+            stats["batches_added"] += batches_added
+            # Later parts of a multi-part batch extend a batch added earlier in the run
+            batches_changed = batches_changed or bool(batches_added) or bool(parsed["batch"] and parsed["batch"]["part"] > 1)
+
+            if stats["messages"] % 100000 == 0:
+                logging.info(f"Scanned {stats['messages']} messages, {stats['records']} records")
+
+    if not dry_run:
+        if stats["files_added"]:
+            write_json(files_path, files)
+        if batches_changed:
+            write_json(batches_path, batches)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import a Telegram Desktop JSON export of the links channel")
+    parser.add_argument("export", help="Path to the export's result.json")
+    parser.add_argument("--files", default=FILE_DATABASE, help="File database to update")
+    parser.add_argument("--batches", default=BATCHES_FILE, help="Batch database to update")
+    parser.add_argument("--dry-run", action="store_true", help="Parse the export without writing anything")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    started = time.monotonic()
+    try:
+        stats = import_export(args.export, args.files, args.batches, args.dry_run)
+    except (OSError, ValueError) + json_codec.DECODE_ERRORS as e:
+        logging.error(f"Import failed: {e}")
+        return 1
+
+    logging.info(
+        f"Imported {stats['files_added']} files and {stats['batches_added']} batches "
+        f"from {stats['records']} records in {stats['messages']} messages "
+        f"({time.monotonic() - started:.1f}s)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
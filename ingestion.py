@@ -0,0 +1,247 @@
+import asyncio
+import inspect
+import logging
+import time
+from datetime import timedelta
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+
+def is_transient(error):
+    """Return True for Bot API errors worth retrying"""
+    if isinstance(error, RetryAfter):
+        return True
+    # BadRequest is a NetworkError subclass, but retrying a bad request won't help
+    return isinstance(error, NetworkError) and not isinstance(error, BadRequest)
+
+
+def retry_after_seconds(error):
+    """Return the wait requested by a RetryAfter error in seconds"""
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class IngestionJob:
+    """One upload waiting to be written to the channels and the local store
+
+    ``data`` is owned by the process function, which records progress in it
+    (e.g. the database channel message ID) so a retry resumes where the last
+    attempt stopped instead of forwarding the file twice.
+    """
+
+    __slots__ = ("job_id", "ids", "chat_id", "bot", "data", "attempts", "future", "record")
+
+    def __init__(self, job_id, ids, chat_id, bot, data, future):
+        self.job_id = job_id
+        self.ids = ids
+        self.chat_id = chat_id
+        self.bot = bot
+        self.data = data
+        self.attempts = 0
+        self.future = future
+        self.record = None  # Set once processing succeeds, even if persisting then fails
+
+
+class IngestionQueue:
+    """Background worker queue for file ingestion
+
+    ``process(job, final_attempt)`` does the Bot API work for a job and returns
+    a record; records from all workers are handed to ``persist(records)`` in
+    groups, so a burst of uploads costs one data file rewrite instead of one
+    per file. Transient errors are retried with backoff, honouring RetryAfter.
+    ``report(bot, chat_id, status)`` is called (throttled) as work proceeds so
+    the admin's status message can be kept up to date, and
+    ``on_failure(job, error)`` once for every job that could not be stored.
+
+    Records that still can't be persisted after ``max_attempts`` are kept,
+    since their files were already sent to the channels: they are retried
+    with the next group, or after ``persist_retry_interval`` seconds, until
+    they are written. Their jobs fail with ``job.record`` set, so
+    ``on_failure`` can tell this apart from a failed upload.
+    """
+
+    def __init__(self, process, persist, report=None, workers=4, max_attempts=5, report_interval=2.0,
+                 on_failure=None, persist_retry_interval=60.0):
+        self.process = process
+        self.persist = persist
+        self.report = report
+        self.on_failure = on_failure
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.report_interval = report_interval
+        self.persist_retry_interval = persist_retry_interval
+
+        self._queue = None
+        self._completed = []
+        self._completed_event = None
+        self._tasks = []
+        self._jobs = {}     # job_id -> IngestionJob still in flight
+        self._unpersisted = []  # records whose jobs finished but that are not written yet
+        self._status = {}   # chat_id -> progress counters for the status message
+
+    def submit(self, job_id, chat_id, bot, data, ids=None):
+        """Queue a job and return it; ``job.future`` resolves to the persisted record
+
+        A job that stores several files (an album) passes their IDs as ``ids``
+        so callers can wait on any of them and progress counts every file.
+        """
+        self._ensure_started()
+        ids = tuple(ids) if ids else (job_id,)
+        job = IngestionJob(job_id, ids, chat_id, bot, data, asyncio.get_running_loop().create_future())
+        for key in (job_id,) + ids:
+            self._jobs[key] = job
+
+        status = self._status.setdefault(chat_id, {
+            "queued": 0, "done": 0, "failed": 0, "message_id": None, "last_report": 0.0
+        })
+        status["queued"] += len(ids)
+
+        self._queue.put_nowait(job)
+        return job
+
+    def in_flight(self, job_ids=None):
+        """Return the jobs still in flight, optionally limited to ``job_ids``"""
+        if job_ids is None:
+            job_ids = list(self._jobs)
+        jobs = {self._jobs[job_id].job_id: self._jobs[job_id] for job_id in job_ids if job_id in self._jobs}
+        return list(jobs.values())
+
+    async def wait_for(self, job_ids, timeout=None):
+        """Wait until the given jobs (all jobs if None) are persisted or failed"""
+        futures = [job.future for job in self.in_flight(job_ids)]
+        if futures:
+            await asyncio.wait(futures, timeout=timeout)
+
+    async def drain(self, timeout=None):
+        """Wait until every queued job is persisted or failed"""
+        await self.wait_for(None, timeout)
+
+    @property
+    def unpersisted(self):
+        """Records processed but not yet persisted, after their group ran out of attempts"""
+        return list(self._unpersisted)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _ensure_started(self):
+        if self._tasks and not any(task.done() for task in self._tasks):
+            return
+        for task in self._tasks:
+            task.cancel()
+
+        loop = asyncio.get_running_loop()
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._completed_event = asyncio.Event()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(loop.create_task(self._persister()))
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                record = await self._run_with_retries(job)
+                job.record = record
+                self._completed.append((job, record))
+                self._completed_event.set()
+            except Exception as e:
+                logging.error(f"Ingestion of {job.job_id} failed after {job.attempts} attempts: {e}")
+                await self._finish(job, error=e)
+            finally:
+                self._queue.task_done()
+
+    async def _run_with_retries(self, job):
+        while True:
+            job.attempts += 1
+            final_attempt = job.attempts >= self.max_attempts
+            try:
+                return await self.process(job, final_attempt)
+            except Exception as e:
+                if final_attempt or not is_transient(e):
+                    raise
+                if isinstance(e, RetryAfter):
+                    delay = retry_after_seconds(e)
+                else:
+                    delay = min(2 ** job.attempts, 30)
+                logging.warning(f"Ingestion of {job.job_id} failed ({e}), retrying in {delay}s")
+            await asyncio.sleep(delay)
+
+    async def _persister(self):
+        while True:
+            await self._completed_event.wait()
+            self._completed_event.clear()
+
+            # Let other workers that are about to finish join this group
+            await asyncio.sleep(0)
+            completed, self._completed = self._completed, []
+            if not completed and not self._unpersisted:
+                continue
+
+            # Records kept from groups that failed before go first
+            retried = len(self._unpersisted)
+            records = self._unpersisted + [record for _, record in completed]
+            error = None
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    result = self.persist(records)
+                    if inspect.isawaitable(result):
+                        await result
+                    error = None
+                    break
+                except Exception as e:
+                    error = e
+                    logging.warning(f"Persisting {len(records)} ingested records failed ({e}), attempt {attempt}")
+                    if attempt < self.max_attempts:
+                        await asyncio.sleep(min(2 ** attempt, 30))
+
+            if error:
+                logging.error(f"Could not persist {len(records)} ingested records ({error}); "
+                              f"keeping them to retry in {self.persist_retry_interval}s")
+                self._unpersisted = records
+                asyncio.get_running_loop().call_later(self.persist_retry_interval, self._completed_event.set)
+            else:
+                if retried:
+                    logging.info(f"Persisted {retried} ingested records kept from earlier failures")
+                self._unpersisted = []
+            for job, record in completed:
+                await self._finish(job, record=record, error=error)
+
+    async def _finish(self, job, record=None, error=None):
+        for key in (job.job_id,) + job.ids:
+            self._jobs.pop(key, None)
+        if not job.future.done():
+            if error:
+                job.future.set_exception(error)
+                # Nobody may be waiting on this job; don't warn about an unretrieved exception
+                job.future.exception()
+            else:
+                job.future.set_result(record)
+
+        if error and self.on_failure:
+            try:
+                await self.on_failure(job, error)
+            except Exception as e:
+                logging.error(f"Failed to report failed ingestion of {job.job_id}: {e}")
+
+        status = self._status.get(job.chat_id)
+        if status is None:
+            return
+        status["queued"] -= len(job.ids)
+        status["failed" if error else "done"] += len(job.ids)
+
+        finished = status["queued"] == 0
+        now = time.monotonic()
+        if self.report and (finished or now - status["last_report"] >= self.report_interval):
+            status["last_report"] = now
+            try:
+                await self.report(job.bot, job.chat_id, status)
+            except Exception as e:
+                logging.error(f"Failed to report ingestion status to chat {job.chat_id}: {e}")
+        if status["queued"] == 0:
+            self._status.pop(job.chat_id, None)
@@ -0,0 +1,45 @@
+"""JSON encoding for the data files.
+
+Uses orjson or msgspec when installed and falls back to the standard
+library. Everything works with bytes, so data files are read and written in
+binary mode. ``typed_decoder`` exposes msgspec's schema-driven decoding for
+callers that know the shape of a file.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if orjson is not None:
+    BACKEND = "orjson"
+    loads = orjson.loads
+
+    def dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+elif msgspec is not None:
+    BACKEND = "msgspec"
+    loads = msgspec.json.decode
+    dumps = msgspec.json.encode
+else:
+    BACKEND = "json"
+    loads = json.loads
+
+    def dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+# Any error a decoder (including a typed one) raises for bad input
+DECODE_ERRORS = (json.JSONDecodeError, UnicodeDecodeError) + ((msgspec.DecodeError,) if msgspec is not None else ())
+
+
+def typed_decoder(type_):
+    """Return a bytes -> ``type_`` decoder when msgspec is installed, otherwise None"""
+    if msgspec is None:
+        return None
+    return msgspec.json.Decoder(type_).decode
@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import json_codec
+import metrics
+import tracing
+
+# Writes queued within this many seconds of each other share one commit
+GROUP_COMMIT_WINDOW = 0.005
+
+
+def _keep_corrupt_copy(path, error):
+    """Copy a file that failed to decode aside, so the next write can't destroy it"""
+    try:
+        corrupt_path = f"{path}.corrupt-{int(os.path.getmtime(path))}"
+        if not os.path.exists(corrupt_path):
+            shutil.copyfile(path, corrupt_path)
+    except OSError:
+        corrupt_path = None
+    logging.error(f"Error decoding {path}: {error}; saved a copy as {corrupt_path}")
+
+
+def read_bytes(path):
+    """Return the raw contents of a data file, or None if it doesn't exist"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def read_json(path, default):
+    """Load a JSON data file, returning a copy of ``default`` if it is missing, corrupt or the wrong type"""
+    raw = read_bytes(path)
+    if raw is None:
+        return default.copy()
+    try:
+        data = json_codec.loads(raw)
+    except json_codec.DECODE_ERRORS as e:
+        _keep_corrupt_copy(path, e)
+        return default.copy()
+    if not isinstance(data, type(default)):
+        return default.copy()
+    return data
+
+
+def fsync_directory(directory):
+    """Flush a directory entry so a rename into it survives a crash"""
+    if not hasattr(os, "O_DIRECTORY"):
+        return  # Not supported (e.g. on Windows)
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_json(path, data, sync_directory=True):
+    """Atomically replace a data file: write a temp file, fsync it and rename it into place
+
+    A crash leaves either the old or the new contents, never a truncated file.
+    Pass ``sync_directory=False`` to fsync the directory once for several files.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(json_codec.dumps(data))
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    if sync_directory:
+        fsync_directory(directory)
+
+
+class JsonStore:
+    """Runs data file I/O on a dedicated thread so the event loop never waits on disk
+
+    Writes are group committed: every ``update`` or ``save`` queued within
+    ``commit_window`` seconds, or while the previous commit is still running,
+    is applied in one pass. Each file touched is loaded once, modified by all
+    of its queued updates, written atomically (see write_json) and fsynced
+    once, and the directory is fsynced once for the whole group. A single
+    worker thread keeps reads and writes in submission order.
+    """
+
+    def __init__(self, commit_window=GROUP_COMMIT_WINDOW):
+        self.commit_window = commit_window
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="json-store")
+        self._pending = {}  # path -> (default, [(apply, future)]) waiting for the next commit
+        self._writer = None
+        self._records = {}  # (path, parse) -> (file identity, parsed records)
+
+    async def run(self, func, *args):
+        """Run ``func(*args)`` on the I/O thread"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def load(self, path, default):
+        """Return the contents of a data file, or a copy of ``default``"""
+        with tracing.span("storage.load", path=path):
+            return await self.run(self._timed_read, path, default)
+
+    async def load_records(self, path, parse):
+        """Return the records in a data file, reusing them while the file is unchanged
+
+        ``parse`` is a records.RecordParser. The result is shared between
+        callers and must not be modified.
+        """
+        with tracing.span("storage.load_records", path=path):
+            return await self.run(self._load_records, path, parse)
+
+    async def update(self, path, mutate, default):
+        """Apply ``mutate(data)`` to a data file in place and return its result
+
+        ``mutate`` runs on the I/O thread and must only touch ``data``.
+        """
+        with tracing.span("storage.update", path=path):
+            return await self._queue(path, default, lambda data: (data, mutate(data)))
+
+    async def transform(self, path, func, default):
+        """Replace a data file with the data from ``func(data) -> (data, result)`` and return result
+
+        Like update, ``func`` runs on the I/O thread inside the group commit,
+        so nothing written meanwhile is lost. Use it when the new contents are
+        built as a new object rather than changed in place.
+        """
+        with tracing.span("storage.transform", path=path):
+            return await self._queue(path, default, func)
+
+    async def save(self, path, data):
+        """Replace the contents of a data file"""
+        with tracing.span("storage.save", path=path):
+            await self._queue(path, data, lambda _: (data, None))
+
+    async def drain(self):
+        """Wait for all queued writes to be committed"""
+        while self._writer:
+            await asyncio.gather(self._writer, return_exceptions=True)
+
+    # Synchronous access for code already running on the I/O thread (see run)
+
+    def read(self, path, default):
+        return read_json(path, default)
+
+    def read_raw(self, path):
+        return read_bytes(path)
+
+    def write(self, path, data):
+        write_json(path, data)
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def size(self, path):
+        """Return the stored size of a data file in bytes, or None if it doesn't exist"""
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+
+    def _identity(self, path):
+        """Return a value that changes whenever the data file is rewritten"""
+        try:
+            stat = os.stat(path)
+            # write_json renames a new file into place, so the inode changes on every write
+            return stat.st_ino, stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def _timed_read(self, path, default):
+        with metrics.STORAGE_SECONDS.time(operation="read"):
+            return self.read(path, default)
+
+    def _load_records(self, path, parse):
+        identity = self._identity(path)
+        cached = self._records.get((path, parse))
+        if cached and identity is not None and cached[0] == identity:
+            metrics.record_cache("records", True)
+            return cached[1]
+        metrics.record_cache("records", False)
+
+        with metrics.STORAGE_SECONDS.time(operation="load_records"):
+            raw = self.read_raw(path)
+            try:
+                records = parse.from_bytes(raw) if raw is not None else parse({})
+            except json_codec.DECODE_ERRORS as e:
+                _keep_corrupt_copy(path, e)
+                records = parse({})
+        self._records[(path, parse)] = (identity, records)
+        return records
+
+    async def _queue(self, path, default, apply):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(path, (default, []))[1].append((apply, future))
+        if self._writer is None:
+            self._writer = loop.create_task(self._commit_pending())
+        return await future
+
+    async def _commit_pending(self):
+        try:
+            while self._pending:
+                # Let writes arriving in the next few milliseconds join this commit
+                await asyncio.sleep(self.commit_window)
+                pending, self._pending = self._pending, {}
+                try:
+                    with metrics.STORAGE_SECONDS.time(operation="commit"):
+                        results = await self.run(self._commit, pending)
+                except Exception as e:
+                    results = {path: [(False, e)] * len(ops) for path, (_, ops) in pending.items()}
+
+                for path, (_, ops) in pending.items():
+                    for (_, future), (ok, value) in zip(ops, results[path]):
+                        if future.done():
+                            continue
+                        if ok:
+                            future.set_result(value)
+                        else:
+                            future.set_exception(value)
+        finally:
+            self._writer = None
+
+    @staticmethod
+    def _apply(data, ops):
+        """Apply queued operations to ``data``; returns (data, [(ok, result or exception)])"""
+        results = []
+        for apply, _ in ops:
+            try:
+                data, result = apply(data)
+                results.append((True, result))
+            except Exception as e:
+                results.append((False, e))
+        return data, results
+
+    def _commit(self, pending):
+        results = {}
+        directories = set()
+        for path, (default, ops) in pending.items():
+            data, path_results = self._apply(read_json(path, default), ops)
+            if any(ok for ok, _ in path_results):
+                try:
+                    write_json(path, data, sync_directory=False)
+                    directories.add(os.path.dirname(os.path.abspath(path)))
+                except Exception as e:
+                    logging.error(f"Error writing {path}: {e}")
+                    path_results = [(False, e)] * len(ops)
+            results[path] = path_results
+
+        for directory in directories:
+            try:
+                fsync_directory(directory)
+            except OSError as e:
+                logging.warning(f"Error syncing {directory}: {e}")
+        return results
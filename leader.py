@@ -0,0 +1,60 @@
+"""Leader election between bot processes through an exclusive file lock.
+
+Jobs that must run once per deployment rather than once per worker, such as
+auto-deletes and token refresh, run only in the process holding the lease.
+The lock belongs to an open file descriptor, so the operating system releases
+it the moment the leader exits or crashes, and another worker can take over
+on its next attempt. Where ``fcntl`` isn't available (Windows) every process
+considers itself the leader, which is right for a single process.
+"""
+import logging
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class LeaderLease:
+    """Non-blocking exclusive lock on ``path``; ``held`` says whether this process is the leader"""
+
+    def __init__(self, path):
+        self.path = path
+        self.held = False
+        self._fd = None
+
+    def acquire(self):
+        """Try to become the leader without waiting; returns whether the lease is held"""
+        if self.held:
+            return True
+        if fcntl is None:
+            self.held = True
+            return True
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        except BaseException:
+            os.close(fd)
+            raise
+
+        # Record the holder for whoever is debugging the deployment
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        self.held = True
+        logging.info(f"Acquired leader lease {self.path}")
+        return True
+
+    def release(self):
+        """Give up the lease so another process can take it"""
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+            logging.info(f"Released leader lease {self.path}")
+        self.held = False
@@ -0,0 +1,253 @@
+"""Links channel message formats.
+
+Batch records are posted as one or more "🔗 Batch Link" messages. Each
+message repeats the batch header and carries one line per file:
+
+    F|<file_id>|<message_id>|<media_type>|<name>
+
+The name is the last field, so it may contain "|" itself. Each message ends
+with the "#file_<id>" and "#batch_files_<ids>" tags the older posts carried.
+The links channel search helpers read a file's message ID from a
+"Message ID:" line, which a packed post can't have for each of its files, so
+a batch's files are read back from its own posts with read_batch_files.
+parse_link_message also understands the older one-message-per-file "🔗 File Link" posts and the
+"#batch_files_" batch posts, so a links channel can be replayed into the
+local store (see /reindex and import_export.py).
+"""
+import re
+
+# Telegram's limit for message text
+MAX_MESSAGE_LENGTH = 4096
+
+RECORD_PREFIX = "F|"
+BATCH_HEADER = "🔗 Batch Link"
+
+
+def format_file_record(file_id, message_id, media_type, name):
+    """Return the one-line record for a file"""
+    name = (name or "").replace("\n", " ")
+    return f"{RECORD_PREFIX}{file_id}|{message_id}|{media_type or 'unknown'}|{name}"
+
+
+def parse_file_record(line):
+    """Parse a record line into a dict, or return None if it isn't one"""
+    if not line.startswith(RECORD_PREFIX):
+        return None
+    parts = line[len(RECORD_PREFIX):].split("|", 3)
+    if len(parts) != 4:
+        return None
+
+    file_id, message_id, media_type, name = parts
+    try:
+        message_id = int(message_id)
+    except ValueError:
+        return None
+    return {
+        "file_id": file_id,
+        "message_id": message_id,
+        "media_type": media_type,
+        "custom_name": name or None
+    }
+
+
+def pack_batch_messages(batch_id, batch_link, date, records, limit=MAX_MESSAGE_LENGTH):
+    """Pack record lines for a batch into as few messages as fit under ``limit``
+
+    ``records`` are lines from format_file_record. Every message starts with
+    the batch header and ends with search tags for its own files, so each
+    part can be parsed and found on its own.
+    """
+    def header(part, parts):
+        return (f"{BATCH_HEADER} (part {part}/{parts}, contains {len(records)} files)\n\n"
+                f"ID: {batch_id}\n"
+                f"Date: {date}\n"
+                f"Total Files: {len(records)}\n"
+                f"Link: {batch_link}\n\n"
+                f"#batch_{batch_id}\n")
+
+    # The part count changes the header length, so pack once with a generous
+    # placeholder and then fill in the real numbers
+    budget = limit - len(header(9999, 9999))
+    budget -= len("\n\n\n#batch_files_")
+    chunks = [[]]
+    size = 0
+    for record in records:
+        file_id = record[len(RECORD_PREFIX):].split("|", 1)[0]
+        tags = len(file_id) + 7 + len(file_id) + 1  # "#file_<id> " and "<id>," in the tag lines
+        if len(record) + 1 + tags > budget:
+            record = record[:budget - 1 - tags]
+        if chunks[-1] and size + len(record) + 1 + tags > budget:
+            chunks.append([])
+            size = 0
+        chunks[-1].append((file_id, record))
+        size += len(record) + 1 + tags
+
+    return [
+        header(i, len(chunks)) + "\n".join(record for _, record in chunk) + "\n\n"
+        + " ".join(f"#file_{file_id}" for file_id, _ in chunk) + "\n"
+        + f"#batch_files_{','.join(file_id for file_id, _ in chunk)}"
+        for i, chunk in enumerate(chunks, 1)
+    ]
+
+
+def parse_batch_records(text):
+    """Return the file records found in a links channel message"""
+    records = []
+    for line in text.splitlines():
+        record = parse_file_record(line.strip())
+        if record:
+            records.append(record)
+    return records
+
+
+FILE_HEADER = "🔗 File Link"
+
+_ID_RE = re.compile(r"^ID: (\S+)$", re.MULTILINE)
+_NAME_RE = re.compile(r"^Name: (.*)$", re.MULTILINE)
+_TYPE_RE = re.compile(r"^Type: (\S+)$", re.MULTILINE)
+_DATE_RE = re.compile(r"^Date: (.*)$", re.MULTILINE)
+_CAPTION_RE = re.compile(r"^Caption: (.*?)\nMessage ID:", re.MULTILINE | re.DOTALL)
+_MESSAGE_ID_RE = re.compile(r"^Message ID: (\d+)$", re.MULTILINE)
+_LINK_RE = re.compile(r"^Link: (\S+)$", re.MULTILINE)
+_BATCH_TAG_RE = re.compile(r"#batch_([0-9a-fA-F-]+)\b")
+_BATCH_FILES_RE = re.compile(r"#batch_files_(\S+)")
+_PART_RE = re.compile(r"\(part (\d+)/(\d+)")
+
+
+def _match(pattern, text):
+    match = pattern.search(text)
+    return match.group(1).strip() if match else None
+
+
+def parse_link_message(text):
+    """Parse a links channel message
+
+    Returns a dict with ``files`` (file_id -> record) and ``batch`` (a dict
+    with ``batch_id``, ``part``, ``parts`` and ``files``, or None), or None if the text
+    is not a file or batch record. Batch posts that list only file names
+    carry no file IDs and can't be recovered.
+    """
+    if not text:
+        return None
+
+    if text.startswith(FILE_HEADER):
+        file_id = _match(_ID_RE, text)
+        message_id = _match(_MESSAGE_ID_RE, text)
+        if not file_id or not message_id:
+            return None
+        name = _match(_NAME_RE, text)
+        record = {
+            "message_id": int(message_id),
+            "custom_name": None if name in (None, "", "Unnamed file") else name,
+            "media_type": _match(_TYPE_RE, text) or "unknown",
+            "caption": _match(_CAPTION_RE, text) or "",
+            "date": _match(_DATE_RE, text) or "",
+            "file_link": _match(_LINK_RE, text) or ""
+        }
+        return {"files": {file_id: record}, "batch": None}
+
+    if text.startswith(BATCH_HEADER):
+        batch_id = _match(_BATCH_TAG_RE, text)
+        if not batch_id:
+            return None
+
+        files = {}
+        file_ids = []
+        for record in parse_batch_records(text):
+            file_id = record.pop("file_id")
+            file_ids.append(file_id)
+            # Message ID 0 marks a file recorded by its own File Link post
+            if record["message_id"]:
+                files[file_id] = record
+
+        if not file_ids:
+            tagged = _match(_BATCH_FILES_RE, text)
+            file_ids = [fid for fid in tagged.split(",") if fid] if tagged else []
+        if not file_ids:
+            return None
+
+        part = _PART_RE.search(text)
+        return {
+            "files": files,
+            "batch": {
+                "batch_id": batch_id,
+                "part": int(part.group(1)) if part else 1,
+                "parts": int(part.group(2)) if part else 1,
+                "files": file_ids,
+                "date": _match(_DATE_RE, text) or ""
+            }
+        }
+
+    return None
+
+
+async def read_batch_files(read_text, batch_id, first_message_id, scan_limit=20):
+    """Collect a packed batch's file records from its links channel posts
+
+    ``read_text(message_id)`` returns a links channel message's text, or None
+    if there isn't one. The parts of a batch are posted one after another
+    from ``first_message_id``, so messages are read in order, skipping other
+    posts, until the last part or ``scan_limit`` messages without a part.
+    Returns file_id -> record, as merge_link_files stores them.
+    """
+    files = {}
+    message_id = last_part_id = first_message_id
+    while message_id - last_part_id <= scan_limit:
+        parsed = parse_link_message(await read_text(message_id))
+        batch = parsed and parsed["batch"]
+        if batch and batch["batch_id"] == batch_id:
+            merge_link_files(parsed, message_id, files)
+            last_part_id = message_id
+            if batch["part"] >= batch["parts"]:
+                break
+        message_id += 1
+    return files
+
+
+def merge_link_message(parsed, links_msg_id, files, batches, assembling):
+    """Merge a parsed links channel message into the files and batches stores
+
+    Records already in the stores are left alone. ``assembling`` is the set
+    of batch IDs created by this merge run whose later parts are still to
+    come; a batch leaves it with its last part. Returns (files_added,
+    batches_added).
+    """
+    return (
+        merge_link_files(parsed, links_msg_id, files),
+        merge_link_batch(parsed, links_msg_id, batches, assembling)
+    )
+
+
+def merge_link_files(parsed, links_msg_id, files):
+    """Merge the file records of a parsed links channel message and return how many were added"""
+    files_added = 0
+    for file_id, record in parsed["files"].items():
+        if file_id not in files:
+            files[file_id] = dict(record, links_channel_msg_id=links_msg_id)
+            files_added += 1
+    return files_added
+
+
+def merge_link_batch(parsed, links_msg_id, batches, assembling):
+    """Merge the batch of a parsed links channel message and return 1 if it was added, else 0"""
+    batch = parsed["batch"]
+    if not batch:
+        return 0
+
+    batch_id = batch["batch_id"]
+    if batch_id not in batches:
+        batches[batch_id] = {
+            "files": list(batch["files"]),
+            "date": batch["date"],
+            "total_files": len(batch["files"]),
+            "links_channel_msg_id": links_msg_id
+        }
+        if batch["part"] < batch["parts"]:
+            assembling.add(batch_id)
+        return 1
+    if batch_id in assembling and batch["part"] > 1:
+        batches[batch_id]["files"].extend(batch["files"])
+        batches[batch_id]["total_files"] = len(batches[batch_id]["files"])
+        if batch["part"] >= batch["parts"]:
+            assembling.discard(batch_id)
+    return 0
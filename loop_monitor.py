@@ -0,0 +1,124 @@
+"""Event-loop lag monitoring.
+
+A heartbeat task on the loop measures how late each of its wakeups is and
+records it in ``metrics.LOOP_LAG``. A watchdog thread watches the heartbeat
+and, once the loop has been stuck for longer than the threshold, captures
+the loop thread's stack while it is still blocked, so each slow stall is
+reported with the code that caused it rather than whatever runs next.
+"""
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+
+import metrics
+
+HEARTBEAT_INTERVAL = 0.1  # Seconds between heartbeats
+
+LOOP_LAG = metrics.REGISTRY.register(metrics.Histogram(
+    "bot_event_loop_lag_seconds", "How late the event loop ran a scheduled heartbeat",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)))
+SLOW_STALLS = metrics.REGISTRY.register(metrics.Counter(
+    "bot_event_loop_stalls_total", "Event loop stalls over the slow threshold, by handler", ["handler"]))
+
+
+class Stall:
+    """One period in which the event loop was blocked for longer than the threshold"""
+
+    __slots__ = ("at", "lag", "handler", "culprit", "stack")
+
+    def __init__(self, at, lag, handler, culprit, stack):
+        self.at = at
+        self.lag = lag
+        self.handler = handler
+        self.culprit = culprit
+        self.stack = stack
+
+
+def _describe(frames, app_files):
+    """Return (outermost app frame, innermost frame) labels for a captured stack"""
+    handler = culprit = None
+    for filename, lineno, name in frames:  # Outermost first
+        label = f"{name} ({os.path.basename(filename)}:{lineno})"
+        # The module frame that started the loop is on every stack; skip it
+        if handler is None and name != "<module>" and os.path.basename(filename) in app_files:
+            handler = name
+        culprit = label
+    return handler or "unknown", culprit or "unknown"
+
+
+class LoopMonitor:
+    """Measures event-loop lag and records stalls over ``threshold`` seconds
+
+    ``app_files`` names the modules whose outermost frame on a stalled stack
+    is reported as the handler (e.g. {"bot.py"}).
+    """
+
+    def __init__(self, threshold=0.5, app_files=("bot.py",), interval=HEARTBEAT_INTERVAL, keep=100):
+        self.threshold = threshold
+        self.app_files = set(app_files)
+        self.interval = interval
+        self.stalls = collections.deque(maxlen=keep)
+        self.pending = []  # Stalls not yet reported to admins
+        self._beat = None
+        self._captured = None  # (heartbeat, stack) the watchdog took during a stall
+        self._thread_id = None
+        self._task = None
+        self._stop = threading.Event()
+        self._watchdog = None
+
+    def start(self):
+        if self._task:
+            return  # Already watching this loop
+        self._thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def take_pending(self):
+        """Return and forget the stalls recorded since the last call"""
+        pending, self.pending = self.pending, []
+        return pending
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            self._beat = expected
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - expected)
+            LOOP_LAG.observe(lag)
+            if lag >= self.threshold:
+                self._record(lag, expected)
+
+    def _record(self, lag, beat):
+        captured, self._captured = self._captured, None
+        # A stack captured for another heartbeat belongs to a different stall
+        frames = captured[1] if captured and captured[0] == beat else []
+        handler, culprit = _describe(frames, self.app_files)
+        stall = Stall(time.time(), lag, handler, culprit, frames)
+        self.stalls.append(stall)
+        self.pending.append(stall)
+        SLOW_STALLS.inc(handler=handler)
+
+    def _watch(self):
+        while not self._stop.wait(self.interval / 2):
+            beat = self._beat
+            if (self._captured is None or self._captured[0] != beat) and time.monotonic() - beat > self.threshold:
+                frame = sys._current_frames().get(self._thread_id)
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append((code.co_filename, frame.f_lineno, code.co_name))
+                    frame = frame.f_back
+                self._captured = (beat, frames[::-1])
@@ -0,0 +1,324 @@
+"""In-process metrics with a Prometheus text endpoint.
+
+Counters, gauges and histograms live in ``REGISTRY`` and are rendered in the
+Prometheus text exposition format, either by ``MetricsServer`` on a local
+port or by ``render`` for anything else that wants them. Recording a value is
+a dict lookup and an addition, cheap enough for every update and API call.
+Each metric has a lock, because the data store records from its I/O thread
+while the endpoint renders on the event loop.
+"""
+import asyncio
+import bisect
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
+
+import tracing
+
+# Seconds; covers everything from a cached lookup to a slow upload
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _escape(value):
+    """Escape a label value for the text exposition format"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """A monotonically increasing count, per label combination"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(_label_key(self.labelnames, labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Gauge:
+    """A value that can go up and down, per label combination"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self.values[key] = value
+
+    def get(self, **labels):
+        return self.values.get(_label_key(self.labelnames, labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Histogram:
+    """Observations counted into cumulative buckets, per label combination"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # label key -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def _series(self, labels):
+        """Return a copy of one label combination's series, or None"""
+        with self._lock:
+            series = self.values.get(_label_key(self.labelnames, labels))
+            return list(series) if series else None
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a ``with`` block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        series = self._series(labels)
+        return sum(series[:-1]) if series else 0
+
+    def total(self, **labels):
+        series = self._series(labels)
+        return series[-1] if series else 0.0
+
+    def quantile(self, q, **labels):
+        """Estimate a quantile by interpolating within its bucket, or None without data"""
+        series = self._series(labels)
+        if not series:
+            return None
+        count = sum(series[:-1])
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        lower = 0.0
+        for bound, bucket_count in zip(self.buckets, series):
+            if seen + bucket_count >= rank:
+                return lower + (bound - lower) * ((rank - seen) / bucket_count if bucket_count else 0)
+            seen += bucket_count
+            lower = bound
+        return self.buckets[-1]  # In the +Inf bucket; the largest bound is the best estimate
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(series)) for key, series in self.values.items())
+        for key, series in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, series):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, key, [("le", bound)]), cumulative
+            cumulative += series[-2]
+            yield f"{self.name}_bucket", _format_labels(self.labelnames, key, [("le", "+Inf")]), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labelnames, key), series[-1]
+            yield f"{self.name}_count", _format_labels(self.labelnames, key), cumulative
+
+    def label_values(self):
+        with self._lock:
+            keys = sorted(self.values)
+        return [dict(zip(self.labelnames, key)) for key in keys]
+
+
+class Registry:
+    """A named collection of metrics"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    "bot_handler_seconds", "Time spent handling an update, by handler", ["handler"]))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    "bot_handler_errors_total", "Handler calls that raised, by handler", ["handler"]))
+API_SECONDS = REGISTRY.register(Histogram(
+    "bot_api_request_seconds", "Bot API request latency, by method", ["method"]))
+API_ERRORS = REGISTRY.register(Counter(
+    "bot_api_errors_total", "Bot API requests that failed, by method and error", ["method", "error"]))
+API_RETRY_AFTER = REGISTRY.register(Counter(
+    "bot_api_retry_after_total", "Bot API requests rejected with RetryAfter (flood control), by method", ["method"]))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "bot_cache_lookups_total", "Cache lookups, by cache and result (hit or miss)", ["cache", "result"]))
+STORAGE_SECONDS = REGISTRY.register(Histogram(
+    "bot_storage_seconds", "Data file I/O time, by operation", ["operation"]))
+COMPACTION_REMOVED = REGISTRY.register(Counter(
+    "bot_compaction_removed_total", "Entries removed by data store compaction, by file", ["file"]))
+COMPACTION_RECLAIMED_BYTES = REGISTRY.register(Counter(
+    "bot_compaction_reclaimed_bytes_total", "Bytes reclaimed by data store compaction, by file", ["file"]))
+DATA_FILE_BYTES = REGISTRY.register(Gauge(
+    "bot_data_file_bytes", "Data file size after the last compaction, by file", ["file"]))
+TOKEN_STATE_ENTRIES = REGISTRY.register(Gauge(
+    "bot_token_state_entries", "In-memory token state entries after the last compaction, by bot and map", ["tenant", "state"]))
+
+
+def render():
+    return REGISTRY.render()
+
+
+def timed(name, func=None):
+    """Record latency and errors of an async handler under ``name``
+
+    Usable as ``@timed("send_file")`` or as ``timed(name, callback)``.
+    """
+    if func is None:
+        return functools.partial(timed, name)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+    wrapper.timed = True
+    return wrapper
+
+
+def record_cache(cache, hit):
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def cache_hit_ratio(cache):
+    """Return the fraction of lookups in ``cache`` that hit, or None before any lookup"""
+    hits = CACHE_LOOKUPS.get(cache=cache, result="hit")
+    total = hits + CACHE_LOOKUPS.get(cache=cache, result="miss")
+    return hits / total if total else None
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """The default Bot API transport, recording latency and failures per API method"""
+
+    async def post(self, url, *args, **kwargs):
+        method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            with tracing.span(f"api.{method}"):
+                return await super().post(url, *args, **kwargs)
+        except RetryAfter:
+            API_RETRY_AFTER.inc(method=method)
+            API_ERRORS.inc(method=method, error="RetryAfter")
+            raise
+        except Exception as e:
+            API_ERRORS.inc(method=method, error=type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method=method)
+
+
+class MetricsServer:
+    """Serves ``GET /metrics`` in the Prometheus text format on a local port"""
+
+    def __init__(self, host="127.0.0.1", port=9108, registry=REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._server = None
+
+    async def start(self):
+        if self._server:
+            return  # Already serving, e.g. for another bot in this process
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logging.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain the headers; the request has no body we care about
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/metrics", "/"):
+                status, content_type, body = "200 OK", "text/plain; version=0.0.4; charset=utf-8", self.registry.render().encode()
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", b"Not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,113 @@
+"""On-demand profiling of the running event loop.
+
+``SamplingProfiler`` samples the loop thread's stack from a background
+thread, which costs the loop next to nothing, and reports collapsed stacks
+(the input format of flamegraph.pl and speedscope). The sampler can only
+look while the loop thread lets go of the GIL, so a long C call that holds
+it (e.g. decoding a big JSON file) is undercounted; cProfile mode catches
+those at the cost of slowing the loop while it runs. ``profile_loop`` runs
+either for a fixed window and returns a report.
+"""
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+SAMPLE_INTERVAL = 0.005  # Seconds between stack samples
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Periodically records the stack of one thread"""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        """Return the samples as collapsed stacks, one "frame;frame;... count" line each"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def top_functions(self, limit=15):
+        """Return [(function, self samples, total samples)] for the hottest functions"""
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return [(frame, count, total[frame]) for frame, count in own.most_common(limit)]
+
+
+async def profile_loop(seconds, mode="sample"):
+    """Profile the running event loop for ``seconds`` and return (summary, report filename, report bytes)
+
+    ``mode`` is "sample" for collapsed stacks or "cprofile" for
+    deterministic profiling, which is more precise but slows the loop down
+    while it runs.
+    """
+    if mode == "cprofile":
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+        output = io.StringIO()
+        stats = pstats.Stats(profile, stream=output).sort_stats("tottime")
+        stats.print_stats(40)
+        output.write("\n")
+        stats.sort_stats("cumulative").print_stats(40)
+
+        lines = [f"cProfile over {seconds}s, top functions by own time:"]
+        top = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:10]
+        for (filename, lineno, name), (_, calls, tottime, cumtime, _) in top:
+            lines.append(f"• {name} ({os.path.basename(filename)}:{lineno}) - {tottime * 1000:.0f}ms own, {cumtime * 1000:.0f}ms total, {calls} calls")
+        return "\n".join(lines), f"profile_{int(time.time())}.txt", output.getvalue().encode()
+
+    profiler = SamplingProfiler(threading.get_ident())
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.stop()
+
+    lines = [f"{profiler.samples} samples over {seconds}s, top functions by own samples:"]
+    for frame, own, total in profiler.top_functions(10):
+        share = own / profiler.samples if profiler.samples else 0
+        lines.append(f"• {frame} - {share:.0%} own, {total} total")
+    return "\n".join(lines), f"profile_{int(time.time())}.collapsed.txt", profiler.collapsed().encode()
@@ -0,0 +1,255 @@
+import sys
+from typing import Dict, List, Optional, Union
+
+import json_codec
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _str(value):
+    return value if isinstance(value, str) else ""
+
+
+class FileRecord:
+    """Metadata for one stored file (a files.json entry)
+
+    String fields are never None (an empty custom_name means an unnamed file)
+    and media types are interned, since a library only has a handful of them.
+    """
+
+    __slots__ = ("message_id", "custom_name", "media_type", "caption", "date",
+                 "file_link", "file_unique_id", "links_channel_msg_id")
+
+    def __init__(self, message_id, custom_name="", media_type="unknown", caption="", date="",
+                 file_link="", file_unique_id=None, links_channel_msg_id=None):
+        self.message_id = message_id
+        self.custom_name = custom_name
+        self.media_type = sys.intern(media_type or "unknown")
+        self.caption = caption
+        self.date = date
+        self.file_link = file_link
+        self.file_unique_id = file_unique_id
+        self.links_channel_msg_id = links_channel_msg_id
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a record from a files.json entry, or return None if it has no usable message ID"""
+        if not isinstance(data, dict):
+            return None
+        message_id = _int_or_none(data.get("message_id"))
+        if not message_id:
+            return None
+        return cls(
+            message_id,
+            custom_name=_str(data.get("custom_name")),
+            media_type=_str(data.get("media_type")),
+            caption=_str(data.get("caption")),
+            date=_str(data.get("date")),
+            file_link=_str(data.get("file_link")),
+            file_unique_id=data.get("file_unique_id") or None,
+            links_channel_msg_id=_int_or_none(data.get("links_channel_msg_id"))
+        )
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+class BatchRecord:
+    """A stored batch (a batches.json entry)
+
+    Older batches were saved as a bare list of file IDs; both shapes load
+    into this one representation.
+    """
+
+    __slots__ = ("files", "date", "links_channel_msg_id")
+
+    def __init__(self, files, date="", links_channel_msg_id=None):
+        self.files = files
+        self.date = date
+        self.links_channel_msg_id = links_channel_msg_id
+
+    @property
+    def total_files(self):
+        return len(self.files)
+
+    @classmethod
+    def from_data(cls, data):
+        """Build a record from either batch shape, or return None if it lists no files"""
+        if isinstance(data, list):
+            files, data = data, {}
+        elif isinstance(data, dict):
+            files = data.get("files")
+        else:
+            return None
+        if not isinstance(files, list) or not files:
+            return None
+        return cls(
+            tuple(str(file_id) for file_id in files),
+            date=_str(data.get("date")),
+            links_channel_msg_id=_int_or_none(data.get("links_channel_msg_id"))
+        )
+
+    def to_dict(self):
+        return {
+            "files": list(self.files),
+            "date": self.date,
+            "total_files": self.total_files,
+            "links_channel_msg_id": self.links_channel_msg_id
+        }
+
+
+class TokenRecord:
+    """An access token from tokens.json; user_id 0 means valid for every user"""
+
+    __slots__ = ("user_id", "expiry")
+
+    def __init__(self, user_id, expiry):
+        self.user_id = user_id
+        self.expiry = expiry
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            return None
+        user_id = _int_or_none(data.get("user_id"))
+        expiry = _int_or_none(data.get("expiry"))
+        if user_id is None or expiry is None:
+            return None
+        return cls(user_id, expiry)
+
+    def to_dict(self):
+        return {"user_id": self.user_id, "expiry": self.expiry}
+
+
+if msgspec is not None:
+    class FileEntry(msgspec.Struct):
+        """files.json entry schema for typed decoding"""
+        message_id: Optional[int] = None
+        custom_name: Optional[str] = None
+        media_type: Optional[str] = None
+        caption: Optional[str] = None
+        date: Optional[str] = None
+        file_link: Optional[str] = None
+        file_unique_id: Optional[str] = None
+        links_channel_msg_id: Optional[int] = None
+
+    class BatchEntry(msgspec.Struct):
+        """batches.json entry schema (dict shape) for typed decoding"""
+        files: List[str] = []
+        date: Optional[str] = None
+        links_channel_msg_id: Optional[int] = None
+
+    class TokenEntry(msgspec.Struct):
+        """tokens.json entry schema for typed decoding"""
+        user_id: int
+        expiry: int
+
+    def _file_from_entry(entry):
+        if not entry.message_id:
+            return None
+        return FileRecord(
+            entry.message_id,
+            custom_name=entry.custom_name or "",
+            media_type=entry.media_type or "",
+            caption=entry.caption or "",
+            date=entry.date or "",
+            file_link=entry.file_link or "",
+            file_unique_id=entry.file_unique_id,
+            links_channel_msg_id=entry.links_channel_msg_id
+        )
+
+    def _batch_from_entry(entry):
+        if isinstance(entry, list):
+            return BatchRecord(tuple(entry)) if entry else None
+        if not entry.files:
+            return None
+        return BatchRecord(tuple(entry.files), entry.date or "", entry.links_channel_msg_id)
+
+    def _token_from_entry(entry):
+        return TokenRecord(entry.user_id, entry.expiry)
+
+    _FILE_SCHEMA = (json_codec.typed_decoder(Dict[str, FileEntry]), _file_from_entry)
+    _BATCH_SCHEMA = (json_codec.typed_decoder(Dict[str, Union[List[str], BatchEntry]]), _batch_from_entry)
+    _TOKEN_SCHEMA = (json_codec.typed_decoder(Dict[str, TokenEntry]), _token_from_entry)
+else:
+    _FILE_SCHEMA = _BATCH_SCHEMA = _TOKEN_SCHEMA = None
+
+
+class RecordParser:
+    """Turns the contents of a data file into a mapping of records
+
+    Called with decoded JSON, entries are validated one by one and malformed
+    ones dropped. ``from_bytes`` decodes raw file contents; with msgspec
+    installed it decodes straight into a typed schema, falling back to the
+    per-entry path if any entry doesn't fit the schema.
+    """
+
+    def __init__(self, build, schema=None):
+        self.build = build
+        self.schema = schema
+
+    def __call__(self, data):
+        if not isinstance(data, dict):
+            return {}
+        records = {}
+        for key, value in data.items():
+            record = self.build(value)
+            if record is not None:
+                records[key] = record
+        return records
+
+    def from_bytes(self, raw):
+        if self.schema:
+            decode, convert = self.schema
+            try:
+                entries = decode(raw)
+            except msgspec.ValidationError:
+                pass  # Some entry has an unexpected shape; validate entry by entry instead
+            else:
+                records = {}
+                for key, entry in entries.items():
+                    record = convert(entry)
+                    if record is not None:
+                        records[key] = record
+                return records
+        return self(json_codec.loads(raw))
+
+
+class IdSetParser:
+    """Turns a data file holding a JSON list of IDs into a frozenset of the IDs as strings"""
+
+    def __call__(self, data):
+        if not isinstance(data, list):
+            return frozenset()
+        return frozenset(str(item) for item in data)
+
+    def from_bytes(self, raw):
+        return self(json_codec.loads(raw))
+
+
+def _auto_delete_from_settings(data):
+    if not isinstance(data, dict):
+        return None
+    return _int_or_none(data.get("auto_delete"))
+
+
+# file_id -> FileRecord
+parse_files = RecordParser(FileRecord.from_dict, _FILE_SCHEMA)
+# batch_id -> BatchRecord
+parse_batches = RecordParser(BatchRecord.from_data, _BATCH_SCHEMA)
+# token -> TokenRecord
+parse_tokens = RecordParser(TokenRecord.from_dict, _TOKEN_SCHEMA)
+# Banned user IDs (banned_users.json), as strings
+parse_banned_users = IdSetParser()
+# chat_id -> auto-delete minutes, for groups that set one (group_settings.json)
+parse_auto_delete = RecordParser(_auto_delete_from_settings)
@@ -0,0 +1,97 @@
+import base64
+import hashlib
+import hmac
+import struct
+import time
+
+# Signed payload: scope user ID (0 = valid for any user) and expiry timestamp
+PAYLOAD = struct.Struct(">qI")
+# Truncated HMAC-SHA256; 128 bits is plenty for short-lived access tokens
+SIGNATURE_SIZE = 16
+
+
+def _sign(payload, secret):
+    return hmac.new(secret.encode(), payload, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+
+
+def sign_token(user_id, expiry, secret):
+    """Return a compact URL-safe token carrying the user scope and expiry
+
+    The result is 38 characters, so ``verify_<token>`` fits comfortably in
+    Telegram's 64 character /start parameter.
+    """
+    payload = PAYLOAD.pack(user_id, expiry)
+    raw = payload + _sign(payload, secret)
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def verify_signed_token(token, secret, now=None):
+    """Return (user_id, expiry) for a genuine, unexpired token, otherwise None"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except (ValueError, TypeError):
+        return None
+
+    if len(raw) != PAYLOAD.size + SIGNATURE_SIZE:
+        return None
+
+    payload, signature = raw[:PAYLOAD.size], raw[PAYLOAD.size:]
+    if not hmac.compare_digest(signature, _sign(payload, secret)):
+        return None
+
+    user_id, expiry = PAYLOAD.unpack(payload)
+    if expiry <= (time.time() if now is None else now):
+        return None
+    return user_id, expiry
+
+
+class VerifiedUsers:
+    """Map of users who redeemed a signed token, keyed by user ID
+
+    Lookups are served from memory; ``load`` and ``to_dict`` convert to and
+    from the stored form, ``{"<user_id>": expiry}``.
+    """
+
+    def __init__(self):
+        self._expiry = {}
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def grant(self, user_id, expiry):
+        if expiry > self._expiry.get(user_id, 0):
+            self._expiry[user_id] = expiry
+
+    def is_verified(self, user_id, now=None):
+        expiry = self._expiry.get(user_id)
+        if expiry is None:
+            return False
+        if expiry <= (time.time() if now is None else now):
+            del self._expiry[user_id]
+            return False
+        return True
+
+    def prune(self, now=None):
+        """Drop expired users and return how many were removed"""
+        now = time.time() if now is None else now
+        expired = [user_id for user_id, expiry in self._expiry.items() if expiry <= now]
+        for user_id in expired:
+            del self._expiry[user_id]
+        return len(expired)
+
+    def load(self, data, now=None):
+        """Grant the unexpired users of a stored map, skipping malformed entries, and return how many"""
+        now = time.time() if now is None else now
+        loaded = 0
+        for user_id, expiry in data.items() if isinstance(data, dict) else ():
+            try:
+                user_id, expiry = int(user_id), int(expiry)
+            except (TypeError, ValueError):
+                continue
+            if expiry > now:
+                self.grant(user_id, expiry)
+                loaded += 1
+        return loaded
+
+    def to_dict(self):
+        return {str(user_id): expiry for user_id, expiry in self._expiry.items()}
@@ -0,0 +1,188 @@
+"""SQLite storage for the data files, safe to share between bot processes.
+
+Each data file becomes one row of a WAL-mode database holding the same JSON
+document the file would, keyed by the file name, so callers use the
+JsonStore interface unchanged. WAL lets any number of processes read while
+one writes, and every group commit runs in one ``BEGIN IMMEDIATE``
+transaction: updates are read-modify-write under the database's write lock,
+so workers never lose each other's changes.
+"""
+import logging
+import os
+import sqlite3
+import tempfile
+import uuid
+
+import json_codec
+from json_store import GROUP_COMMIT_WINDOW, JsonStore, read_bytes
+
+# Seconds to wait for another process to release the write lock
+BUSY_TIMEOUT = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    name TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    revision TEXT NOT NULL
+)
+"""
+
+
+class SqliteStore(JsonStore):
+    """JsonStore backed by one SQLite database at ``path``
+
+    ``load_records`` caches parsed records by row revision, a random ID
+    written with every change, so a worker notices writes made by the others.
+    """
+
+    def __init__(self, path, commit_window=GROUP_COMMIT_WINDOW):
+        super().__init__(commit_window)
+        self.path = path
+        # Autocommit mode: group commits open their own transactions. The
+        # connection is only used on the I/O thread once the bot is running.
+        self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")  # Same durability as write_json's fsyncs
+        self._db.execute(_SCHEMA)
+
+    def read(self, path, default):
+        raw = self.read_raw(path)
+        if raw is None:
+            return default.copy()
+        try:
+            data = json_codec.loads(raw)
+        except json_codec.DECODE_ERRORS as e:
+            logging.error(f"Error decoding {path} in {self.path}: {e}")
+            return default.copy()
+        if not isinstance(data, type(default)):
+            return default.copy()
+        return data
+
+    def read_raw(self, path):
+        row = self._db.execute("SELECT data FROM documents WHERE name = ?", (path,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def write(self, path, data):
+        self._write_raw(path, json_codec.dumps(data))
+
+    def _write_raw(self, path, raw):
+        self._db.execute(
+            "INSERT INTO documents (name, data, revision) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET data = excluded.data, revision = excluded.revision",
+            (path, raw, uuid.uuid4().hex)
+        )
+
+    def exists(self, path):
+        return self._db.execute("SELECT 1 FROM documents WHERE name = ?", (path,)).fetchone() is not None
+
+    def size(self, path):
+        row = self._db.execute("SELECT length(data) FROM documents WHERE name = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    def _identity(self, path):
+        row = self._db.execute("SELECT revision FROM documents WHERE name = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    def _commit(self, pending):
+        results = {}
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            for path, (default, ops) in pending.items():
+                data, path_results = self._apply(self.read(path, default), ops)
+                if any(ok for ok, _ in path_results):
+                    self.write(path, data)
+                results[path] = path_results
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        return results
+
+    def import_files(self, paths, replace=False):
+        """Copy JSON data files into the database and return the paths imported
+
+        Files with a document already in the database are skipped unless
+        ``replace`` is set, so this is safe to run on every startup.
+        Missing and undecodable files are skipped.
+        """
+        imported = []
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            for path in paths:
+                if not replace and self.exists(path):
+                    continue
+                raw = read_bytes(path)
+                if raw is None:
+                    continue
+                try:
+                    data = json_codec.loads(raw)
+                except json_codec.DECODE_ERRORS as e:
+                    logging.error(f"Not importing {path}: {e}")
+                    continue
+                self.write(path, data)
+                imported.append(path)
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        if imported:
+            logging.info(f"Imported {', '.join(imported)} into {self.path}")
+        return imported
+
+    def copy_to(self, path, names=None):
+        """Write a consistent copy of the database to ``path``, replacing it atomically
+
+        With ``names`` the copy holds only those documents, so one bot sharing
+        the database with others (see tenants.py) can be backed up on its own.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".store.", suffix=".tmp", dir=directory)
+        os.close(fd)
+        try:
+            target = sqlite3.connect(tmp_path)
+            try:
+                self._db.backup(target)
+                if names is not None:
+                    target.execute(
+                        f"DELETE FROM documents WHERE name NOT IN ({', '.join('?' * len(names))})", list(names)
+                    )
+                    target.commit()
+            finally:
+                target.close()
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def copy_from(self, path, names=None):
+        """Replace the database contents with a copy written by copy_to
+
+        With ``names`` only those documents are restored and everything else
+        in the database is left alone. Other processes see the restored
+        documents on their next read.
+        """
+        source = sqlite3.connect(path)
+        try:
+            if names is None:
+                source.backup(self._db)
+                rows = None
+            else:
+                rows = source.execute(
+                    f"SELECT name, data FROM documents WHERE name IN ({', '.join('?' * len(names))})", list(names)
+                ).fetchall()
+        finally:
+            source.close()
+        if rows is not None:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for name, raw in rows:
+                    self._write_raw(name, raw)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        self._records.clear()
@@ -0,0 +1,162 @@
+"""Host several bots in one process, each with its own token, channels and data.
+
+Every bot (tenant) is a directory under TENANTS_DIR holding a ``.env`` with
+its BOT_TOKEN, DATABASE_CHANNEL, LINKS_CHANNEL and any other setting that
+differs from the shared ``.env`` next to bot.py. The tenant's data files,
+backups and persistence live in that directory too.
+
+bot.py is loaded once per tenant as a separate module with the tenant's
+settings in the environment, so configuration, caches, jobs and handler
+state stay per bot without any changes to the handlers. Whatever bot.py
+asks for through ``shared`` exists once for the whole process instead: the
+Bot API connection pool, the delivery rate limiter, the data store with its
+I/O thread and record caches, logging, tracing, metrics and the event-loop
+monitor. All the applications run on one event loop.
+
+Run ``python tenants.py``. bot.py on its own still runs a single bot.
+"""
+import asyncio
+import importlib.util
+import logging
+import os
+import signal
+import sys
+
+from dotenv import dotenv_values, load_dotenv
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+_shared = {}
+
+
+def shared(key, factory):
+    """Return the process-wide object for ``key``, creating it with ``factory()`` on first use
+
+    Every tenant in this process gets the same object; a bot running on its
+    own just gets the one it created.
+    """
+    if key not in _shared:
+        _shared[key] = factory()
+    return _shared[key]
+
+
+def discover(directory):
+    """Return {tenant name: tenant directory} for the subdirectories of ``directory`` with a .env file"""
+    tenants = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(os.path.join(path, ".env")):
+            tenants[name] = path
+    return tenants
+
+
+def load_tenant(name, directory, restart_notify_chat=None):
+    """Load bot.py as the module ``bot_<name>`` configured from the tenant's .env"""
+    env_file = os.path.join(directory, ".env")
+    settings = {key: value for key, value in dotenv_values(env_file).items() if value is not None}
+    if not settings.get("BOT_TOKEN"):
+        raise ValueError(f"{env_file} does not set BOT_TOKEN")
+    if settings.get("WORKER_PORT", os.getenv("WORKER_PORT", "0")) not in ("", "0"):
+        # Workers take their updates from dispatcher.py; tenants each poll Telegram on the shared loop
+        raise ValueError(f"WORKER_PORT can't be used with tenants ({env_file})")
+    settings.update(TENANT=name, DATA_DIR=directory, ENV_FILE=env_file)
+    if restart_notify_chat:
+        settings["RESTART_NOTIFY_CHAT"] = restart_notify_chat
+
+    # bot.py reads its configuration from the environment at import time,
+    # so apply the tenant's settings only while it is being imported
+    saved = {key: os.environ.get(key) for key in settings}
+    os.environ.update(settings)
+    try:
+        spec = importlib.util.spec_from_file_location(f"bot_{name}", BOT_SCRIPT)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    return module
+
+
+def run(bots):
+    """Run every tenant's application on one event loop until SIGTERM, SIGINT or stop_running()
+
+    Mirrors Application.run_polling for each bot, including the post_init,
+    post_stop and post_shutdown hooks. stop_running() from any bot (as
+    /restart does) stops them all. Shutdown waits until every bot has
+    stopped and finished its post_stop work, because the connection pool
+    they share closes with the first bot to shut down. What the bots share
+    through ``shared`` is stopped once, after they have all shut down.
+    """
+    applications = [bot.build_application() for bot in bots]
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, loop.stop)
+
+    initialized = []
+    try:
+        for bot, application in zip(bots, applications):
+            loop.run_until_complete(application.initialize())
+            initialized.append(application)
+            if application.post_init:
+                loop.run_until_complete(application.post_init(application))
+            loop.run_until_complete(application.updater.start_polling())
+            loop.run_until_complete(application.start())
+            logging.info(f"Tenant {bot.TENANT} is running as @{application.bot.username}")
+        loop.run_forever()
+    finally:
+        try:
+            for application in initialized:
+                if application.updater.running:
+                    loop.run_until_complete(application.updater.stop())
+            for application in initialized:
+                if application.running:
+                    loop.run_until_complete(application.stop())
+                    if application.post_stop:
+                        loop.run_until_complete(application.post_stop(application))
+            for application in initialized:
+                loop.run_until_complete(application.shutdown())
+                if application.post_shutdown:
+                    loop.run_until_complete(application.post_shutdown(application))
+            # The metrics endpoint, loop monitor, stores and tracing outlive any one bot
+            for bot in bots:
+                loop.run_until_complete(bot.shutdown_shared())
+        finally:
+            loop.close()
+
+
+def main():
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+    directory = os.getenv("TENANTS_DIR", "tenants")
+    tenants = discover(directory) if os.path.isdir(directory) else {}
+    if not tenants:
+        sys.exit(f"No tenants found: create {directory}/<name>/.env for each bot")
+
+    # Set by a /restart in the previous process as "<tenant>:<chat ID>"
+    notify_tenant, _, notify_chat = os.environ.pop("RESTART_NOTIFY_CHAT", "").rpartition(":")
+
+    bots = [
+        load_tenant(name, path, notify_chat if name == notify_tenant else None)
+        for name, path in tenants.items()
+    ]
+    tokens = [bot.TOKEN for bot in bots]
+    if len(set(tokens)) != len(tokens):
+        sys.exit("Each tenant needs its own BOT_TOKEN")
+
+    print(f"⚔️ TATAKAE x{len(bots)}")
+    run(bots)
+
+    for bot in bots:
+        if bot.restart_requested_by is not None:
+            bot.exec_restart()
+
+
+if __name__ == "__main__":
+    # bot.py imports this module as "tenants"; go through that copy so the
+    # tenants it loads share the same registry
+    import tenants
+    tenants.main()
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from backups import BackupStore
+
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_snapshot_and_restore(tmp_path):
+    files = str(tmp_path / "files.json")
+    tokens = str(tmp_path / "tokens.json")
+    write(files, '{"a": 1}')
+    write(tokens, '{"t": 2}')
+    store = BackupStore(str(tmp_path / "backups"))
+
+    snapshot_id, stored = store.snapshot([files, tokens, str(tmp_path / "missing.json")])
+    assert stored > 0
+    assert sorted(store.list_snapshots()[0][1]["files"]) == [files, tokens]
+
+    write(files, '{"a": 1, "b": 2}')
+    os.remove(tokens)
+    assert sorted(store.restore(snapshot_id)) == [files, tokens]
+    assert read(files) == '{"a": 1}'
+    assert read(tokens) == '{"t": 2}'
+
+
+def test_unchanged_files_are_not_stored_again(tmp_path):
+    files = str(tmp_path / "files.json")
+    tokens = str(tmp_path / "tokens.json")
+    write(files, "x" * 10000)
+    write(tokens, "{}")
+    store = BackupStore(str(tmp_path / "backups"))
+
+    store.snapshot([files, tokens])
+    write(tokens, '{"t": 1}')
+    _, stored = store.snapshot([files, tokens])
+    assert 0 < stored < 100
+    assert len(os.listdir(store.objects_dir)) == 3
+
+
+def test_restore_newest_and_selected_paths(tmp_path):
+    files = str(tmp_path / "files.json")
+    tokens = str(tmp_path / "tokens.json")
+    write(files, "1")
+    write(tokens, "1")
+    store = BackupStore(str(tmp_path / "backups"))
+    store.snapshot([files, tokens])
+    write(files, "2")
+    write(tokens, "2")
+    store.snapshot([files, tokens])
+    write(files, "3")
+    write(tokens, "3")
+
+    assert store.restore(paths=[files]) == [files]
+    assert read(files) == "2"
+    assert read(tokens) == "3"
+
+
+def test_retention_drops_old_snapshots_and_their_objects(tmp_path):
+    path = str(tmp_path / "files.json")
+    store = BackupStore(str(tmp_path / "backups"), keep=2)
+    for i in range(4):
+        write(path, str(i))
+        store.snapshot([path])
+
+    assert len(store.list_snapshots()) == 2
+    assert len(os.listdir(store.objects_dir)) == 2
+    store.restore()
+    assert read(path) == "3"
+
+
+def test_restore_unknown_snapshot(tmp_path):
+    store = BackupStore(str(tmp_path / "backups"))
+    with pytest.raises(FileNotFoundError):
+        store.restore()
+    with pytest.raises(FileNotFoundError):
+        store.restore("nope")
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from delivery_scheduler import DeliveryScheduler
+
+
+def test_users_are_served_round_robin():
+    async def run():
+        scheduler = DeliveryScheduler(global_limit=1, per_user_limit=1, user_interval=0)
+        order = []
+
+        def job(name):
+            async def send():
+                order.append(name)
+                await asyncio.sleep(0)
+            return send
+
+        futures = [scheduler.submit("batch", job(f"batch{i}")) for i in range(3)]
+        futures.append(scheduler.submit("single", job("single")))
+        await asyncio.gather(*futures)
+        await scheduler.stop()
+        return order
+
+    order = asyncio.run(run())
+    # The one-off request doesn't wait for the whole batch
+    assert order.index("single") < order.index("batch2")
+
+
+def test_job_results_and_errors_reach_the_submitter():
+    async def run():
+        scheduler = DeliveryScheduler(user_interval=0)
+
+        async def ok():
+            return 42
+
+        async def fail():
+            raise ValueError("boom")
+
+        result = await scheduler.deliver(1, ok)
+        with pytest.raises(ValueError):
+            await scheduler.deliver(1, fail)
+        assert await scheduler.drain(timeout=1)
+        await scheduler.stop()
+        return result
+
+    assert asyncio.run(run()) == 42
+
+
+def test_cancelled_job_cancels_its_future():
+    async def run():
+        scheduler = DeliveryScheduler(user_interval=0)
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.sleep(3600)
+
+        future = scheduler.submit(1, hang)
+        await started.wait()
+        for task in asyncio.all_tasks():
+            if task.get_coro().__name__ == "_run_job":
+                task.cancel()
+        await asyncio.gather(future, return_exceptions=True)
+        await scheduler.stop()
+        return future, scheduler.in_flight
+
+    future, in_flight = asyncio.run(run())
+    assert future.cancelled()
+    assert in_flight == 0
+
+
+def test_position_skips_users_that_cannot_start():
+    async def run():
+        scheduler = DeliveryScheduler(global_limit=1, per_user_limit=1, user_interval=60)
+        release = asyncio.Event()
+
+        async def wait():
+            await release.wait()
+
+        # User 1 takes the only slot and is then paced for a minute
+        scheduler.submit(1, wait)
+        scheduler.submit(1, wait)
+        scheduler.submit(2, wait)
+        scheduler.submit(3, wait)
+        positions = {user_id: scheduler.position(user_id) for user_id in (1, 2, 3, 4)}
+        release.set()
+        await scheduler.stop()
+        return positions
+
+    positions = asyncio.run(run())
+    # Users queue at the front of the ring: 3, 2, then the paced user 1
+    assert positions[3] == 1
+    assert positions[2] == 2
+    assert positions[1] == 3
+    assert positions[4] is None
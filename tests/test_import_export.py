@@ -0,0 +1,59 @@
+import io
+import json
+
+import pytest
+
+from import_export import import_export, iter_export_messages, message_text
+from link_records import format_file_record, pack_batch_messages
+
+FILE_POST = (
+    "🔗 File Link\n\nID: abc\nName: Movie\nType: video\nDate: 2025-01-01\nCaption: \n"
+    "Message ID: 42\n\nLink: https://t.me/bot?start=abc\n\n#file_abc"
+)
+
+
+def test_messages_are_read_across_small_reads():
+    messages = [{"id": i, "type": "message", "text": "x" * i + "]}\"["} for i in range(50)]
+    export = json.dumps({"name": "Links", "messages": messages}, indent=1)
+    assert list(iter_export_messages(io.StringIO(export), read_size=7)) == messages
+
+
+def test_empty_and_truncated_exports():
+    assert list(iter_export_messages(io.StringIO('{"messages": []}'))) == []
+    with pytest.raises(ValueError):
+        list(iter_export_messages(io.StringIO('{"chats": []}')))
+    with pytest.raises(ValueError):
+        list(iter_export_messages(io.StringIO('{"messages": [{"id": 1}, '), read_size=4))
+
+
+def test_message_text_joins_formatted_parts():
+    message = {"text": ["🔗 File Link\n\nID: ", {"type": "code", "text": "abc"}, "\n"]}
+    assert message_text(message) == "🔗 File Link\n\nID: abc\n"
+
+
+def test_import_merges_file_and_batch_posts(tmp_path):
+    records = [format_file_record(f"f{i}", i + 1, "document", "x" * 80) for i in range(100)]
+    posts = [FILE_POST] + pack_batch_messages("b1", "link", "2025-01-01", records)
+    export = tmp_path / "result.json"
+    export.write_text(json.dumps({"messages": (
+        [{"id": i + 1, "type": "message", "text": text} for i, text in enumerate(posts)]
+        + [{"id": 99, "type": "service", "action": "pin_message"}]
+    )}))
+    files_path = tmp_path / "files.json"
+    files_path.write_text(json.dumps({"abc": {"message_id": 7}}))
+    batches_path = tmp_path / "batches.json"
+
+    stats = import_export(str(export), str(files_path), str(batches_path))
+    assert stats == {"messages": len(posts) + 1, "records": len(posts), "files_added": 100, "batches_added": 1}
+    files = json.loads(files_path.read_text())
+    assert files["abc"] == {"message_id": 7}
+    assert files["f0"]["links_channel_msg_id"] == 2
+    assert json.loads(batches_path.read_text())["b1"]["total_files"] == 100
+
+
+def test_dry_run_writes_nothing(tmp_path):
+    export = tmp_path / "result.json"
+    export.write_text(json.dumps({"messages": [{"id": 1, "type": "message", "text": FILE_POST}]}))
+    stats = import_export(str(export), str(tmp_path / "files.json"), str(tmp_path / "batches.json"), dry_run=True)
+    assert stats["files_added"] == 1
+    assert not (tmp_path / "files.json").exists()
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from ingestion import IngestionQueue, is_transient
+
+
+def test_transient_errors():
+    assert is_transient(RetryAfter(1))
+    assert is_transient(NetworkError("timed out"))
+    assert not is_transient(BadRequest("message not found"))
+    assert not is_transient(ValueError())
+
+
+def test_records_are_persisted_in_groups_and_retried():
+    persisted = []
+    attempts = {}
+
+    async def process(job, final_attempt):
+        attempts[job.job_id] = attempts.get(job.job_id, 0) + 1
+        if job.job_id == "flaky" and attempts["flaky"] == 1:
+            raise RetryAfter(0)
+        return {"id": job.job_id}
+
+    def persist(records):
+        persisted.append([record["id"] for record in records])
+
+    async def run():
+        queue = IngestionQueue(process, persist, workers=4)
+        jobs = [queue.submit(job_id, 1, None, {}) for job_id in ("a", "b", "flaky")]
+        results = await asyncio.gather(*(job.future for job in jobs))
+        await queue.stop()
+        return results
+
+    assert asyncio.run(run()) == [{"id": "a"}, {"id": "b"}, {"id": "flaky"}]
+    assert attempts["flaky"] == 2
+    assert sorted(job_id for group in persisted for job_id in group) == ["a", "b", "flaky"]
+    assert len(persisted) < 3
+
+
+def test_failed_job_is_reported_once():
+    failures = []
+    reports = []
+
+    async def process(job, final_attempt):
+        raise BadRequest("chat not found")
+
+    async def on_failure(job, error):
+        failures.append((job.job_id, str(error)))
+
+    async def report(bot, chat_id, status):
+        reports.append(dict(status))
+
+    async def run():
+        queue = IngestionQueue(process, lambda records: None, report=report, on_failure=on_failure)
+        job = queue.submit("a", 1, None, {}, ids=["a1", "a2"])
+        with pytest.raises(BadRequest):
+            await job.future
+        await queue.stop()
+        return job
+
+    job = asyncio.run(run())
+    assert job.attempts == 1
+    assert failures == [("a", "chat not found")]
+    assert reports[-1]["failed"] == 2
+    assert reports[-1]["queued"] == 0
+
+
+def test_records_that_fail_to_persist_are_kept_and_retried():
+    persisted = []
+    failures = []
+    store_down = True
+
+    async def process(job, final_attempt):
+        return job.job_id
+
+    def persist(records):
+        if store_down:
+            raise OSError("disk full")
+        persisted.extend(records)
+
+    async def on_failure(job, error):
+        failures.append((job.job_id, job.record))
+
+    async def run():
+        nonlocal store_down
+        queue = IngestionQueue(process, persist, max_attempts=2, on_failure=on_failure, persist_retry_interval=0.05)
+        job = queue.submit("a", 1, None, {})
+        started = asyncio.get_running_loop().time()
+        with pytest.raises(OSError):
+            await job.future
+        # One backoff between the two attempts, none after the last
+        elapsed = asyncio.get_running_loop().time() - started
+        assert queue.unpersisted == ["a"]
+
+        store_down = False
+        for _ in range(100):
+            if persisted:
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return elapsed, queue.unpersisted
+
+    elapsed, unpersisted = asyncio.run(run())
+    assert elapsed < 3
+    assert failures == [("a", "a")]
+    assert persisted == ["a"]
+    assert unpersisted == []
@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+
+import json_store
+from json_store import JsonStore, read_json
+from records import parse_banned_users
+
+
+def test_concurrent_updates_share_one_commit(tmp_path, monkeypatch):
+    path = str(tmp_path / "counts.json")
+    writes = []
+    write_json = json_store.write_json
+    monkeypatch.setattr(json_store, "write_json", lambda *args, **kwargs: (writes.append(args[0]), write_json(*args, **kwargs)))
+
+    def increment(data):
+        data["count"] = data.get("count", 0) + 1
+        return data["count"]
+
+    async def run():
+        store = JsonStore()
+        results = await asyncio.gather(*(store.update(path, increment, {}) for _ in range(50)))
+        await store.drain()
+        return results
+
+    assert sorted(asyncio.run(run())) == list(range(1, 51))
+    assert read_json(path, {}) == {"count": 50}
+    assert writes == [path]
+
+
+def test_failed_update_only_fails_its_caller(tmp_path):
+    path = str(tmp_path / "data.json")
+
+    def fail(data):
+        raise KeyError("missing")
+
+    async def run():
+        store = JsonStore()
+        return await asyncio.gather(
+            store.update(path, lambda data: data.update(a=1), {}),
+            store.update(path, fail, {}),
+            store.update(path, lambda data: data.update(b=2), {}),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert isinstance(results[1], KeyError)
+    assert read_json(path, {}) == {"a": 1, "b": 2}
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "banned.json")
+
+    async def run():
+        store = JsonStore()
+        missing = await store.load(path, [])
+        await store.save(path, [1, 2])
+        return missing, await store.load(path, [])
+
+    assert asyncio.run(run()) == ([], [1, 2])
+
+
+def test_wrong_type_loads_as_default(tmp_path):
+    path = tmp_path / "data.json"
+    path.write_text("[1, 2]")
+    assert read_json(str(path), {}) == {}
+
+
+def test_default_is_not_shared(tmp_path):
+    default = {}
+    data = read_json(str(tmp_path / "missing.json"), default)
+    data["a"] = 1
+    assert default == {}
+
+
+def test_failed_write_keeps_old_contents(tmp_path, monkeypatch):
+    path = tmp_path / "data.json"
+    json_store.write_json(str(path), {"a": 1})
+
+    def crash(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(json_store.os, "replace", crash)
+    with pytest.raises(OSError):
+        json_store.write_json(str(path), {"a": 2})
+    assert read_json(str(path), {}) == {"a": 1}
+    assert [p.name for p in tmp_path.iterdir()] == ["data.json"]
+
+
+def test_failed_commit_fails_every_update_and_keeps_old_contents(tmp_path, monkeypatch):
+    path = str(tmp_path / "data.json")
+    json_store.write_json(path, {"a": 1})
+
+    def crash(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(json_store, "write_json", crash)
+
+    async def run():
+        store = JsonStore()
+        return await asyncio.gather(
+            store.update(path, lambda data: data.update(b=2), {}),
+            store.update(path, lambda data: data.update(c=3), {}),
+            return_exceptions=True
+        )
+
+    assert all(isinstance(result, OSError) for result in asyncio.run(run()))
+    assert read_json(path, {}) == {"a": 1}
+
+
+def test_write_keeps_file_mode(tmp_path):
+    path = tmp_path / "data.json"
+    json_store.write_json(str(path), {})
+    path.chmod(0o600)
+    json_store.write_json(str(path), {"a": 1})
+    assert path.stat().st_mode & 0o777 == 0o600
+
+
+@pytest.mark.parametrize("contents", ["{not json", ""])
+def test_corrupt_file_is_kept_aside(tmp_path, contents):
+    path = tmp_path / "data.json"
+    path.write_text(contents)
+    assert read_json(str(path), {}) == {}
+    copies = [p for p in tmp_path.iterdir() if p.name.startswith("data.json.corrupt-")]
+    assert len(copies) == 1
+    assert copies[0].read_text() == contents
+
+
+def test_codec_round_trip(tmp_path):
+    path = str(tmp_path / "data.json")
+    data = {"name": "Mikasa ⚔️", "ids": [1, 2], "nested": {"ok": True, "none": None}}
+    json_store.write_json(path, data)
+    assert read_json(path, {}) == data
+
+
+def test_load_records_follows_rewrites(tmp_path):
+    path = str(tmp_path / "banned_users.json")
+    store = JsonStore()
+
+    async def run():
+        await store.save(path, [1])
+        first = await store.load_records(path, parse_banned_users)
+        cached = await store.load_records(path, parse_banned_users)
+        await store.update(path, lambda banned: banned.append(2), [])
+        return first, cached, await store.load_records(path, parse_banned_users)
+
+    first, cached, changed = asyncio.run(run())
+    assert cached is first
+    assert changed == {"1", "2"}
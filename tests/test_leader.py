@@ -0,0 +1,17 @@
+from leader import LeaderLease
+
+
+def test_only_one_holder_at_a_time(tmp_path):
+    path = str(tmp_path / "leader.lock")
+    first = LeaderLease(path)
+    second = LeaderLease(path)
+
+    assert first.acquire()
+    assert first.acquire()
+    assert not second.acquire()
+    assert not second.held
+
+    first.release()
+    assert not first.held
+    assert second.acquire()
+    second.release()
@@ -0,0 +1,148 @@
+import asyncio
+
+from link_records import (
+    MAX_MESSAGE_LENGTH, format_file_record, merge_link_message, pack_batch_messages, parse_file_record,
+    parse_link_message, read_batch_files
+)
+
+
+def make_records(count, name_length=60):
+    return [format_file_record(f"file{i:04d}", i + 1, "document", f"name {i} " + "x" * name_length) for i in range(count)]
+
+
+def test_file_record_round_trip():
+    line = format_file_record("abc", 17, "video", "a|b\nc")
+    assert parse_file_record(line) == {"file_id": "abc", "message_id": 17, "media_type": "video", "custom_name": "a|b c"}
+
+
+def test_file_record_rejects_other_lines():
+    assert parse_file_record("ID: abc") is None
+    assert parse_file_record("F|abc|notanumber|video|name") is None
+    assert parse_file_record("F|abc|1") is None
+
+
+def test_unnamed_file_record():
+    assert parse_file_record(format_file_record("abc", 1, None, None))["custom_name"] is None
+
+
+def test_batch_round_trip_across_parts():
+    records = make_records(150)
+    messages = pack_batch_messages("b1", "https://t.me/bot?start=b1", "2025-01-01", records)
+    assert len(messages) > 1
+    assert all(len(message) <= MAX_MESSAGE_LENGTH for message in messages)
+
+    file_ids = []
+    for part, message in enumerate(messages, 1):
+        parsed = parse_link_message(message)
+        batch = parsed["batch"]
+        assert (batch["batch_id"], batch["part"], batch["parts"]) == ("b1", part, len(messages))
+        assert batch["date"] == "2025-01-01"
+        assert list(parsed["files"]) == batch["files"]
+        file_ids.extend(batch["files"])
+    assert file_ids == [f"file{i:04d}" for i in range(150)]
+
+
+def test_batch_parts_carry_search_tags():
+    messages = pack_batch_messages("b1", "link", "2025-01-01", make_records(150))
+    for message in messages:
+        file_ids = parse_link_message(message)["batch"]["files"]
+        assert message.endswith("#batch_files_" + ",".join(file_ids))
+        for file_id in file_ids:
+            assert f"#file_{file_id}" in message
+
+
+def test_long_name_is_truncated_to_fit():
+    messages = pack_batch_messages("b1", "link", "", make_records(1, name_length=10000))
+    assert len(messages) == 1
+    assert len(messages[0]) <= MAX_MESSAGE_LENGTH
+    assert list(parse_link_message(messages[0])["files"]) == ["file0000"]
+
+
+def test_file_link_post():
+    text = (
+        "🔗 File Link\n\n"
+        "ID: abc\n"
+        "Name: Unnamed file\n"
+        "Type: photo\n"
+        "Date: 2025-01-01 10:00:00\n"
+        "Caption: two\nlines\n"
+        "Message ID: 42\n\n"
+        "Link: https://t.me/bot?start=abc\n\n"
+        "#file_abc"
+    )
+    assert parse_link_message(text) == {
+        "files": {"abc": {
+            "message_id": 42,
+            "custom_name": None,
+            "media_type": "photo",
+            "caption": "two\nlines",
+            "date": "2025-01-01 10:00:00",
+            "file_link": "https://t.me/bot?start=abc"
+        }},
+        "batch": None
+    }
+
+
+def test_older_batch_post_with_tagged_files_only():
+    text = "🔗 Batch Link (contains 2 files)\n\nID: b1\nDate: 2025-01-01\n\n#batch_b1\n#batch_files_f1,f2"
+    parsed = parse_link_message(text)
+    assert parsed["files"] == {}
+    assert parsed["batch"]["files"] == ["f1", "f2"]
+    assert (parsed["batch"]["part"], parsed["batch"]["parts"]) == (1, 1)
+
+
+def test_other_messages_are_ignored():
+    assert parse_link_message(None) is None
+    assert parse_link_message("hello") is None
+    assert parse_link_message("🔗 File Link\n\nName: no id") is None
+
+
+def test_merge_assembles_multi_part_batch():
+    messages = pack_batch_messages("b1", "link", "2025-01-01", make_records(150))
+    files, batches, assembling = {}, {}, set()
+    added = [merge_link_message(parse_link_message(message), 100 + i, files, batches, assembling)
+             for i, message in enumerate(messages)]
+
+    assert sum(files_added for files_added, _ in added) == 150
+    assert sum(batches_added for _, batches_added in added) == 1
+    assert batches["b1"]["files"] == [f"file{i:04d}" for i in range(150)]
+    assert batches["b1"]["total_files"] == 150
+    assert batches["b1"]["links_channel_msg_id"] == 100
+    assert files["file0149"]["links_channel_msg_id"] == 100 + len(messages) - 1
+    # A batch stops assembling with its last part
+    assert assembling == set()
+
+
+def test_merge_leaves_existing_records_alone():
+    messages = pack_batch_messages("b1", "link", "2025-01-01", make_records(150))
+    files = {"file0000": {"message_id": 999}}
+    batches = {"b1": {"files": ["old"], "total_files": 1}}
+    assembling = set()
+    for i, message in enumerate(messages):
+        merge_link_message(parse_link_message(message), i, files, batches, assembling)
+    assert files["file0000"] == {"message_id": 999}
+    assert batches["b1"]["files"] == ["old"]
+
+
+def test_merge_does_not_change_the_parsed_message():
+    parsed = parse_link_message(pack_batch_messages("b1", "link", "", make_records(1))[0])
+    merge_link_message(parsed, 5, {}, {}, set())
+    assert "links_channel_msg_id" not in parsed["files"]["file0000"]
+
+
+def test_packed_batch_files_are_read_back():
+    messages = pack_batch_messages("b1", "https://t.me/bot?start=b1", "2025-01-01", make_records(150))
+    # An unrelated post lands between the parts, and a deleted message leaves a gap
+    channel = {100: messages[0], 101: "🔗 File Link\n\nID: other\nMessage ID: 9", 103: messages[1]}
+    channel.update({104 + i: text for i, text in enumerate(messages[2:])})
+    reads = []
+
+    async def read_text(message_id):
+        reads.append(message_id)
+        return channel.get(message_id)
+
+    files = asyncio.run(read_batch_files(read_text, "b1", 100))
+    assert len(files) == 150
+    assert files["file0149"]["message_id"] == 150
+    assert "other" not in files
+    assert reads[-1] == max(channel)
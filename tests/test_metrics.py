@@ -0,0 +1,56 @@
+import threading
+
+from metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    counter = registry.register(Counter("errors_total", "Errors", ["handler"]))
+    counter.inc(handler='a\\b"c\nd')
+    assert 'errors_total{handler="a\\\\b\\"c\\nd"} 1' in registry.render().splitlines()
+
+
+def test_gauge_keeps_the_last_value():
+    registry = Registry()
+    gauge = registry.register(Gauge("file_bytes", "Size", ["file"]))
+    gauge.set(100, file="a.json")
+    gauge.set(40, file="a.json")
+    assert gauge.get(file="a.json") == 40
+    assert gauge.get(file="b.json") == 0
+    assert "# TYPE file_bytes gauge" in registry.render()
+    assert 'file_bytes{file="a.json"} 40' in registry.render().splitlines()
+
+
+def test_histogram_samples_are_cumulative():
+    histogram = Histogram("seconds", "Time", ["op"], buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value, op="read")
+    samples = {(name, labels): value for name, labels, value in histogram.samples()}
+    assert samples[("seconds_bucket", '{op="read",le="0.1"}')] == 1
+    assert samples[("seconds_bucket", '{op="read",le="1"}')] == 3
+    assert samples[("seconds_bucket", '{op="read",le="+Inf"}')] == 4
+    assert samples[("seconds_count", '{op="read"}')] == 4
+    assert samples[("seconds_sum", '{op="read"}')] == 6.05
+    assert histogram.count(op="read") == 4
+    assert histogram.count(op="write") == 0
+    assert histogram.quantile(0.5, op="read") == 0.55
+    assert histogram.quantile(0.5, op="write") is None
+
+
+def test_recording_from_threads_loses_nothing():
+    counter = Counter("calls_total", "Calls", ["op"])
+    histogram = Histogram("seconds", "Time", ["op"])
+
+    def record():
+        for i in range(2000):
+            counter.inc(op=i % 3)
+            histogram.observe(0.01, op=i % 3)
+            list(histogram.samples())
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(counter.values.values()) == 8000
+    assert sum(histogram.count(op=op) for op in range(3)) == 8000
@@ -0,0 +1,72 @@
+import json_codec
+from records import (
+    BatchRecord, FileRecord, TokenRecord, parse_auto_delete, parse_banned_users, parse_batches, parse_files,
+    parse_tokens
+)
+
+
+def test_files_keep_valid_entries_and_drop_malformed_ones():
+    raw = json_codec.dumps({
+        "a": {"message_id": 5, "custom_name": "Name", "media_type": "video", "links_channel_msg_id": "9"},
+        "b": {"message_id": None},
+        "c": {"message_id": "oops"},
+        "d": "not a record",
+        "e": {"message_id": 7, "custom_name": None, "caption": 3}
+    })
+    files = parse_files.from_bytes(raw)
+    assert sorted(files) == ["a", "e"]
+    assert files["a"].custom_name == "Name"
+    assert files["a"].links_channel_msg_id == 9
+    assert files["e"].custom_name == ""
+    assert files["e"].caption == ""
+    assert files["e"].media_type == "unknown"
+
+
+def test_file_record_round_trip():
+    record = FileRecord.from_dict({"message_id": 5, "custom_name": "x", "file_unique_id": "u"})
+    assert FileRecord.from_dict(record.to_dict()).to_dict() == record.to_dict()
+
+
+def test_batches_load_from_both_shapes():
+    raw = json_codec.dumps({
+        "old": ["f1", "f2"],
+        "new": {"files": ["f3"], "date": "2025-01-01", "total_files": 1, "links_channel_msg_id": 4},
+        "empty": [],
+        "broken": {"files": "f4"}
+    })
+    batches = parse_batches.from_bytes(raw)
+    assert sorted(batches) == ["new", "old"]
+    assert batches["old"].files == ("f1", "f2")
+    assert batches["old"].total_files == 2
+    assert batches["new"].to_dict() == {"files": ["f3"], "date": "2025-01-01", "total_files": 1, "links_channel_msg_id": 4}
+
+
+def test_batch_record_ignores_other_data():
+    assert BatchRecord.from_data("f1") is None
+
+
+def test_tokens():
+    raw = json_codec.dumps({
+        "t1": {"user_id": 0, "expiry": 2000},
+        "t2": {"user_id": 1},
+        "t3": {"user_id": "x", "expiry": 2000}
+    })
+    tokens = parse_tokens.from_bytes(raw)
+    assert list(tokens) == ["t1"]
+    assert tokens["t1"].to_dict() == {"user_id": 0, "expiry": 2000}
+    assert TokenRecord.from_dict(None) is None
+
+
+def test_non_dict_file_loads_as_empty():
+    assert parse_files.from_bytes(b"[1, 2]") == {}
+
+
+def test_banned_users_are_matched_as_strings():
+    banned = parse_banned_users.from_bytes(json_codec.dumps([5, "7"]))
+    assert banned == {"5", "7"}
+    assert parse_banned_users({}) == frozenset()
+
+
+def test_auto_delete_keeps_groups_that_set_it():
+    raw = json_codec.dumps({"-1": {"auto_delete": 0}, "-2": {"auto_delete": "15"}, "-3": {}, "-4": None})
+    assert parse_auto_delete.from_bytes(raw) == {"-1": 0, "-2": 15}
@@ -0,0 +1,54 @@
+from signed_tokens import VerifiedUsers, sign_token, verify_signed_token
+
+SECRET = "test-secret"
+
+
+def test_round_trip():
+    token = sign_token(12345, 2000000000, SECRET)
+    assert len(token) == 38
+    assert verify_signed_token(token, SECRET, now=1000) == (12345, 2000000000)
+
+
+def test_any_user_scope_round_trips():
+    assert verify_signed_token(sign_token(0, 2000, SECRET), SECRET, now=1000) == (0, 2000)
+
+
+def test_expired_token_is_rejected():
+    token = sign_token(1, 2000, SECRET)
+    assert verify_signed_token(token, SECRET, now=2000) is None
+
+
+def test_wrong_secret_is_rejected():
+    assert verify_signed_token(sign_token(1, 2000, SECRET), "other", now=1000) is None
+
+
+def test_tampered_token_is_rejected():
+    token = sign_token(1, 2000, SECRET)
+    tampered = ("B" if token[0] == "A" else "A") + token[1:]
+    assert verify_signed_token(tampered, SECRET, now=1000) is None
+
+
+def test_malformed_tokens_are_rejected():
+    for token in ("", "abc", "!!!!", "A" * 38, sign_token(1, 2000, SECRET)[:-2]):
+        assert verify_signed_token(token, SECRET, now=1000) is None
+
+
+def test_verified_users_expire():
+    users = VerifiedUsers()
+    users.grant(1, 2000)
+    users.grant(1, 1500)  # An older grant doesn't shorten access
+    users.grant(2, 1200)
+    assert users.is_verified(1, now=1800)
+    assert not users.is_verified(3, now=1000)
+    assert users.prune(now=1300) == 1
+    assert len(users) == 1
+    assert not users.is_verified(1, now=2000)
+
+
+def test_verified_users_load_skips_expired_and_malformed():
+    users = VerifiedUsers()
+    loaded = users.load({"1": 2000, "2": 1000, "x": 2000, "3": None}, now=1500)
+    assert loaded == 1
+    assert users.to_dict() == {"1": 2000}
+    assert users.is_verified(1, now=1500)
+    assert not users.is_verified(2, now=1500)
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import threading
+
+from records import parse_files
+from sqlite_store import SqliteStore
+
+
+def test_update_load_and_load_records(tmp_path):
+    store = SqliteStore(str(tmp_path / "store.sqlite3"))
+
+    async def run():
+        await store.update("files.json", lambda files: files.update(a={"message_id": 1}), {})
+        first = await store.load_records("files.json", parse_files)
+        cached = await store.load_records("files.json", parse_files)
+        await store.update("files.json", lambda files: files.update(b={"message_id": 2}), {})
+        changed = await store.load_records("files.json", parse_files)
+        return await store.load("files.json", {}), first is cached, sorted(changed)
+
+    data, reused, changed = asyncio.run(run())
+    assert data == {"a": {"message_id": 1}, "b": {"message_id": 2}}
+    assert reused
+    assert changed == ["a", "b"]
+
+
+def test_transform_replaces_document(tmp_path):
+    store = SqliteStore(str(tmp_path / "store.sqlite3"))
+
+    async def run():
+        await store.save("tokens.json", {"a": 1, "b": 0})
+        removed = await store.transform("tokens.json", lambda tokens: ({k: v for k, v in tokens.items() if v}, 1), {})
+        return removed, await store.load("tokens.json", {})
+
+    assert asyncio.run(run()) == (1, {"a": 1})
+
+
+def test_stores_sharing_a_database_lose_no_updates(tmp_path):
+    # Each store stands in for a worker process with its own connection
+    path = str(tmp_path / "store.sqlite3")
+    stores = [SqliteStore(path) for _ in range(4)]
+
+    def increment(data):
+        data["count"] = data.get("count", 0) + 1
+
+    def worker(store):
+        async def run():
+            for _ in range(25):
+                await store.update("stats.json", increment, {})
+        asyncio.run(run())
+
+    threads = [threading.Thread(target=worker, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert SqliteStore(path).read("stats.json", {}) == {"count": 100}
+
+
+def test_failed_commit_rolls_back(tmp_path):
+    store = SqliteStore(str(tmp_path / "store.sqlite3"))
+    store.write("a.json", {"v": 1})
+    store.write("b.json", {"v": 1})
+    write = store.write
+
+    def crash(path, data):
+        if path == "b.json":
+            raise OSError("disk full")
+        write(path, data)
+
+    store.write = crash
+
+    async def run():
+        return await asyncio.gather(
+            store.update("a.json", lambda data: data.update(v=2), {}),
+            store.update("b.json", lambda data: data.update(v=2), {}),
+            return_exceptions=True
+        )
+
+    assert all(isinstance(result, OSError) for result in asyncio.run(run()))
+    assert store.read("a.json", {}) == {"v": 1}
+    assert store.read("b.json", {}) == {"v": 1}
+
+
+def test_import_files_skips_existing_documents(tmp_path):
+    files = tmp_path / "files.json"
+    files.write_text(json.dumps({"a": 1}))
+    broken = tmp_path / "broken.json"
+    broken.write_text("{not json")
+    store = SqliteStore(str(tmp_path / "store.sqlite3"))
+
+    assert store.import_files([str(files), str(broken), str(tmp_path / "missing.json")]) == [str(files)]
+    files.write_text(json.dumps({"a": 2}))
+    assert store.import_files([str(files)]) == []
+    assert store.read(str(files), {}) == {"a": 1}
+
+
+def test_copy_to_and_copy_from(tmp_path):
+    store = SqliteStore(str(tmp_path / "store.sqlite3"))
+    store.write("files.json", {"a": 1})
+    backup = str(tmp_path / "backup" / "store.sqlite3")
+    store.copy_to(backup)
+
+    store.write("files.json", {"a": 2})
+    store.write("new.json", {})
+    store.copy_from(backup)
+    assert store.read("files.json", {}) == {"a": 1}
+    assert not store.exists("new.json")
+
+
+def test_copy_and_restore_one_bots_documents(tmp_path):
+    store = SqliteStore(str(tmp_path / "store.sqlite3"))
+    store.write("a/files.json", {"v": 1})
+    store.write("b/files.json", {"v": 1})
+    backup = str(tmp_path / "a.sqlite3")
+    store.copy_to(backup, names=["a/files.json"])
+
+    store.write("a/files.json", {"v": 2})
+    store.write("b/files.json", {"v": 2})
+    store.copy_from(backup, names=["a/files.json"])
+    assert store.read("a/files.json", {}) == {"v": 1}
+    assert store.read("b/files.json", {}) == {"v": 2}
@@ -0,0 +1,34 @@
+import pytest
+
+import tenants
+
+
+def test_shared_creates_each_object_once():
+    created = []
+
+    def factory():
+        created.append(object())
+        return created[-1]
+
+    first = tenants.shared(("test", "shared"), factory)
+    assert tenants.shared(("test", "shared"), factory) is first
+    assert len(created) == 1
+
+
+def test_discover_finds_directories_with_an_env_file(tmp_path):
+    for name in ("b", "a", "empty"):
+        (tmp_path / name).mkdir()
+    (tmp_path / "a" / ".env").write_text("BOT_TOKEN=1:a\n")
+    (tmp_path / "b" / ".env").write_text("BOT_TOKEN=2:b\n")
+    assert tenants.discover(str(tmp_path)) == {"a": str(tmp_path / "a"), "b": str(tmp_path / "b")}
+
+
+def test_load_tenant_rejects_missing_token_and_worker_port(tmp_path, monkeypatch):
+    monkeypatch.delenv("WORKER_PORT", raising=False)
+    (tmp_path / ".env").write_text("DATABASE_CHANNEL=-1001\n")
+    with pytest.raises(ValueError, match="BOT_TOKEN"):
+        tenants.load_tenant("a", str(tmp_path))
+
+    (tmp_path / ".env").write_text("BOT_TOKEN=1:a\nWORKER_PORT=9000\n")
+    with pytest.raises(ValueError, match="WORKER_PORT"):
+        tenants.load_tenant("a", str(tmp_path))
@@ -0,0 +1,262 @@
+"""Opt-in per-update tracing.
+
+``trace_handler`` opens a root span for each update a handler processes, and
+``span`` / ``traced`` add child spans for the stages inside it (Bot API
+calls, data file I/O, token checks...). The current span is kept in a
+context variable, so it follows the update through awaits and into tasks it
+creates; work handed to a scheduler's own tasks can be attached with
+``bind``.
+
+Finished spans are exported on a background thread, either as JSON lines to
+a local file or as OTLP/JSON to a collector. Without an exporter configured
+every call here is a no-op.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+EXPORT_BATCH_SIZE = 512
+EXPORT_INTERVAL = 1.0  # Seconds a finished span may wait before it is exported
+
+_current = contextvars.ContextVar("current_span", default=None)
+_exporter = None
+
+
+class Span:
+    """One timed stage of a trace"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_ns / 1e9,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+
+class _BackgroundExporter:
+    """Collects finished spans and hands them to ``write`` in batches on a daemon thread"""
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+        self._thread.start()
+
+    def export(self, span):
+        self._queue.put(span)
+
+    def close(self, timeout=5):
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        closing = False
+        while not closing:
+            batch = []
+            deadline = time.monotonic() + EXPORT_INTERVAL
+            while len(batch) < EXPORT_BATCH_SIZE:
+                try:
+                    span = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if span is None:
+                    closing = True
+                    break
+                batch.append(span)
+            if batch:
+                try:
+                    self.write(batch)
+                except Exception as e:
+                    logging.warning(f"Dropped {len(batch)} trace spans: {e}")
+
+    def write(self, spans):
+        raise NotImplementedError
+
+
+class JsonlExporter(_BackgroundExporter):
+    """Appends one JSON object per span to a local file"""
+
+    def __init__(self, path):
+        self.path = path
+        super().__init__()
+
+    def write(self, spans):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+
+class OtlpExporter(_BackgroundExporter):
+    """POSTs spans as OTLP/JSON to a collector's /v1/traces endpoint"""
+
+    def __init__(self, url, service_name="checkmate-bot"):
+        self.url = url
+        self.service_name = service_name
+        super().__init__()
+
+    def write(self, spans):
+        body = {"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", self.service_name)]},
+            "scopeSpans": [{"scope": {"name": "bot"}, "spans": [_otlp_span(span) for span in spans]}]
+        }]}
+        request = urllib.request.Request(
+            self.url, data=json.dumps(body, default=str).encode(),
+            headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=10) as response:
+            response.read()
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _otlp_span(span):
+    otlp = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [_otlp_attribute(key, value) for key, value in span.attributes.items()],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1}
+    }
+    if span.parent_id:
+        otlp["parentSpanId"] = span.parent_id
+    return otlp
+
+
+def configure(spec):
+    """Start exporting spans
+
+    ``spec`` is "jsonl:<path>", "otlp:<collector URL>" or empty to disable
+    tracing.
+    """
+    global _exporter
+    if _exporter:
+        _exporter.close()
+        _exporter = None
+    if not spec:
+        return
+    kind, _, target = spec.partition(":")
+    if kind == "jsonl":
+        _exporter = JsonlExporter(target or "traces.jsonl")
+    elif kind == "otlp":
+        _exporter = OtlpExporter(target or "http://127.0.0.1:4318/v1/traces")
+    else:
+        logging.warning(f"Unknown trace exporter {spec!r}, tracing disabled")
+        return
+    logging.info(f"Tracing enabled, exporting to {spec}")
+
+
+def enabled():
+    return _exporter is not None
+
+
+def shutdown():
+    """Export any remaining spans and stop the exporter"""
+    configure("")
+
+
+@contextmanager
+def span(name, root=False, **attributes):
+    """Time a ``with`` block as a child of the current span
+
+    Outside a trace this does nothing unless ``root`` is set, so stages shared
+    with background jobs only show up when an update is being traced.
+    """
+    parent = _current.get()
+    if _exporter is None or (parent is None and not root):
+        yield None
+        return
+    current = Span(name, parent.trace_id if parent else os.urandom(16).hex(),
+                   parent.span_id if parent else None, attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        current.end_ns = time.time_ns()
+        exporter = _exporter
+        if exporter:
+            exporter.export(current)
+
+
+def traced(name):
+    """Decorate an async function so each call is a child span named ``name``"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(factory):
+    """Return ``factory`` wrapped to run under the current span, wherever it is awaited"""
+    parent = _current.get()
+    if parent is None:
+        return factory
+
+    async def run():
+        token = _current.set(parent)
+        try:
+            return await factory()
+        finally:
+            _current.reset(token)
+    return run
+
+
+def trace_handler(name, callback):
+    """Wrap an update handler so every update it handles opens a new trace"""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        if _exporter is None:
+            return await callback(update, context)
+        attributes = {"handler": name, "update_id": getattr(update, "update_id", None)}
+        user = getattr(update, "effective_user", None)
+        chat = getattr(update, "effective_chat", None)
+        if user:
+            attributes["user_id"] = user.id
+        if chat:
+            attributes["chat_id"] = chat.id
+        with span(f"update.{name}", root=True, **attributes):
+            return await callback(update, context)
+    return wrapper